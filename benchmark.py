@@ -0,0 +1,277 @@
+import kagome_lattice
+import reactivityModifier
+import lattice
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import contextlib
+import multiprocessing
+import concurrent.futures
+import numpy as np
+
+# lattice sizes of the default suite
+SIZES = (100, 200, 500, 1000, 2000)
+# width of the rhombs in pixel for the lattices which are drawn
+LATTICEWIDTH = 4
+nan = float('nan')
+# representative rule sets by name
+RULESETS = {"uniform": [],
+            "growth": [reactivityModifier.ReactivityModifier(0.1, 1, nan, 4),
+                       reactivityModifier.ReactivityModifier(0.9, 1, 1, nan)],
+            "mixed": [reactivityModifier.ReactivityModifier(0.2, 1, 1, nan),
+                      reactivityModifier.ReactivityModifier(0.5, 3, 2, nan),
+                      reactivityModifier.ReactivityModifier(0.7, 3, nan, 4),
+                      reactivityModifier.ReactivityModifier(0.9, 5, 6, nan)]}
+
+def peak_memory():
+    """
+    Highest resident memory of this process so far.
+    returns int bytes
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def image_size(size):
+    """
+    Dimension of an image which shows the whole lattice.
+    size ... int lattice points in x and y direction
+    returns (int, int) image size in pixel
+    """
+    return kagome_lattice.renderer.full_image_size(size, size, LATTICEWIDTH)
+
+
+def quiet_kagome(size, outputFolder=None):
+    """
+    Creates a lattice without console output and without the neighbor shell cache.
+    size ... int lattice points in x and y direction
+    outputFolder ... str folder for images and logs, None runs headless
+    returns Kagome the lattice
+    """
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return kagome_lattice.Kagome(LATTICEWIDTH, (size, size), image_size(size), outputFolder, neighborCache=None, seed=1)
+
+
+def bench_init(size):
+    """
+    Times the constructor of Kagome.
+    size ... int lattice points in x and y direction
+    returns dict measurements
+    """
+    start = time.perf_counter()
+    kagome = quiet_kagome(size)
+    seconds = time.perf_counter() - start
+    kagome.close()
+    return {"seconds": seconds}
+
+
+def bench_shells(size, maxOrder):
+    """
+    Times the generation of the neighbor shells of every order.
+    size ... int lattice points in x and y direction
+    maxOrder ... int highest neighbor order
+    returns dict measurements, seconds is the time of all orders and orderSeconds the time of each one
+    """
+    geometry = lattice.Lattice(size, size)
+    orderSeconds = []
+    start = time.perf_counter()
+    while len(geometry.shells) < maxOrder:
+        orderStart = time.perf_counter()
+        geometry.shells.calculate_next_shell()
+        orderSeconds.append(time.perf_counter() - orderStart)
+    return {"seconds": time.perf_counter() - start,
+            "orderSeconds": orderSeconds,
+            "indices": int(sum(len(indices) for indices in geometry.shells.indices))}
+
+
+def bench_mc(size, ruleSet, mode, steps):
+    """
+    Measures the Monte Carlo steps per second, model2DPropagation prepares the neighbor shells and counters before its clock starts.
+    size ... int lattice points in x and y direction
+    ruleSet ... str key of RULESETS
+    mode ... str simulation mode, see Kagome.model2DPropagation
+    steps ... int number of Monte Carlo steps, sweeps in synchronous mode
+    returns dict measurements
+    """
+    kagome = quiet_kagome(size)
+    rules = RULESETS[ruleSet]
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        kagome.model2DPropagation(rules, steps, seeds=10, mode=mode)
+    kagome.close()
+    report = kagome.stats.report()
+    return {"seconds": report["wallTime"],
+            "stepsPerSecond": report["stepsPerSecond"],
+            "acceptanceRate": report["acceptanceRate"],
+            "conversion": float(np.mean(kagome.reacted))}
+
+
+def bench_draw(size, outputFolder):
+    """
+    Times draw_image and save_image of a half converted lattice.
+    size ... int lattice points in x and y direction
+    outputFolder ... str folder of the image
+    returns dict measurements
+    """
+    kagome = quiet_kagome(size, outputFolder)
+    kagome.set_reacted_many(np.flatnonzero(np.random.default_rng(1).random(len(kagome.reacted)) < 0.5))
+    start = time.perf_counter()
+    kagome.draw_image()
+    drawn = time.perf_counter()
+    kagome.save_image("benchmark")
+    saved = time.perf_counter()
+    kagome.close()
+    return {"seconds": saved - start, "drawSeconds": drawn - start, "saveSeconds": saved - drawn}
+
+
+def bench_snapshot(size, outputFolder):
+    """
+    Times the label map snapshots which model2DPropagation uses, without the background writer.
+    size ... int lattice points in x and y direction
+    outputFolder ... str folder of the image
+    returns dict measurements, setupSeconds is the one time rasterization of the tiling
+    """
+    kagome = quiet_kagome(size, outputFolder)
+    kagome.set_reacted_many(np.flatnonzero(np.random.default_rng(1).random(len(kagome.reacted)) < 0.5))
+    start = time.perf_counter()
+    snapshotRenderer = kagome.get_renderer()
+    ready = time.perf_counter()
+    snapshotRenderer.render(kagome.reacted).save(kagome.image_file_name("benchmark"), compress_level=kagome.pngCompression)
+    saved = time.perf_counter()
+    kagome.close()
+    return {"seconds": saved - ready, "setupSeconds": ready - start}
+
+
+def measure(benchmark, args):
+    """
+    Runs a benchmark, called in a fresh process so that the peak memory belongs to this benchmark alone.
+    benchmark ... function one of the bench_ functions
+    args ... tuple arguments of the benchmark
+    returns dict measurements with the peak memory before and during the benchmark
+    """
+    baseline = peak_memory()
+    result = benchmark(*args)
+    result["baselineMemory"] = baseline
+    result["peakMemory"] = peak_memory()
+    return result
+
+
+def git_commit():
+    """
+    Commit of the working tree which is benchmarked.
+    returns (str, bool) commit hash and whether there are uncommitted changes, None if git is not available
+    """
+    folder = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=folder, capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=folder, capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, len(status) > 0
+
+
+def workloads(sizes, maxOrder, ruleSets, modes, steps, sweeps, drawSizes):
+    """
+    Lists the benchmarks of a suite.
+    returns array of (str, dict, function, tuple) name, parameters, benchmark and its arguments, the output folder is added later
+    """
+    tasks = []
+    for size in sizes:
+        tasks.append(("init", {"size": size}, bench_init, (size,)))
+    for size in sizes:
+        tasks.append(("shells", {"size": size, "maxOrder": maxOrder}, bench_shells, (size, maxOrder)))
+    for size in sizes:
+        for ruleSet in ruleSets:
+            for mode in modes:
+                count = sweeps if mode == "synchronous" else steps
+                tasks.append(("mc", {"size": size, "ruleSet": ruleSet, "mode": mode, "steps": count}, bench_mc, (size, ruleSet, mode, count)))
+    for size in drawSizes:
+        tasks.append(("draw", {"size": size}, bench_draw, (size,)))
+        tasks.append(("snapshot", {"size": size}, bench_snapshot, (size,)))
+    return tasks
+
+
+def run_suite(resultsFile, sizes=SIZES, maxOrder=10, ruleSets=tuple(RULESETS), modes=("sequential", "rejectionfree", "synchronous", "block"), steps=200000, sweeps=10, drawSizes=SIZES):
+    """
+    Runs all benchmarks, each in its own process, and writes the results as json.
+    resultsFile ... str path of the json file
+    sizes ... array int lattice points in x and y direction for construction, neighbor shells and Monte Carlo steps
+    maxOrder ... int highest neighbor order of the neighbor shell benchmark
+    ruleSets ... array str keys of RULESETS which are simulated
+    modes ... array str simulation modes, see Kagome.model2DPropagation
+    steps ... int Monte Carlo steps of the sequential and rejection-free benchmarks
+    sweeps ... int sweeps of the synchronous benchmarks
+    drawSizes ... array int lattice points in x and y direction for drawing and saving images
+    returns dict the results
+    """
+    commit, dirty = git_commit()
+    results = {"commit": commit,
+               "dirty": dirty,
+               "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "python": platform.python_version(),
+               "numpy": np.__version__,
+               "platform": platform.platform(),
+               "benchmarks": []}
+    outputFolder = tempfile.mkdtemp(prefix="benchmark_") + os.sep
+    context = multiprocessing.get_context("spawn")
+    try:
+        for name, parameters, benchmark, args in workloads(sizes, maxOrder, ruleSets, modes, steps, sweeps, drawSizes):
+            if name in ("draw", "snapshot"):
+                args = args + (outputFolder,)
+            print("%s %s" % (name, parameters), end=" ", flush=True)
+            with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                result = pool.submit(measure, benchmark, args).result()
+            print("%0.3f s, %0.1f MB" % (result["seconds"], result["peakMemory"] / 2 ** 20))
+            results["benchmarks"].append(dict(name=name, parameters=parameters, **result))
+            # partial results survive an interrupted suite
+            with open(resultsFile, 'w') as f:
+                json.dump(results, f, indent=2)
+    finally:
+        shutil.rmtree(outputFolder, ignore_errors=True)
+    return results
+
+
+def compare(oldFile, newFile):
+    """
+    Prints the change of time and memory of the benchmarks which are in both result files.
+    oldFile ... str path of the results of the reference commit
+    newFile ... str path of the results which are compared to it
+    """
+    with open(oldFile) as f:
+        old = json.load(f)
+    with open(newFile) as f:
+        new = json.load(f)
+    reference = {(benchmark["name"], json.dumps(benchmark["parameters"], sort_keys=True)): benchmark for benchmark in old["benchmarks"]}
+    print("%s -> %s" % (old["commit"], new["commit"]))
+    for benchmark in new["benchmarks"]:
+        key = (benchmark["name"], json.dumps(benchmark["parameters"], sort_keys=True))
+        if key in reference:
+            before = reference[key]
+            print("%-8s %-60s time x%0.2f, memory x%0.2f" % (benchmark["name"], key[1], benchmark["seconds"] / max(before["seconds"], 1e-9),
+                                                            benchmark["peakMemory"] / max(before["peakMemory"], 1)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of lattice construction, neighbor shells, Monte Carlo steps and image output")
+    parser.add_argument("resultsFile", help="json file for the results")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES), help="lattice points in x and y direction")
+    parser.add_argument("--max-order", type=int, default=10, help="highest neighbor order")
+    parser.add_argument("--rule-sets", nargs="+", default=list(RULESETS), choices=list(RULESETS))
+    parser.add_argument("--modes", nargs="+", default=["sequential", "rejectionfree", "synchronous", "block"])
+    parser.add_argument("--steps", type=int, default=200000, help="Monte Carlo steps of the sequential and rejection-free benchmarks")
+    parser.add_argument("--sweeps", type=int, default=10, help="sweeps of the synchronous benchmarks")
+    parser.add_argument("--draw-sizes", type=int, nargs="+", default=None, help="lattice sizes which are drawn, defaults to --sizes")
+    parser.add_argument("--compare", metavar="OLDFILE", help="compare resultsFile with the results of another commit instead of running")
+    arguments = parser.parse_args()
+    if arguments.compare is not None:
+        compare(arguments.compare, arguments.resultsFile)
+    else:
+        run_suite(arguments.resultsFile, arguments.sizes, arguments.max_order, arguments.rule_sets, arguments.modes,
+                  arguments.steps, arguments.sweeps, arguments.sizes if arguments.draw_sizes is None else arguments.draw_sizes)
@@ -0,0 +1,103 @@
+import kagome_lattice
+import reactivityModifier
+import lattice
+import os
+import json
+import random
+import numpy as np
+
+def random_state(generator):
+    """
+    State of a random number generator which can be stored as json.
+    generator ... random.Random, the random module, numpy.random.Generator or the numpy.random module
+    returns dict state of the generator
+    """
+    if generator is np.random:
+        state = np.random.get_state(legacy=False)
+        state["state"]["key"] = state["state"]["key"].tolist()
+        return state
+    if isinstance(generator, np.random.Generator):
+        return generator.bit_generator.state
+    version, internal, gauss = generator.getstate()
+    return {"version": version, "internal": list(internal), "gauss": gauss}
+
+
+def set_random_state(generator, state):
+    """
+    Restores the state of a random number generator.
+    generator ... random.Random, the random module, numpy.random.Generator or the numpy.random module
+    state ... dict result of random_state
+    """
+    if generator is np.random:
+        state["state"]["key"] = np.array(state["state"]["key"], dtype=np.uint32)
+        np.random.set_state(state)
+    elif isinstance(generator, np.random.Generator):
+        generator.bit_generator.state = state
+    else:
+        generator.setstate((state["version"], tuple(state["internal"]), state["gauss"]))
+
+
+def save(fileName, metadata, arrays):
+    """
+    Writes a checkpoint. The file is replaced atomically, so a run which is killed while writing keeps the previous checkpoint.
+    fileName ... str path of the checkpoint
+    metadata ... dict everything apart from the arrays, must be json serializable
+    arrays ... dict name -> array
+    """
+    temporary = "%s.%i.tmp" % (fileName, os.getpid())
+    with open(temporary, 'wb') as f:
+        np.savez(f, metadata=np.array(json.dumps(metadata)), **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, fileName)
+
+
+def load(fileName):
+    """
+    Reads a checkpoint written by save.
+    fileName ... str path of the checkpoint
+    returns (dict, dict) metadata and name -> array
+    """
+    with np.load(fileName) as stored:
+        arrays = {name: stored[name] for name in stored.files if name != "metadata"}
+        metadata = json.loads(str(stored["metadata"]))
+    return metadata, arrays
+
+
+def rules_to_list(reactivityModifiers):
+    """
+    returns array of [float, int, float, float] parameters of every modifier of a rule set
+    """
+    return [[modifier.r, modifier.neighborOrder, modifier.reactedLateralNeighborsRequired, modifier.unreactedLateralNeighborsRequired]
+            for modifier in reactivityModifiers]
+
+
+def rules_from_list(parameters):
+    """
+    returns array of ReactivityModifier rule set created from the result of rules_to_list
+    """
+    return [reactivityModifier.ReactivityModifier(*modifier) for modifier in parameters]
+
+
+def resume(fileName, neighborCache=lattice.CACHEFOLDER, debug=False):
+    """
+    Continues an interrupted run from its last checkpoint.
+    The lattice, its output files and the random number generators are restored, so the run continues exactly as if it had not been interrupted.
+    fileName ... str path of the checkpoint
+    neighborCache ... str folder in which neighbor shells are cached between runs, None disables the cache
+    debug ... bool cross-checks the reacted neighbor counters, see Kagome
+    returns Kagome the lattice after the end of the run
+    """
+    metadata, arrays = load(fileName)
+    settings = metadata["lattice"]
+    # seeded lattices have their own generators, their state is overwritten below
+    seed = None if metadata["random"]["global"] else 0
+    kagome = kagome_lattice.Kagome(settings["latticeWidth"], settings["latticePoints"], tuple(settings["imageSize"]), settings["outputFolder"],
+                                   neighborCache=neighborCache, debug=debug, seed=seed, ascLogs=settings["ascLogs"], runName=settings["runName"],
+                                   mappedFolder=settings.get("mappedFolder"))
+    # the blocks of the block mode and the stripes and phases of the parallel mode have to end at the same steps as before
+    kagome.blockSize = settings.get("blockSize", 0)
+    kagome.parallelWorkers = settings.get("parallelWorkers", 0)
+    kagome.phaseSteps = settings.get("phaseSteps", 0)
+    kagome.resume(metadata, arrays)
+    return kagome
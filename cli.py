@@ -0,0 +1,182 @@
+import kagome_lattice
+import reactivityModifier
+import renderer
+import lattice
+import sweep
+import os
+import sys
+import json
+import argparse
+import traceback
+import contextlib
+import concurrent.futures
+import numpy as np
+
+# settings of a job which are not given in the job file, the keys follow the arguments of Kagome and Kagome.model2DPropagation
+DEFAULTS = {"name": None, # name of the job in the results, defaults to its position in the job file
+            "latticePoints": None, # (int, int) lattice points in x and y direction, required
+            "rules": [], # array of [r, neighborOrder, reactedLateralNeighborsRequired, unreactedLateralNeighborsRequired], null for nan
+            "backRules": [], # rule set of the back reaction in the same form, empty for irreversible reactions
+            "MCcycleMax": 10000, # int number of Monte Carlo cycles or float conversion at which the run stops
+            "seeds": 0,
+            "sampleCycle": 0, # Monte Carlo cycles between two samples of the conversion, and images if there is an outputFolder, 0 only samples the end
+            "mode": "sequential",
+            "seed": None, # int seed of the random numbers of the job, None uses the global random state
+            "outputFolder": None, # folder for images and log files ending with a separator as in Kagome, None runs headless
+            "latticeWidth": 4, # width of the rhombs in pixel, only used for images
+            "imageSize": None, # (int, int) dimension of the images, None shows the whole lattice
+            "eventLog": None,
+            "checkpointFile": None,
+            "checkpointCycle": 0,
+            "correlationOrder": 0,
+            "trackDomains": False,
+            "timing": False,
+            "statsFile": None,
+            "mappedFolder": None,
+            "stateFile": None,
+            "runName": None,
+            "ascLogs": False}
+
+def rules_from_json(parameters):
+    """
+    Creates a rule set from its json form, null stands for a requirement which is skipped.
+    parameters ... array of [float, int, float, float] parameters of every modifier as in checkpoint.rules_to_list
+    returns array of ReactivityModifier the rule set
+    """
+    nan = float('nan')
+    return [reactivityModifier.ReactivityModifier(*[nan if value is None else value for value in modifier]) for modifier in parameters]
+
+
+def read_jobs(jobFile):
+    """
+    Reads the jobs of a job file. The file holds a single job, an array of jobs or {"defaults": {...}, "jobs": [...]}
+    with settings which all jobs share unless they give their own ones.
+    jobFile ... str path of the json file, - reads from stdin
+    returns array of dict complete settings of every job, see DEFAULTS
+    """
+    if jobFile == "-":
+        content = json.load(sys.stdin)
+    else:
+        with open(jobFile) as f:
+            content = json.load(f)
+    defaults = {}
+    if isinstance(content, dict) and "jobs" in content:
+        defaults = content.get("defaults", {})
+        content = content["jobs"]
+    elif isinstance(content, dict):
+        content = [content]
+    jobs = []
+    for number, settings in enumerate(content):
+        job = dict(DEFAULTS, **defaults)
+        job.update(settings)
+        unknown = sorted(set(job) - set(DEFAULTS))
+        if unknown:
+            raise ValueError("Job %i has unknown settings %s" % (number, ", ".join(unknown)))
+        if job["latticePoints"] is None:
+            raise ValueError("Job %i has no latticePoints" % number)
+        if job["name"] is None:
+            job["name"] = str(number)
+        jobs.append(job)
+    return jobs
+
+
+def run_job(job, neighborCache=lattice.CACHEFOLDER, verbose=False):
+    """
+    Runs a single job in this process.
+    job ... dict complete settings of the job, see read_jobs
+    neighborCache ... str folder of the neighbor shell cache, None disables it
+    verbose ... bool pass the console output of the simulation to stderr instead of dropping it
+    returns dict result record of the job, error holds the traceback of a failed job
+    """
+    result = {"name": job["name"], "job": job, "error": None}
+    try:
+        reactivityModifiers = rules_from_json(job["rules"])
+        backReactionModifiers = rules_from_json(job["backRules"])
+        latticePoints = tuple(job["latticePoints"])
+        imageSize = job["imageSize"]
+        if imageSize is None:
+            # the image of a headless job is never allocated
+            imageSize = renderer.full_image_size(latticePoints[0], latticePoints[1], job["latticeWidth"]) if job["outputFolder"] is not None else (1, 1)
+        with contextlib.ExitStack() as stack:
+            # stdout belongs to the results
+            output = sys.stderr if verbose else stack.enter_context(open(os.devnull, 'w'))
+            stack.enter_context(contextlib.redirect_stdout(output))
+            geometry = None
+            if job["mappedFolder"] is None:
+                # jobs of the same dimensions in this process share geometry and neighbor shells
+                maxNeighborOrder = max([modifier.neighborOrder for modifier in reactivityModifiers + backReactionModifiers] + [1, job["correlationOrder"]])
+                geometry = sweep.get_geometry(latticePoints, maxNeighborOrder, neighborCache)
+            kagome = stack.enter_context(kagome_lattice.Kagome(job["latticeWidth"], latticePoints, imageSize, job["outputFolder"],
+                                                               neighborCache=neighborCache, seed=job["seed"], geometry=geometry,
+                                                               ascLogs=job["ascLogs"], runName=job["runName"],
+                                                               mappedFolder=job["mappedFolder"], stateFile=job["stateFile"]))
+            kagome.model2DPropagation(reactivityModifiers, job["MCcycleMax"], job["seeds"], job["sampleCycle"], job["mode"], job["eventLog"],
+                                      job["timing"], job["statsFile"], job["checkpointFile"], job["checkpointCycle"], job["correlationOrder"],
+                                      job["trackDomains"], backReactionModifiers=backReactionModifiers)
+        cycles = [cycle for cycle, conversion in kagome.conversionHistory]
+        conversions = [conversion for cycle, conversion in kagome.conversionHistory]
+        result.update({"MCcycle": cycles[-1],
+                       "conversion": conversions[-1],
+                       "reacted": int(np.count_nonzero(kagome.reacted)),
+                       "rhombs": kagome.numberAllLatticePoints,
+                       "cycles": cycles,
+                       "conversions": conversions,
+                       "stats": kagome.stats.report()})
+        if kagome.correlation is not None:
+            result["correlations"] = {"columns": kagome.correlation.columns(),
+                                      "cycles": [cycle for cycle, correlations in kagome.correlationHistory],
+                                      # nan is not valid json
+                                      "values": [[None if np.isnan(value) else value for value in correlations.ravel().tolist()]
+                                                 for cycle, correlations in kagome.correlationHistory]}
+        if kagome.domains is not None:
+            result["domains"] = {"clusters": kagome.domains.clusters,
+                                 "largest": kagome.domains.largest,
+                                 "wrapsX": kagome.domains.wrappingX,
+                                 "wrapsY": kagome.domains.wrappingY,
+                                 "percolationSize": kagome.domains.percolationSize,
+                                 "history": kagome.domainHistory}
+    except Exception:
+        result["error"] = traceback.format_exc()
+    return result
+
+
+def run_jobs(jobs, resultsFile=None, processes=1, neighborCache=lattice.CACHEFOLDER, verbose=False):
+    """
+    Runs jobs and writes one json line per job as soon as it is finished, in the order of the jobs.
+    jobs ... array of dict complete settings of the jobs, see read_jobs
+    resultsFile ... str path of the json lines file, None writes to stdout
+    processes ... int number of worker processes, None uses all cores, 1 runs everything in this process
+    neighborCache ... str folder of the neighbor shell cache, None disables it
+    verbose ... bool pass the console output of the simulations to stderr
+    returns int number of failed jobs
+    """
+    failed = 0
+    with contextlib.ExitStack() as stack:
+        f = sys.stdout if resultsFile is None else stack.enter_context(open(resultsFile, 'w'))
+        if processes == 1:
+            results = (run_job(job, neighborCache, verbose) for job in jobs)
+        else:
+            pool = stack.enter_context(concurrent.futures.ProcessPoolExecutor(max_workers=processes))
+            # neighboring jobs often have the same dimensions, chunks keep them in the same worker
+            results = pool.map(run_job, jobs, [neighborCache] * len(jobs), [verbose] * len(jobs), chunksize=max(1, len(jobs) // (4 * (processes or os.cpu_count() or 1))))
+        for result in results:
+            if result["error"] is not None:
+                failed += 1
+                print("Job %s failed:\n%s" % (result["name"], result["error"]), file=sys.stderr)
+            f.write(json.dumps(result) + "\n")
+            f.flush()
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs the simulations of a json job file without a display and writes the results as json lines")
+    parser.add_argument("jobFile", help="json file with a job, an array of jobs or {\"defaults\": {...}, \"jobs\": [...]}, - reads from stdin")
+    parser.add_argument("--results", metavar="FILE", help="json lines file for the results, defaults to stdout")
+    parser.add_argument("--processes", type=int, default=1, help="number of jobs which run at the same time, 0 uses all cores")
+    parser.add_argument("--neighbor-cache", default=lattice.CACHEFOLDER, help="folder of the neighbor shell cache")
+    parser.add_argument("--no-cache", action="store_true", help="do not read or write the neighbor shell cache")
+    parser.add_argument("--verbose", action="store_true", help="show the console output of the simulations on stderr")
+    arguments = parser.parse_args()
+    failed = run_jobs(read_jobs(arguments.jobFile), arguments.results, arguments.processes if arguments.processes > 0 else None,
+                      None if arguments.no_cache else arguments.neighbor_cache, arguments.verbose)
+    sys.exit(1 if failed > 0 else 0)
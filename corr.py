@@ -1,8 +1,68 @@
+import numpy as np
+
+# kinds of pairs, reacted-reacted, reacted-unreacted and unreacted-unreacted
+PAIRS = ("RR", "RU", "UU")
+
 class Correlation():
+    """
+    Pair correlations between reacted and unreacted rhombs for each neighbor order.
+    All ordered pairs of a rhomb and a member of its neighbor shell are counted over the whole lattice,
+    the correlation of a kind of pair is its share divided by the share expected for randomly placed reacted rhombs.
+    A value above 1 means that this kind of pair is more frequent than by chance, e.g. RR > 1 for growing domains.
+    """
 
-    def __init__(self, neighborOrder, siteMultiplicationReacted, siteMultiplicationReactedMaximum, propabilityModifierReacted, propabilityModifierUnreacted):
+    def __init__(self, shells, neighborOrder):
+        """
+        Constructor
+        shells ... lattice.NeighborShells neighbor shells of the lattice, up to neighborOrder
+        neighborOrder ... int highest neighbor order which is analysed
+        """
+        self.shells = shells
         self.order = neighborOrder
-        self.propR = propabilityModifierReacted
-        self.multR = siteMultiplicationReacted
-        self.maxiR = siteMultiplicationReactedMaximum
-        self.propU = propabilityModifierUnreacted
\ No newline at end of file
+        # size of each shell of every rhomb and number of ordered pairs by order
+        self.sizes = np.array([shells.sizes(order) for order in range(1, neighborOrder + 1)], dtype=np.int64)
+        self.pairs = self.sizes.sum(axis=1)
+
+
+    def columns(self):
+        """
+        returns array of string names of the values of correlations, e.g. RR1, RU1, UU1, RR2, ...
+        """
+        return ["%s%i" % (kind, order) for order in range(1, self.order + 1) for kind in PAIRS]
+
+
+    def pair_counts(self, reacted, neighborCounts=None):
+        """
+        Counts the pairs of each kind.
+        reacted ... array bool state of all rhombs
+        neighborCounts ... array[order, rhombs] reacted neighbors of every rhomb as maintained by Kagome, orders without counters are recounted
+        returns array[order, 3] int64 number of RR, RU and UU pairs, RU counts both orientations
+        """
+        counts = np.empty((self.order, 3), dtype=np.int64)
+        for order in range(1, self.order + 1):
+            if neighborCounts is not None and order <= len(neighborCounts):
+                reactedNeighbors = neighborCounts[order - 1]
+            else:
+                reactedNeighbors = self.shells.count(order, reacted)
+            # pairs starting at a reacted rhomb and pairs ending at one
+            reactedReacted = int(reactedNeighbors[reacted].sum(dtype=np.int64))
+            fromReacted = int(self.sizes[order - 1][reacted].sum())
+            toReacted = int(reactedNeighbors.sum(dtype=np.int64))
+            counts[order - 1] = (reactedReacted,
+                                 fromReacted + toReacted - 2 * reactedReacted,
+                                 self.pairs[order - 1] - fromReacted - toReacted + reactedReacted)
+        return counts
+
+
+    def correlations(self, reacted, neighborCounts=None):
+        """
+        Calculates the pair correlations of a state.
+        reacted ... array bool state of all rhombs
+        neighborCounts ... array[order, rhombs] reacted neighbors of every rhomb as maintained by Kagome, orders without counters are recounted
+        returns array[order, 3] float correlation of RR, RU and UU pairs, nan if there is no reacted or no unreacted rhomb
+        """
+        conversion = np.count_nonzero(reacted) / len(reacted)
+        expected = np.array([conversion ** 2, 2 * conversion * (1 - conversion), (1 - conversion) ** 2])
+        shares = self.pair_counts(reacted, neighborCounts) / self.pairs[:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(expected > 0, shares / expected, np.nan)
@@ -0,0 +1,218 @@
+import numpy as np
+
+class Domains():
+    """
+    Connected domains of reacted rhombs, i.e. product islands, over first neighbor connectivity.
+    A union-find structure is updated with every reacted rhomb, so cluster statistics are available at any time without a flood fill.
+    Every rhomb also stores its displacement to its parent in unwrapped lattice coordinates. If a new bond joins a domain
+    with itself and the displacements around the loop do not cancel, the domain wraps around the torus, i.e. it percolates.
+    Removing rhombs is not supported by union-find, the domains have to be rebuilt from the state instead.
+    """
+
+    def __init__(self, geometry, reacted=None):
+        """
+        Constructor
+        geometry ... lattice.Lattice geometry of the lattice
+        reacted ... array bool state from which the domains are built, None starts with an empty lattice
+        """
+        self.geometry = geometry
+        siteCount = len(geometry)
+        self.periodX, self.periodY, self.shiftX, self.shiftY = self.neighbor_shifts()
+        # on broken tori (latticePointsY not a multiple of 4) a site is not always a first neighbor of its first neighbors,
+        # bonds are undirected so those sites get the reverse bonds as (site, shift in x, shift in y) in addition
+        self.reverseBonds = None
+        offsets, indices = geometry.shells.reverse(1)
+        if indices is not geometry.shells.indices[0]:
+            self.reverseBonds = [[] for i in range(siteCount)]
+            for k, neighbors in enumerate(geometry.firstNeighbors.tolist()):
+                for m in range(4):
+                    self.reverseBonds[neighbors[m]].append((k, -self.shiftX[k][m], -self.shiftY[k][m]))
+        self.member = np.zeros(siteCount, dtype=bool)
+        # union-find forest as lists, the updates touch single elements only
+        self.parent = list(range(siteCount))
+        self.size = [1] * siteCount
+        self.offsetX = [0] * siteCount # displacement from the parent in units of a quarter rhomb width
+        self.offsetY = [0] * siteCount # displacement from the parent in rows
+        self.wrapsX = [False] * siteCount # valid for roots only
+        self.wrapsY = [False] * siteCount
+        self.sizeCounts = {} # domain size -> number of domains
+        self.sites = 0
+        self.clusters = 0
+        self.largest = 0
+        # some domain wraps around the torus in x or y direction, domains only grow so this never changes back
+        self.wrappingX = False
+        self.wrappingY = False
+        # number of reacted rhombs when a domain wrapped around the torus for the first time
+        self.percolationSize = None
+        if reacted is not None:
+            self.add_many(np.flatnonzero(reacted))
+
+
+    def neighbor_shifts(self):
+        """
+        Displacement from every site to each of its first neighbors, taking the shortest way around the torus.
+        The x coordinate is measured in quarters of a rhomb width as in renderer.kag_to_screen: 2x + 1 in even rows,
+        4x in rows with y % 4 == 1 and 4x + 2 in rows with y % 4 == 3.
+        returns (int, int, array[N, 4], array[N, 4]) period of the torus in x and y and the shifts in x and y
+        """
+        geometry = self.geometry
+        x = geometry.siteX.astype(np.int64)
+        y = geometry.siteY.astype(np.int64)
+        position = np.where(y % 2 == 0, 2 * x + 1, np.where(y % 4 == 1, 4 * x, 4 * x + 2))
+        periodX = 2 * geometry.latticePointsX
+        periodY = geometry.latticePointsY
+        neighbors = geometry.firstNeighbors.astype(np.int64)
+        shiftX = position[neighbors] - position[:, None]
+        shiftY = y[neighbors] - y[:, None]
+        # shortest image on the torus
+        shiftX = (shiftX + periodX // 2) % periodX - periodX // 2
+        shiftY = (shiftY + periodY // 2) % periodY - periodY // 2
+        return periodX, periodY, shiftX.tolist(), shiftY.tolist()
+
+
+    def find(self, i):
+        """
+        Root of the domain of a site with path compression.
+        i ... int flat site index
+        returns (int, int, int) root and displacement of the site from the root in x and y
+        """
+        parent = self.parent
+        path = []
+        while parent[i] != i:
+            path.append(i)
+            i = parent[i]
+        root = i
+        # walk back from the root so that every site on the path points directly to it
+        dx = 0
+        dy = 0
+        for j in reversed(path):
+            dx += self.offsetX[j]
+            dy += self.offsetY[j]
+            self.offsetX[j] = dx
+            self.offsetY[j] = dy
+            parent[j] = root
+        if path:
+            return root, self.offsetX[path[0]], self.offsetY[path[0]]
+        return root, 0, 0
+
+
+    def count(self, size, change):
+        """
+        Updates the size histogram.
+        size ... int size of a domain
+        change ... int number of domains of that size which are added or removed
+        """
+        number = self.sizeCounts.get(size, 0) + change
+        if number > 0:
+            self.sizeCounts[size] = number
+        else:
+            del self.sizeCounts[size]
+
+
+    def add(self, i):
+        """
+        Adds a reacted rhomb and joins it with the domains of its reacted first neighbors.
+        i ... int flat site index
+        """
+        if self.member[i]:
+            return
+        self.member[i] = True
+        self.sites += 1
+        self.clusters += 1
+        self.count(1, 1)
+        self.largest = max(self.largest, 1)
+        neighbors = self.geometry.firstNeighbors[i].tolist()
+        for k in range(4):
+            if self.member[neighbors[k]]:
+                self.join(i, neighbors[k], self.shiftX[i][k], self.shiftY[i][k])
+        if self.reverseBonds is not None:
+            for j, shiftX, shiftY in self.reverseBonds[i]:
+                if self.member[j]:
+                    self.join(i, j, shiftX, shiftY)
+
+
+    def add_many(self, sites):
+        """
+        Adds many reacted rhombs.
+        sites ... array int flat site indices
+        """
+        for i in np.asarray(sites).tolist():
+            self.add(i)
+
+
+    def join(self, i, j, shiftX, shiftY):
+        """
+        Joins the domains of two neighboring sites.
+        i ... int flat site index
+        j ... int flat site index of a first neighbor of i
+        shiftX ... int displacement from i to j in x
+        shiftY ... int displacement from i to j in y
+        """
+        rootI, xI, yI = self.find(i)
+        rootJ, xJ, yJ = self.find(j)
+        # displacement from rootI to rootJ along the new bond
+        dx = xI + shiftX - xJ
+        dy = yI + shiftY - yJ
+        if rootI == rootJ:
+            # a closed loop which does not return to its start winds around the torus
+            if dx != 0 or dy != 0:
+                self.wrapsX[rootI] = self.wrapsX[rootI] or dx != 0
+                self.wrapsY[rootI] = self.wrapsY[rootI] or dy != 0
+                self.wrappingX = self.wrappingX or dx != 0
+                self.wrappingY = self.wrappingY or dy != 0
+                if self.percolationSize is None:
+                    self.percolationSize = self.sites
+            return
+        # the smaller domain is attached to the larger one
+        if self.size[rootI] < self.size[rootJ]:
+            rootI, rootJ = rootJ, rootI
+            dx = -dx
+            dy = -dy
+        self.count(self.size[rootI], -1)
+        self.count(self.size[rootJ], -1)
+        self.parent[rootJ] = rootI
+        self.offsetX[rootJ] = dx
+        self.offsetY[rootJ] = dy
+        self.size[rootI] += self.size[rootJ]
+        self.wrapsX[rootI] = self.wrapsX[rootI] or self.wrapsX[rootJ]
+        self.wrapsY[rootI] = self.wrapsY[rootI] or self.wrapsY[rootJ]
+        self.count(self.size[rootI], 1)
+        self.clusters -= 1
+        self.largest = max(self.largest, self.size[rootI])
+
+
+    def domain_size(self, i):
+        """
+        i ... int flat site index
+        returns int size of the domain of a site, 0 if it has not reacted
+        """
+        if not self.member[i]:
+            return 0
+        return self.size[self.find(i)[0]]
+
+
+    def histogram(self):
+        """
+        Size distribution of the domains.
+        returns (array, array) int64 domain sizes in ascending order and the number of domains of each size
+        """
+        sizes = np.array(sorted(self.sizeCounts), dtype=np.int64)
+        return sizes, np.array([self.sizeCounts[size] for size in sizes.tolist()], dtype=np.int64)
+
+
+    def domain_wraps(self, i):
+        """
+        i ... int flat site index
+        returns (bool, bool) the domain of a site wraps around the torus in x and in y direction
+        """
+        if not self.member[i]:
+            return False, False
+        root = self.find(i)[0]
+        return self.wrapsX[root], self.wrapsY[root]
+
+
+    def percolates(self):
+        """
+        returns bool some domain wraps around the torus in any direction
+        """
+        return self.percolationSize is not None
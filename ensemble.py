@@ -0,0 +1,117 @@
+import kagome_lattice
+import lattice
+import os
+import contextlib
+import concurrent.futures
+import numpy as np
+
+# quantiles of the conversion which are reported by default
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+class EnsembleResult():
+    """
+    Conversion versus Monte Carlo cycle statistics of an ensemble of independent runs.
+    """
+
+    def __init__(self, cycles, conversions, quantiles=QUANTILES):
+        """
+        Constructor
+        cycles ... array int common grid of Monte Carlo cycles
+        conversions ... array[replicas, cycles] float conversion of every replica on the grid
+        quantiles ... array float quantiles which should be calculated
+        """
+        self.cycles = cycles
+        self.conversions = conversions
+        self.mean = conversions.mean(axis=0)
+        self.std = conversions.std(axis=0)
+        self.quantiles = {}
+        for q in quantiles:
+            self.quantiles[q] = np.quantile(conversions, q, axis=0)
+
+
+    def __str__(self):
+        """
+        tostring functions
+        returns string a human readable summary of the final conversion
+        """
+        return "%i replicas, final conversion %0.04f +- %0.04f after %i cycles" % (len(self.conversions), self.mean[-1], self.std[-1], self.cycles[-1])
+
+
+def replica_seeds(masterSeed, replicas):
+    """
+    Derives independent random streams for all replicas from a single seed.
+    masterSeed ... int seed of the whole ensemble
+    replicas ... int number of replicas
+    returns array of numpy.random.SeedSequence one seed sequence per replica
+    """
+    return np.random.SeedSequence(masterSeed).spawn(replicas)
+
+
+def run_replica(latticePoints, reactivityModifiers, MCcycleMax, seeds, sampleCycle, mode, seed, neighborCache=lattice.CACHEFOLDER):
+    """
+    Runs a single simulation without images and log files.
+    latticePoints ... (int, int) lattice points in x and y direction
+    reactivityModifiers ... array of ReactivityModifier rule set which is applied to the simulation
+    MCcycleMax ... int or float stop criterion, see Kagome.model2DPropagation
+    seeds ... int number of randomly created seeds
+    sampleCycle ... int number of Monte Carlo cycles between two samples of the conversion
+    mode ... str simulation mode, see Kagome.model2DPropagation
+    seed ... int or numpy.random.SeedSequence seed of this replica
+    neighborCache ... str folder of the neighbor shell cache
+    returns (array, array) Monte Carlo cycles and conversion of all samples
+    """
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        kagome = kagome_lattice.Kagome(1, latticePoints, (1, 1), None, neighborCache=neighborCache, seed=seed)
+        kagome.model2DPropagation(reactivityModifiers, MCcycleMax, seeds, sampleCycle, mode)
+    history = np.array(kagome.conversionHistory)
+    return history[:, 0].astype(np.int64), history[:, 1]
+
+
+def on_grid(cycles, conversion, grid):
+    """
+    Samples a conversion curve on a grid of Monte Carlo cycles, the conversion is held constant between samples and after the last one.
+    cycles ... array int Monte Carlo cycles of the samples
+    conversion ... array float conversion of the samples
+    grid ... array int Monte Carlo cycles of the grid
+    returns array float conversion on the grid
+    """
+    position = np.searchsorted(cycles, grid, side='right') - 1
+    return np.where(position >= 0, conversion[np.maximum(position, 0)], 0)
+
+
+def run_ensemble(latticePoints, reactivityModifiers, MCcycleMax, replicas, masterSeed, seeds=0, sampleCycle=100, mode="sequential", grid=None, processes=None, quantiles=QUANTILES, neighborCache=lattice.CACHEFOLDER):
+    """
+    Runs independent replicas of a simulation in a process pool and collects their conversion curves.
+    latticePoints ... (int, int) lattice points in x and y direction
+    reactivityModifiers ... array of ReactivityModifier rule set which is applied to the simulation
+    MCcycleMax ... int or float stop criterion, see Kagome.model2DPropagation
+    replicas ... int number of independent runs
+    masterSeed ... int seed from which the random streams of all replicas are derived
+    seeds ... int number of randomly created seeds in each run
+    sampleCycle ... int number of Monte Carlo cycles between two samples of the conversion
+    mode ... str simulation mode, see Kagome.model2DPropagation
+    grid ... array int common Monte Carlo cycles of the statistics, None uses every sampleCycle up to the longest run
+    processes ... int number of worker processes, None uses all cores, 1 runs everything in this process
+    quantiles ... array float quantiles which should be calculated
+    neighborCache ... str folder of the neighbor shell cache
+    returns EnsembleResult statistics of the ensemble
+    """
+    # the neighbor shells are calculated once, all workers read them from the cache
+    if neighborCache is not None:
+        maxNeighborOrder = max([modifier.neighborOrder for modifier in reactivityModifiers] + [1])
+        kagome = kagome_lattice.Kagome(1, latticePoints, (1, 1), None, neighborCache=neighborCache)
+        kagome.calculate_neighbor_shells(maxNeighborOrder)
+
+    tasks = [(latticePoints, reactivityModifiers, MCcycleMax, seeds, sampleCycle, mode, seed, neighborCache) for seed in replica_seeds(masterSeed, replicas)]
+    if processes == 1:
+        curves = [run_replica(*task) for task in tasks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as pool:
+            curves = list(pool.map(run_replica, *zip(*tasks)))
+
+    if grid is None:
+        lastCycle = max(cycles[-1] for cycles, conversion in curves)
+        grid = np.arange(0, lastCycle + sampleCycle, sampleCycle)
+    grid = np.asarray(grid)
+    conversions = np.array([on_grid(cycles, conversion, grid) for cycles, conversion in curves])
+    return EnsembleResult(grid, conversions, quantiles)
@@ -0,0 +1,256 @@
+import ensemble
+import sweep
+import checkpoint
+import lattice
+import os
+import json
+import hashlib
+import itertools
+import concurrent.futures
+import numpy as np
+
+# folder of the simulated conversion curves, shared by all fitting sessions
+CURVEFOLDER = os.path.join(lattice.CACHEFOLDER, "curves")
+
+class CurveCache():
+    """
+    On-disk memo of simulated conversion curves.
+    A curve is stored under a hash of everything which decides it: the geometry, the rules, the settings of the run and the seed of the replica,
+    so a curve is never simulated twice, also not by different fitting sessions or processes.
+    """
+
+    def __init__(self, folder=CURVEFOLDER):
+        """
+        Constructor
+        folder ... str folder of the cache, it is created on the first write
+        """
+        self.folder = folder
+        self.hits = 0
+        self.misses = 0
+
+
+    def key(self, latticePoints, reactivityModifiers, MCcycleMax, seeds, sampleCycle, mode, masterSeed, replica):
+        """
+        Identifies a simulated curve.
+        latticePoints ... (int, int) lattice points in x and y direction
+        reactivityModifiers ... array of ReactivityModifier rule set of the run
+        MCcycleMax ... int or float stop criterion, see Kagome.model2DPropagation
+        seeds ... int number of randomly created seeds
+        sampleCycle ... int number of Monte Carlo cycles between two samples of the conversion
+        mode ... str simulation mode, see Kagome.model2DPropagation
+        masterSeed ... int seed of the ensemble
+        replica ... int index of the replica in the ensemble
+        returns str hash of the settings
+        """
+        # same rounding as in Kagome
+        settings = {"latticePoints": [latticePoints[0] + latticePoints[0] % 2, latticePoints[1] + latticePoints[1] % 2],
+                    "rules": checkpoint.rules_to_list(reactivityModifiers),
+                    "MCcycleMax": MCcycleMax,
+                    "seeds": seeds,
+                    "sampleCycle": sampleCycle,
+                    "mode": mode,
+                    "seed": [masterSeed, replica]}
+        return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+    def file_name(self, key):
+        """
+        key ... str result of self.key
+        returns str path of the cached curve
+        """
+        return os.path.join(self.folder, "curve_%s.npz" % key)
+
+
+    def load(self, key):
+        """
+        Reads a cached curve.
+        key ... str result of self.key
+        returns (array, array) Monte Carlo cycles and conversion of all samples, None if the curve is not cached
+        """
+        fileName = self.file_name(key)
+        if not os.path.exists(fileName):
+            self.misses += 1
+            return None
+        self.hits += 1
+        with np.load(fileName) as cached:
+            return cached["cycles"], cached["conversion"]
+
+
+    def store(self, key, cycles, conversion):
+        """
+        Writes a curve to the cache. The file is replaced atomically so that parallel sessions never see a partial file.
+        key ... str result of self.key
+        cycles ... array int Monte Carlo cycles of the samples
+        conversion ... array float conversion of the samples
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        fileName = self.file_name(key)
+        temporary = "%s.%i.tmp" % (fileName, os.getpid())
+        with open(temporary, 'wb') as f:
+            np.savez(f, cycles=cycles, conversion=conversion)
+        os.replace(temporary, fileName)
+
+
+class FitResult():
+    """
+    Best parameters of a fit and every point which was evaluated on the way.
+    """
+
+    def __init__(self, parameters, timeScale, residual, reactivityModifiers, cycles, conversion, history):
+        """
+        Constructor
+        parameters ... dict parameter name -> best value
+        timeScale ... float Monte Carlo cycles per unit of the measured time
+        residual ... float root mean square deviation of the simulated from the measured conversion
+        reactivityModifiers ... array of ReactivityModifier rule set of the best parameters
+        cycles ... array int Monte Carlo cycles of the simulated curve
+        conversion ... array float mean conversion of the ensemble of the best parameters
+        history ... array of dict parameters, timeScale and residual of every evaluated point in order
+        """
+        self.parameters = parameters
+        self.timeScale = timeScale
+        self.residual = residual
+        self.reactivityModifiers = reactivityModifiers
+        self.cycles = cycles
+        self.conversion = conversion
+        self.history = history
+
+
+    def __str__(self):
+        """
+        tostring functions
+        returns string a human readable summary of the fit
+        """
+        return "%s, %0.4g cycles per time unit, rms deviation %0.04f after %i points" % (
+            ", ".join("%s = %0.4g" % item for item in sorted(self.parameters.items())), self.timeScale, self.residual, len(self.history))
+
+
+def run_replica(latticePoints, reactivityModifiers, MCcycleMax, seeds, sampleCycle, mode, masterSeed, replica, neighborCache):
+    """
+    Simulates a single replica of an ensemble, see ensemble.run_replica.
+    masterSeed ... int seed of the ensemble
+    replica ... int index of the replica, its random stream is the same as in ensemble.run_ensemble
+    returns (array, array) Monte Carlo cycles and conversion of all samples
+    """
+    seed = np.random.SeedSequence(masterSeed, spawn_key=(replica,))
+    return ensemble.run_replica(latticePoints, reactivityModifiers, MCcycleMax, seeds, sampleCycle, mode, seed, neighborCache)
+
+
+def ensemble_curves(cache, ruleSets, latticePoints, MCcycleMax, replicas, masterSeed, seeds, sampleCycle, mode, processes, neighborCache):
+    """
+    Mean conversion curves of the ensembles of many rule sets, only curves which are not in the cache are simulated.
+    cache ... CurveCache cache of the simulated curves
+    ruleSets ... array of array of ReactivityModifier rule sets
+    see fit for the other arguments
+    returns (array, array[ruleSets, cycles]) common grid of Monte Carlo cycles and the mean conversion of every rule set on it
+    """
+    keys = [[cache.key(latticePoints, rules, MCcycleMax, seeds, sampleCycle, mode, masterSeed, replica) for replica in range(replicas)] for rules in ruleSets]
+    curves = {}
+    tasks = []
+    for rules, ruleKeys in zip(ruleSets, keys):
+        for replica, key in enumerate(ruleKeys):
+            if key in curves:
+                continue
+            curves[key] = cache.load(key)
+            if curves[key] is None:
+                tasks.append((key, (latticePoints, rules, MCcycleMax, seeds, sampleCycle, mode, masterSeed, replica, neighborCache)))
+    if tasks:
+        print("Simulating %i of %i curves" % (len(tasks), len(curves)))
+        if neighborCache is not None:
+            # the neighbor shells are calculated once, all workers read them from the cache
+            sweep.get_geometry(latticePoints, max([modifier.neighborOrder for rules in ruleSets for modifier in rules] + [1]), neighborCache)
+        if processes == 1:
+            simulated = [run_replica(*arguments) for key, arguments in tasks]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as pool:
+                simulated = list(pool.map(run_replica, *zip(*[arguments for key, arguments in tasks])))
+        for (key, arguments), (cycles, conversion) in zip(tasks, simulated):
+            cache.store(key, cycles, conversion)
+            curves[key] = (cycles, conversion)
+
+    if type(MCcycleMax) == int:
+        lastCycle = MCcycleMax
+    else:
+        lastCycle = max(int(cycles[-1]) for cycles, conversion in curves.values())
+    grid = np.arange(0, lastCycle + sampleCycle, sampleCycle)
+    means = np.array([np.mean([ensemble.on_grid(*curves[key], grid) for key in ruleKeys], axis=0) for ruleKeys in keys])
+    return grid, means
+
+
+def best_time_scale(grid, conversion, times, measured, timeScale):
+    """
+    Finds the Monte Carlo cycles per unit of the measured time for which a simulated curve fits best, no simulation is needed for it.
+    grid ... array int Monte Carlo cycles of the simulated curve
+    conversion ... array float simulated conversion
+    times ... array float times of the measurement
+    measured ... array float measured conversion
+    timeScale ... float fixed number of Monte Carlo cycles per time unit or (float, float) range in which it is searched
+    returns (float, float) time scale and root mean square deviation
+    """
+    candidates = np.array([float(timeScale)]) if np.isscalar(timeScale) else np.geomspace(timeScale[0], timeScale[1], 256)
+    for refinement in range(1 if len(candidates) == 1 else 2):
+        residuals = np.array([np.sqrt(np.mean((np.interp(times * scale, grid, conversion) - measured) ** 2)) for scale in candidates])
+        best = int(np.argmin(residuals))
+        scale, residual = float(candidates[best]), float(residuals[best])
+        # a second pass between the neighbors of the best candidate
+        candidates = np.geomspace(candidates[max(best - 1, 0)], candidates[min(best + 1, len(candidates) - 1)], 64)
+    return scale, residual
+
+
+def fit(times, measured, ruleFactory, bounds, latticePoints, MCcycleMax, replicas=8, masterSeed=0, seeds=0, sampleCycle=100, mode="sequential",
+        timeScale=1.0, gridPoints=5, rounds=4, shrink=0.5, decimals=6, processes=None, neighborCache=lattice.CACHEFOLDER, cacheFolder=CURVEFOLDER):
+    """
+    Fits the parameters of a rule set to a measured conversion curve.
+    The parameters are searched on a grid which is refined around the best point in every round. Every point is an ensemble of replicas
+    with the same random streams, so differences between points are not hidden by noise. All simulated curves go to a CurveCache,
+    a refined or repeated fit only simulates the points and replicas which were never simulated before.
+    times ... array float times of the measurement, e.g. read with log.read_xy
+    measured ... array float measured conversion at these times
+    ruleFactory ... function which turns a dict parameter name -> value into an array of ReactivityModifier
+    bounds ... dict parameter name -> (float, float) range of the parameter, e.g. {"r": (0, 1)}
+    latticePoints ... (int, int) lattice points in x and y direction
+    MCcycleMax ... int or float stop criterion, see Kagome.model2DPropagation, the runs should cover the measured times
+    replicas ... int number of independent runs per point
+    masterSeed ... int seed from which the random streams of the replicas are derived
+    seeds ... int number of randomly created seeds in each run
+    sampleCycle ... int number of Monte Carlo cycles between two samples of the conversion
+    mode ... str simulation mode, see Kagome.model2DPropagation
+    timeScale ... float Monte Carlo cycles per unit of the measured time or (float, float) range in which it is fitted as well
+    gridPoints ... int number of values of each parameter in a round
+    rounds ... int number of refinements of the grid
+    shrink ... float factor by which the range of the parameters shrinks in every round
+    decimals ... int parameters are rounded to this many decimals, so the points of different sessions hit the cache
+    processes ... int number of worker processes, None uses all cores, 1 runs everything in this process
+    neighborCache ... str folder of the neighbor shell cache
+    cacheFolder ... str folder of the simulated curves, see CurveCache
+    returns FitResult best parameters and all evaluated points
+    """
+    times = np.asarray(times, dtype=np.float64)
+    measured = np.asarray(measured, dtype=np.float64)
+    names = sorted(bounds)
+    cache = CurveCache(cacheFolder)
+    lowest = np.array([bounds[name][0] for name in names], dtype=np.float64)
+    highest = np.array([bounds[name][1] for name in names], dtype=np.float64)
+    low, high = lowest, highest
+    evaluated = {} # rounded parameters -> (time scale, residual, mean conversion)
+    history = []
+    for refinement in range(rounds):
+        axes = [np.unique(np.round(np.linspace(low[p], high[p], gridPoints), decimals)) for p in range(len(names))]
+        points = [point for point in itertools.product(*[axis.tolist() for axis in axes]) if point not in evaluated]
+        if points:
+            grid, means = ensemble_curves(cache, [ruleFactory(dict(zip(names, point))) for point in points], latticePoints, MCcycleMax,
+                                          replicas, masterSeed, seeds, sampleCycle, mode, processes, neighborCache)
+            for point, conversion in zip(points, means):
+                scale, residual = best_time_scale(grid, conversion, times, measured, timeScale)
+                evaluated[point] = (scale, residual, conversion)
+                history.append({"parameters": dict(zip(names, point)), "timeScale": scale, "residual": residual})
+        best = min(evaluated, key=lambda point: evaluated[point][1])
+        print("Round %i: %s" % (refinement + 1, ", ".join("%s = %0.4g" % item for item in zip(names, best))))
+        # the next grid is centered on the best point and stays within the bounds
+        width = (high - low) * shrink
+        low = np.clip(np.array(best) - width / 2, lowest, highest - width)
+        high = low + width
+    scale, residual, conversion = evaluated[best]
+    print("%i curves from the cache, %i simulated" % (cache.hits, cache.misses))
+    return FitResult(dict(zip(names, best)), scale, residual, ruleFactory(dict(zip(names, best))),
+                     np.arange(len(conversion)) * sampleCycle, conversion, history)
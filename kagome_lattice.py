@@ -1,14 +1,20 @@
 import rhomb
+import lattice
 import reactivityModifier
 import math
 import log
 import corr
+import renderer
+import writer
+import trajectory
+import progress
+import checkpoint
+import domains
 import random
+import time
 import os.path
 import warnings
 import numpy as np
-from PIL import Image
-from PIL import ImageDraw
 
 class Kagome():
     """Creates a two-dimensional Kagome lattice and all tools for drawing on it."""
@@ -28,32 +34,67 @@ class Kagome():
         new_func.__dict__.update(func.__dict__)
         return new_func
 
-    def __init__(self, latticeWidth, latticePoints, imageSize, outputFolder):
+    def __init__(self, latticeWidth, latticePoints, imageSize, outputFolder, neighborCache=lattice.CACHEFOLDER, debug=False, seed=None, geometry=None, ascLogs=False, runName=None, mappedFolder=None, stateFile=None):
         """Constructor
         latticeWidth ... int width of rhombs in pixel
         latticePoints ... (int, int) lattice points in x and y direction
         imageSize ... (int, int) dimension of the resulting output images
-        outputFolder ... str location of the folder to save images"""
+        outputFolder ... str location of the folder to save images, None runs without any images and log files
+        neighborCache ... str folder in which neighbor shells are cached between runs, None disables the cache
+        debug ... bool cross-checks the reacted neighbor counters against a full recount after every reaction
+        seed ... int or numpy.random.SeedSequence seed of the random number generators of this lattice, None uses the global random state
+        geometry ... lattice.Lattice geometry and neighbor shells shared with other lattices of the same dimensions, None creates a new one
+        ascLogs ... bool also write the logs in the old .asc text format
+        runName ... str unique name of the run which is part of the log file names, None creates a new one
+        mappedFolder ... str folder for the memory-mapped geometry, neighbor shells, counters and state of very large lattices, None keeps everything in memory.
+                         The memory then stays bounded only for the sequential, block and parallel modes without back reactions, domains and correlations,
+                         model2DPropagation refuses the other settings. Images are rendered from the mapped state.
+        stateFile ... str .npy file with the reacted state of all rhombs in which the lattice starts, e.g. the state of an earlier run, None starts unreacted"""
 
         # logging related stuff
         self.outputFolder = outputFolder
-        # check if outputfolder exists and create it if not
-        if not os.path.exists(self.outputFolder):
-            os.makedirs(self.outputFolder)
-            print("created %s" % self.outputFolder)
-        # create a name for the model
-        self.modelName = os.path.basename(os.path.normpath(self.outputFolder))
-        # start the loggers
-        self.log = log.Logger("Log", self.outputFolder)
+        if self.outputFolder is not None:
+            # check if outputfolder exists and create it if not
+            if not os.path.exists(self.outputFolder):
+                os.makedirs(self.outputFolder)
+                print("created %s" % self.outputFolder)
+            # create a name for the model
+            self.modelName = os.path.basename(os.path.normpath(self.outputFolder))
+        else:
+            self.modelName = None
+        # start the loggers, both files of a run share the same unique name
+        self.runName = log.run_name() if runName is None else runName
+        self.ascLogs = ascLogs
+        self.log = log.Logger("Log", self.outputFolder, self.runName, ascLogs)
         self.log.log_text("Program initialized")
-        self.log_conversion = log.Logger("conversion", self.outputFolder)
+        self.log_conversion = log.Logger("conversion", self.outputFolder, self.runName, ascLogs)
         self.log.log_text("Conversion log created")
+        self.log_correlation = log.Logger("correlation", self.outputFolder, self.runName, ascLogs)
+        # conversion at every snapshot as list of (MCcycle, conversion)
+        self.conversionHistory = []
+        # pair correlations at every snapshot as list of (MCcycle, array[order, 3]), if they are sampled, see corr.Correlation
+        self.correlation = None
+        self.correlationHistory = []
+        # connected domains of reacted rhombs if they are tracked, see domains.Domains, and their statistics at every snapshot
+        self.log_domains = log.Logger("domains", self.outputFolder, self.runName, ascLogs, columns=("MCcycle", "conversion", "clusters", "largest", "wrapsX", "wrapsY"))
+        self.domains = None
+        # back reactions split domains, which union-find cannot follow, the domains are then rebuilt before they are read, see refresh_domains
+        self.domainsStale = False
+        self.domainHistory = []
+
+        # random number generators, independent streams if a seed is given
+        if seed is None:
+            self.random = random
+            self.numpyRandom = np.random
+        else:
+            sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+            self.random = random.Random(int(sequence.generate_state(1, np.uint64)[0]))
+            self.numpyRandom = np.random.default_rng(sequence)
 
         # set pixel dimensions for drawing
         self.latticeWidth = latticeWidth
         # this is a simple mathematical relation of hexagon width to height
-        self.latticeHeight = 1/2 * 2 * math.sqrt((latticeWidth / 2) ** 2 -
-                            (latticeWidth / 2 * math.cos(math.radians(60))) ** 2)
+        self.latticeHeight = renderer.lattice_height(latticeWidth)
 
         # generate the dimensions of the lattice, always even
         self.latticePointsX = latticePoints[0]
@@ -61,30 +102,145 @@ class Kagome():
         self.latticePointsY = latticePoints[1]
         if self.latticePointsY % 2 == 1: self.latticePointsY += 1
 
-        # stuff for drawing and image saving
-        self.image = Image.new('RGB', imageSize, 'white')
-        self.draw = ImageDraw.Draw(self.image)
+        # stuff for drawing and image saving, the image itself is only allocated when something is drawn, see self.image
+        self.imageSize = tuple(imageSize)
+        self.pilImage = None
+        self.pilDraw = None
         self.rhombColor = 'red'
+        self.renderer = None
+        # snapshots are written in the background with at most pendingImages waiting, pngCompression is the zlib level from 0 to 9
+        self.writer = None
+        self.pendingImages = 4
+        # binary log of all reactions, only open while model2DPropagation runs
+        self.eventLog = None
+        self.pngCompression = 6
+        # progress line, updated at most every progressInterval seconds and only on a terminal
+        self.progress = None
+        self.progressInterval = 0.5
+        # Monte Carlo steps whose random numbers are drawn at once in the block mode, 0 selects it from the lattice size and the rules
+        self.blockSize = 0
+        # worker processes of the parallel mode, 0 uses all cores, and Monte Carlo steps of two of its phases, 0 selects them from the lattice size
+        self.parallelWorkers = 0
+        self.phaseSteps = 0
+        # progress.Instrumentation statistics of the last run of model2DPropagation
+        self.stats = None
+        # checkpoints of the running simulation, see write_checkpoint
+        self.checkpointFile = None
+        self.checkpointCycle = 0
+        self.runSettings = None
 
         # centering the image on the tiling
-        self.imageXOffset = int((self.latticePointsX / 2 * self.latticeWidth - self.image.size[0]) / 2)
-        self.imageYOffset = int((self.latticePointsY * self.latticeHeight - self.image.size[1]) / 2)
+        self.imageXOffset, self.imageYOffset = renderer.image_offsets(self.latticePointsX, self.latticePointsY, self.latticeWidth, self.imageSize)
 
 
-        # generate rhomb lattice
-        self.numberAllLatticePoints = 0
-        self.lattice = self.generate_lattice_array()
-        for y in range(len(self.lattice)):
-            for x in range(len(self.lattice[y])):
-                self.lattice[y][x] = rhomb.Rhomb(x, y, self.latticePointsX, self.latticePointsY)
-                self.numberAllLatticePoints += 1
+        # generate the compact lattice, the state of each rhomb is an entry in a flat array
+        self.mappedFolder = mappedFolder
+        if geometry is None:
+            folder = None if mappedFolder is None else os.path.join(mappedFolder, "lattice_%ix%i" % (self.latticePointsX, self.latticePointsY))
+            geometry = lattice.Lattice(self.latticePointsX, self.latticePointsY, folder)
+        elif (geometry.latticePointsX, geometry.latticePointsY) != (self.latticePointsX, self.latticePointsY):
+            raise ValueError("The geometry has %ix%i lattice points instead of %ix%i" % (geometry.latticePointsX, geometry.latticePointsY, self.latticePointsX, self.latticePointsY))
+        self.geometry = geometry
+        if stateFile is not None and mappedFolder is not None and os.path.abspath(stateFile) == os.path.abspath(self.mapped_file_name("state")):
+            # a run with the same name continues in its own state file
+            self.reacted = np.load(stateFile, mmap_mode='r+')
+        else:
+            self.reacted = self.allocate("state", len(self.geometry), bool)
+            if stateFile is not None:
+                initialState = np.load(stateFile, mmap_mode='r')
+                if initialState.shape != self.reacted.shape:
+                    raise ValueError("The state file holds %i rhombs instead of %i" % (initialState.size, len(self.reacted)))
+                for start, stop in lattice.chunk_ranges(0, len(self.reacted)):
+                    self.reacted[start:stop] = initialState[start:stop]
+        self.shells = self.geometry.shells
+        self.neighborCache = neighborCache
+        # reacted neighbors of each rhomb by neighbor order, maintained while the state changes
+        self.neighborCounts = None
+        self.neighborSizes = None
+        # index of the reacted rhombs for the random choice of back reactions, only maintained while the sequential mode simulates them
+        self.reactedSites = None
+        self.debug = debug
+        self.numberAllLatticePoints = len(self.geometry)
+        # object like access to the rhombs via self.lattice[y][x]
+        self.lattice = rhomb.RhombRows(self)
         self.rhombCount = self.latticePointsY * self.latticePointsX / 2 + self.latticePointsY * self.latticePointsX / 4
         self.log.log_text("Lattice created")
         self.log.log_text("Created %i rhombs" % self.rhombCount)
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
     def __del__(self):
         """Destructor, cleaning up :) """
-        self.log.log_text("Destructor called")
+        # the loggers are the first files of the constructor, without all of them it failed before there was anything to close
+        if hasattr(self, "log_domains"):
+            self.close()
+
+    def close(self):
+        """Writes all pending images, events and log messages and closes the files, call it when the lattice is not needed anymore"""
+        # a constructor which failed after the loggers leaves the later attributes unset
+        if getattr(self, "writer", None) is not None:
+            self.close_writer()
+        if getattr(self, "eventLog", None) is not None:
+            self.close_event_log()
+        self.log.log_text("Closed")
+        self.log.close()
+        self.log_conversion.close()
+        self.log_correlation.close()
+        self.log_domains.close()
+        if getattr(self, "mappedFolder", None) is not None:
+            # the counters are recounted by every run, only the state is kept
+            for name in ("counts", "sizes"):
+                if os.path.exists(self.mapped_file_name(name)):
+                    os.remove(self.mapped_file_name(name))
+
+    def flush_logs(self):
+        """Writes the buffered messages and data of the loggers to their files"""
+        self.log.flush()
+        self.log_conversion.flush()
+        self.log_correlation.flush()
+        self.log_domains.flush()
+
+
+    @property
+    def image(self):
+        """PIL image of the size imageSize for drawing, allocated on first use so that runs which never draw do not hold it in memory"""
+        if self.pilImage is None:
+            # PIL is only loaded by runs which draw, see renderer
+            from PIL import Image, ImageDraw
+            self.pilImage = Image.new('RGB', self.imageSize, 'white')
+            self.pilDraw = ImageDraw.Draw(self.pilImage)
+        return self.pilImage
+
+    @property
+    def draw(self):
+        """ImageDraw of self.image"""
+        self.image
+        return self.pilDraw
+
+    def mapped_file_name(self, name):
+        """
+        Location of a memory-mapped array of this run.
+        name ... str name of the array, e.g. state
+        returns str path of the .npy file
+        """
+        return os.path.join(self.mappedFolder, "%s_%s.npy" % (name, self.runName))
+
+    def allocate(self, name, shape, dtype):
+        """
+        Creates a zeroed array for the state of the lattice, in memory or in a memory-mapped .npy file of this run if there is a mappedFolder.
+        name ... str name of the array, part of the file name
+        shape ... int or tuple shape of the array
+        dtype ... numpy.dtype type of the elements
+        returns array the new array
+        """
+        if self.mappedFolder is None:
+            return np.zeros(shape, dtype=dtype)
+        os.makedirs(self.mappedFolder, exist_ok=True)
+        return np.lib.format.open_memmap(self.mapped_file_name(name), mode='w+', dtype=dtype, shape=shape if isinstance(shape, tuple) else (shape,))
 
 
     def debug_draw_neighbors(self, x, y):
@@ -102,30 +258,143 @@ class Kagome():
         Gets a rhomb at the specific coordinates. This also ensures the torus like shape of the sheet.
         x ... int x coordinate in the lattice
         y ... int y coordinate in the lattice
-        retruns Rhomb a rhomb at the given lattice points
+        retruns RhombView a view on the rhomb at the given lattice points
         """
-        # check y
-        if y < 0:
-            y = y + self.latticePointsY
-        else:
-            y = y % self.latticePointsY
+        return rhomb.RhombView(self, self.geometry.index(x, y))
+
+
+    def site_index(self, currentRhomb):
+        """
+        Flat index of a rhomb.
+        currentRhomb ... Rhomb, RhombView or int the rhomb or its flat index
+        returns int flat site index
+        """
+        if isinstance(currentRhomb, rhomb.RhombView):
+            return currentRhomb.index
+        elif isinstance(currentRhomb, rhomb.Rhomb):
+            return int(self.geometry.index(currentRhomb.x, currentRhomb.y))
+        return int(currentRhomb)
 
-        if x >= self.latticePointsX:
-            x = x % self.latticePointsX
-        # # check x
-        if y % 2 == 1:
-            divisor = 2
-        else:
-            divisor = 1
-        if x >= (self.latticePointsX / divisor):
-            x = x % (self.latticePointsX / divisor)
 
-        return self.lattice[y][x]
+    def set_reacted(self, i, value=True):
+        """
+        Changes the state of a single rhomb.
+        i ... int flat site index
+        value ... bool new state of the rhomb
+        """
+        if self.reacted[i] == value:
+            return
+        self.reacted[i] = value
+        if self.reactedSites is not None:
+            if value:
+                self.reactedSites.add(i)
+            else:
+                self.reactedSites.remove(i)
+        if self.domains is not None:
+            if not value:
+                self.domainsStale = True
+            elif not self.domainsStale:
+                self.domains.add(i)
+        # update the reacted neighbor counters of all rhombs which have this one as neighbor
+        if self.neighborCounts is not None:
+            change = 1 if value else -1
+            for order in range(len(self.neighborCounts)):
+                offsets, indices = self.shells.reverse(order + 1)
+                np.add.at(self.neighborCounts[order], indices[offsets[i]:offsets[i + 1]], change)
+            if self.debug:
+                self.verify_neighbor_counts()
+
+
+    def refresh_domains(self):
+        """
+        Rebuilds the domains from the state if back reactions have split them since the last rebuild.
+        The number of reacted rhombs of the first percolation is kept, percolations in between are noticed at the rebuild.
+        """
+        if self.domains is None or not self.domainsStale:
+            return
+        percolationSize = self.domains.percolationSize
+        self.domains = domains.Domains(self.geometry, self.reacted)
+        if percolationSize is not None:
+            self.domains.percolationSize = percolationSize
+        self.domainsStale = False
+
+
+    def set_reacted_many(self, sites, value=True):
+        """
+        Changes the state of many rhombs at once.
+        Many changes update the counters by a count over the lattice, for a lattice in a mappedFolder it is done one chunk of
+        lattice.CHUNKSITES rhombs at a time, so no array over the whole lattice is allocated.
+        sites ... array int flat indices of distinct rhombs which are all in the other state
+        value ... bool new state of the rhombs
+        """
+        if len(sites) == 0:
+            return
+        self.reacted[sites] = value
+        if self.reactedSites is not None:
+            for i in np.asarray(sites).tolist():
+                if value:
+                    self.reactedSites.add(i)
+                else:
+                    self.reactedSites.remove(i)
+        if self.domains is not None:
+            if not value:
+                self.domainsStale = True
+            elif not self.domainsStale:
+                self.domains.add_many(sites)
+        if self.neighborCounts is not None:
+            for order in range(1, len(self.neighborCounts) + 1):
+                offsets, indices = self.shells.reverse(order)
+                owner, members = lattice.gather(offsets, indices, sites)
+                if 8 * len(members) < self.numberAllLatticePoints:
+                    # a few changes are cheaper in place than a count over the whole lattice
+                    (np.add if value else np.subtract).at(self.neighborCounts[order - 1], members, 1)
+                elif self.mappedFolder is not None:
+                    members = np.sort(members)
+                    for start, stop in lattice.chunk_ranges(0, self.numberAllLatticePoints):
+                        first, last = np.searchsorted(members, [start, stop])
+                        counts = np.bincount(members[first:last] - start, minlength=stop - start).astype(np.uint8)
+                        if value:
+                            self.neighborCounts[order - 1][start:stop] += counts
+                        else:
+                            self.neighborCounts[order - 1][start:stop] -= counts
+                elif value:
+                    self.neighborCounts[order - 1] += np.bincount(members, minlength=self.numberAllLatticePoints).astype(np.uint8)
+                else:
+                    self.neighborCounts[order - 1] -= np.bincount(members, minlength=self.numberAllLatticePoints).astype(np.uint8)
+            if self.debug:
+                self.verify_neighbor_counts()
+
+
+    def count_all_neighbors(self, maxNeighborOrder):
+        """
+        Sets up the reacted neighbor counters of all rhombs up to a given order by a full recount.
+        Afterwards the counters are updated with every change of state.
+        maxNeighborOrder ... int highest order of neighbors which is counted
+        """
+        self.calculate_neighbor_shells(maxNeighborOrder)
+        self.neighborCounts = self.allocate("counts", (maxNeighborOrder, self.numberAllLatticePoints), np.uint8)
+        self.neighborSizes = self.allocate("sizes", (maxNeighborOrder, self.numberAllLatticePoints), np.uint8)
+        for order in range(1, maxNeighborOrder + 1):
+            for start, stop in lattice.chunk_ranges(0, self.numberAllLatticePoints):
+                self.neighborCounts[order - 1][start:stop] = self.shells.count(order, self.reacted, start, stop)
+                self.neighborSizes[order - 1][start:stop] = self.shells.sizes(order, start, stop)
+
+
+    def verify_neighbor_counts(self):
+        """
+        Debug function. Compares the reacted neighbor counters with a full recount.
+        """
+        for order in range(1, len(self.neighborCounts) + 1):
+            wrong = np.flatnonzero(self.neighborCounts[order - 1] != self.shells.count(order, self.reacted))
+            if len(wrong) > 0:
+                raise RuntimeError("Reacted neighbor counter of order %i is wrong for %i rhombs, e.g. rhomb %s" % (order, len(wrong), self.geometry.coordinates(wrong[0])))
 
 
+    @deprecated
     def calculate_Nth_neighbor(self, nMinus1, nMinus2):
         """
         Calculates the second and higher neighbors. The order of the neighbors is given by N
+        Superseded by calculate_neighbor_shells which works on integer indices of the whole lattice at once.
         nMinus1 ... array of tuples of the N - 2 neighbors
         nMinus2 ... array of tuples of the N - 2 neighbors
         returns a tuple array of the coordinates of the Nth neighbors
@@ -151,15 +420,15 @@ class Kagome():
         return complete
 
 
-    def generate_lattice_array(self):
+    def calculate_neighbor_shells(self, maxNeighborOrder):
         """
-        Creates an empty numpy array with all lattice points.
-        return ... array[array] emtpy array with correct indices
+        Calculates the higher neighbor shells of all rhombs, or reads them from the cache, and stores them in self.shells.
+        maxNeighborOrder ... int highest order of neighbors which is required
         """
-        lattice = np.empty(self.latticePointsY, dtype=object)
-        for y in range(len(lattice)):
-            lattice[y] = np.empty(int(self.latticePointsX / (y % 2 + 1)), dtype=object)
-        return lattice
+        if len(self.shells) < maxNeighborOrder:
+            print("Working on neighbors up to order %i" % maxNeighborOrder)
+            lattice.build_neighbor_shells(self.geometry, self.shells, maxNeighborOrder, self.neighborCache)
+            self.log.log_text("Neighbor shells up to order %i ready" % maxNeighborOrder)
 
 
     def kag_to_screen(self, x, y):
@@ -169,16 +438,7 @@ class Kagome():
         y ... int y-coordinate of the Kagome lattice point
         returns a tuple of (x, y) coordinates to draw on an image.
         """
-        if y % 2 == 0:
-            indent = self.latticeWidth / 4
-            step = self.latticeWidth / 2
-        else:
-            indent = 0
-            step = self.latticeWidth
-        if (y + 1) % 4 == 0:
-            indent = self.latticeWidth / 2
-        return (x * step + indent - self.imageXOffset,
-                y * self.latticeHeight - self.imageYOffset)
+        return renderer.kag_to_screen(x, y, self.latticeWidth, self.latticeHeight, self.imageXOffset, self.imageYOffset)
 
 
     def rhomb_at_kagome(self, x, y):
@@ -187,15 +447,7 @@ class Kagome():
         x ... int x-coordinate of the Kagome lattice point
         y ... int y-coordinate of the Kagome lattice point
         """
-        draw_x, draw_y = self.kag_to_screen(x, y) # converting to drawing coordinates
-        # figure out the right orientation
-        if y % 2 == 1:
-            self.draw.polygon(rhomb.lying(draw_x, draw_y, self.latticeWidth, self.latticeHeight), self.rhombColor)
-        elif ((y % 2 == 0 and x % 2 == 1 and y % 4 == 0) or
-              (y % 2 == 0 and x % 2 == 0 and y % 4 == 2)):
-            self.draw.polygon(rhomb.right(draw_x, draw_y, self.latticeWidth, self.latticeHeight), self.rhombColor)
-        else:
-            self.draw.polygon(rhomb.left(draw_x, draw_y, self.latticeWidth, self.latticeHeight), self.rhombColor)
+        self.draw.polygon(renderer.rhomb_polygon(x, y, self.latticeWidth, self.latticeHeight, self.imageXOffset, self.imageYOffset), self.rhombColor)
 
 
     def get_random_point(self):
@@ -203,38 +455,103 @@ class Kagome():
         Generates a random coordinate from the lattice.
         return ... (int, int) kagome lattice coordinates
         """
-        y = random.randint(0, len(self.lattice) - 1)
-        x = random.randint(0, len(self.lattice[y]) - 1)
+        y = self.random.randint(0, self.latticePointsY - 1)
+        x = self.random.randint(0, int(self.geometry.rowLength[y]) - 1)
         return (x, y)
 
 
-    def draw_tiling(self):
+    def visible_sites(self):
+        """
+        returns array int64 flat indices of the rhombs which are on the image, see renderer.visible_sites
+        """
+        return renderer.visible_sites(self.geometry, self.latticeWidth, self.latticeHeight, self.imageSize, self.imageXOffset, self.imageYOffset)
+
+
+    def draw_tiling(self, sites=None):
         """
         Creates an outline overlay of the rhombille tiling and fills it with reacted rhombs.
+        sites ... array int flat indices of the rhombs which are drawn, None draws all rhombs on the image
         """
-        for y in range(len(self.lattice)):
-            for x in range(len(self.lattice[y])):
-                draw_x, draw_y = self.kag_to_screen(x, y) # converting to drawing coordinates
-                # determine the orientation
-                if y % 2 == 1:
-                    self.draw.polygon(rhomb.lying(draw_x, draw_y, self.latticeWidth, self.latticeHeight), outline=1)
-                elif ((y % 2 == 0 and x % 2 == 1 and y % 4 == 0) or
-                      (y % 2 == 0 and x % 2 == 0 and y % 4 == 2)):
-                    self.draw.polygon(rhomb.right(draw_x, draw_y, self.latticeWidth, self.latticeHeight), outline=1)
-                else:
-                    self.draw.polygon(rhomb.left(draw_x, draw_y, self.latticeWidth, self.latticeHeight), outline=1)
+        if sites is None:
+            sites = self.visible_sites()
+        for i in sites.tolist():
+            self.draw.polygon(renderer.rhomb_polygon(int(self.geometry.siteX[i]), int(self.geometry.siteY[i]), self.latticeWidth, self.latticeHeight,
+                                                     self.imageXOffset, self.imageYOffset), outline=1)
 
 
     def draw_image(self):
         """
-        Draws an image of the current state.
+        Draws an image of the current state, rhombs outside of the image are skipped.
+        Rhombs smaller than renderer.DENSITYTHRESHOLD pixels are not drawn one by one, the image shows the local conversion instead.
+        """
+        if renderer.pixels_per_rhomb(self.latticeWidth) < renderer.DENSITYTHRESHOLD:
+            self.image.paste(self.get_renderer().render(self.reacted))
+            return
+        sites = self.visible_sites()
+        for i in sites[self.reacted[sites]].tolist():
+            self.rhomb_at_kagome(*self.geometry.coordinates(i))
+        self.draw_tiling(sites)
+
+
+    def get_renderer(self):
+        """
+        Renderer for snapshots, the tiling is rasterized on the first call.
+        returns renderer.LabelMapRenderer or renderer.DensityRenderer renderer which fits the geometry and image of this lattice, see renderer.make_renderer
+        """
+        if self.renderer is None:
+            self.renderer = renderer.make_renderer(self.geometry, self.latticeWidth, self.latticeHeight, self.imageSize,
+                                                   self.imageXOffset, self.imageYOffset, self.rhombColor)
+        return self.renderer
+
+
+    def render_viewport(self, center, latticeWidth, imageSize=None):
+        """
+        Image of a part of the current state at any zoom, only the rhombs in view are rasterized, so it is cheap also for huge lattices.
+        center ... (int, int) kagome lattice point in the center of the image
+        latticeWidth ... width of the rhombs in pixel, the zoom of the view
+        imageSize ... (int, int) dimension of the image, None uses the one of this lattice
+        returns PIL.Image image of the view
+        """
+        return renderer.render_viewport(self.geometry, self.reacted, center, latticeWidth, self.imageSize if imageSize is None else imageSize,
+                                        reactedColor=self.rhombColor)
+
+
+    def get_writer(self):
+        """
+        Background writer for snapshots, started on the first call.
+        returns writer.SnapshotWriter writer which saves the images of this lattice
+        """
+        if self.writer is None:
+            self.writer = writer.SnapshotWriter(self.pendingImages, self.pngCompression)
+        return self.writer
+
+
+    def close_writer(self, raiseError=True):
+        """
+        Waits until all snapshots are written and stops the background writer.
+        raiseError ... bool raise errors which occurred while writing
         """
-        for y in range(len(self.lattice)):
-            for x in range(len(self.lattice[y])):
-                r = self.lattice[y][x]
-                if r.reacted:
-                    self.rhomb_at_kagome(r.x, r.y)
-        self.draw_tiling()
+        if self.writer is not None:
+            imageWriter, self.writer = self.writer, None
+            imageWriter.close(raiseError)
+
+
+    def close_event_log(self):
+        """
+        Writes all buffered reaction events and closes the event log.
+        """
+        if self.eventLog is not None:
+            eventLog, self.eventLog = self.eventLog, None
+            eventLog.close()
+
+
+    def image_file_name(self, cycle):
+        """
+        Location of an image.
+        cycle ... int number of the image, i.e. position number of the current Monte Carlo cycle.
+        returns str path of the image
+        """
+        return self.outputFolder + "%s.png" % cycle
 
 
     def save_image(self, cycle):
@@ -242,85 +559,231 @@ class Kagome():
         Saves the current image.
         cycle ... int number of the image, i.e. position number of the current Monte Carlo cycle.
         """
-        self.image.save(self.outputFolder + "%s.png" % cycle)
+        self.image.save(self.image_file_name(cycle))
 
 
-    def model2DPropagation(self, reactivityModifiers, MCcycleMax, seeds=0, imageCycle=0):
+    def model2DPropagation(self, reactivityModifiers, MCcycleMax, seeds=0, imageCycle=0, mode="sequential", eventLog=None, timing=False, statsFile=None, checkpointFile=None, checkpointCycle=0, correlationOrder=0, trackDomains=False, state=None, backReactionModifiers=None):
         """
         Run a Monte Carlo Simulation with a given rule set.
         reactivityModifiers ... array of ReactivityModifier rule set which is applied to the simulation
         MCcycleMax ... int or float if int, this is the number of how many time steps the simulation should run, if float, simulation stops when the conversion reaches that value
         seeds ... int number of randomly created seeds before the model should run
         imageCycle ... int determines after how many Monte Carlo iterations an image of the current state should be created and saved, a value of 0 turns it of
+        mode ... str "sequential" picks a random rhomb in every step, "rejectionfree" only simulates the steps in which a rhomb reacts and skips the others,
+                 "synchronous" updates all rhombs at once in every step as described in pseudocode.txt, MCcycle then counts sweeps over the lattice,
+                 "block" is the sequential dynamics with the random numbers of many steps drawn at once, see run_block,
+                 "parallel" runs the sequential dynamics on stripes of the lattice in several processes, see run_parallel
+        eventLog ... str path of a binary log which records every reaction, see trajectory.Trajectory for reading it, None turns it off
+        timing ... bool measure how the time splits between site selection, rule evaluation, rendering and logging, see self.stats
+        statsFile ... str path of a json file to which the statistics of the run are written at its end, None skips it
+        checkpointFile ... str path of a checkpoint from which an interrupted run can be continued with checkpoint.resume, None turns checkpoints off
+        checkpointCycle ... int number of Monte Carlo cycles between two checkpoints
+        correlationOrder ... int pair correlations up to this neighbor order are sampled with every snapshot, see self.correlationHistory, 0 turns them off
+        trackDomains ... bool keep track of the connected domains of reacted rhombs, see self.domains and self.domainHistory
+        state ... dict state of a checkpoint from which the run continues instead of starting with seeds, see resume
+        backReactionModifiers ... array of ReactivityModifier rule set of the back reaction of reacted rhombs, which is evaluated like the one of the reaction,
+                                  e.g. a single modifier with nan requirements is a constant rate, None or an empty rule set makes the reaction irreversible.
+                                  Back reactions are supported by the sequential, rejection-free and synchronous modes
+        With a mappedFolder only the sequential, block and parallel modes without back reactions, domains and correlations are supported,
+        the others hold arrays over the whole lattice in memory.
         """
+        backReactionModifiers = list(backReactionModifiers or [])
+        if backReactionModifiers and mode not in ("sequential", "rejectionfree", "synchronous"):
+            raise ValueError("The %s mode does not support back reactions" % mode)
+        if self.mappedFolder is not None:
+            unsupported = [name for name, used in (("the %s mode" % mode, mode in ("rejectionfree", "synchronous")), ("back reactions", bool(backReactionModifiers)),
+                                                   ("trackDomains", trackDomains), ("correlationOrder", correlationOrder > 0)) if used]
+            if unsupported:
+                raise ValueError("A lattice in a mappedFolder does not support %s, they keep arrays over the whole lattice in memory" % ", ".join(unsupported))
         # calculating the highest neighbor correlations
         maxNeighborOrder = 1
-        for modifier in reactivityModifiers:
+        for modifier in list(reactivityModifiers) + backReactionModifiers:
             maxNeighborOrder = max(maxNeighborOrder, modifier.neighborOrder)
 
-        # calculating higher neighbors of rhombs and building the grid
-        if maxNeighborOrder > 1:
-            count = 0
-            for y in range(len(self.lattice)):
-                for x in range(len(self.lattice[y])):
-                    count += 1
-                    rhomb = self.getRhomb(x, y)
-                    completeShells = 1 # first neighbor are already known
-                    # run through increasing neighboring shells and fill them with neighbors
-                    while completeShells < maxNeighborOrder:
-                        print("Working on neighbor %i of rhomb %i of %i      " % (completeShells + 1, count, self.rhombCount), end='\r')
-                        # special case for the second neighbors
-                        if completeShells == 1:
-                            nMinus1 = rhomb.neighbors[0]
-                            nMinus2 = rhomb.identifier
-                        else:
-                            nMinus1 = rhomb.neighbors[completeShells - 1]
-                            nMinus2 = rhomb.neighbors[completeShells - 2]
-                        # remove duplicate and lower neighbors
-                        nth = self.calculate_Nth_neighbor(nMinus1, nMinus2)
-                        rhomb.neighbors[completeShells] = nth
-                        completeShells += 1
+        # calculating higher neighbors of rhombs and building the grid, then counting the reacted neighbors
+        self.count_all_neighbors(maxNeighborOrder)
+        if correlationOrder > 0:
+            # higher orders than the rules need are recounted for each sample instead of being maintained
+            self.calculate_neighbor_shells(correlationOrder)
+            self.correlation = corr.Correlation(self.shells, correlationOrder)
+            self.log_correlation.columns = ["MCcycle", "conversion"] + self.correlation.columns()
+        else:
+            self.correlation = None
         print("\nFinished with neighbors!")
 
-        converted = 0
-        if seeds > 0:
-            print("Generating seeds")
-            self.generate_seeds(seeds)
-            converted += seeds
+        self.progress = progress.ProgressReporter(self.progressInterval)
+        self.stats = progress.Instrumentation(timing)
+        self.checkpointFile = checkpointFile
+        self.checkpointCycle = checkpointCycle if checkpointFile is not None else 0
+        # everything a checkpoint needs to start the run again
+        self.runSettings = {"rules": checkpoint.rules_to_list(reactivityModifiers), "MCcycleMax": MCcycleMax, "seeds": seeds, "imageCycle": imageCycle,
+                            "mode": mode, "eventLog": eventLog, "timing": timing, "statsFile": statsFile,
+                            "checkpointFile": checkpointFile, "checkpointCycle": checkpointCycle, "correlationOrder": correlationOrder,
+                            "trackDomains": trackDomains, "backRules": checkpoint.rules_to_list(backReactionModifiers)}
+        # the domains of the current state, they follow every change from now on
+        self.domains = domains.Domains(self.geometry, self.reacted) if trackDomains else None
+        self.domainsStale = False
+        # a checkpoint keeps the order of the index, the random choice of a reacted rhomb depends on it
+        if not backReactionModifiers or mode != "sequential":
+            self.reactedSites = None
+        elif state is not None and state["reactedSites"] is not None:
+            self.reactedSites = lattice.SiteSet(self.numberAllLatticePoints, state["reactedSites"])
+        else:
+            self.reactedSites = lattice.SiteSet(self.numberAllLatticePoints, np.flatnonzero(self.reacted))
+        try:
+            if eventLog is not None:
+                # a resumed run cuts its log back to the checkpoint, a new run starts a new one
+                self.eventLog = trajectory.EventLog(eventLog, self.geometry, resume=state is not None)
+            if state is None:
+                MCcycle = 0
+                classes = None
+                backClasses = None
+                # rhombs which have reacted before, e.g. in a state file
+                converted = int(np.count_nonzero(self.reacted))
+                if self.eventLog is not None and converted > 0:
+                    # they are logged like seeds, a trajectory replays from an unreacted lattice
+                    for start, stop in lattice.chunk_ranges(0, self.numberAllLatticePoints):
+                        self.eventLog.record_many(-1, start + np.flatnonzero(self.reacted[start:stop]))
+                if seeds > 0:
+                    print("Generating seeds")
+                    converted += self.generate_seeds(seeds)
+            else:
+                MCcycle = state["MCcycle"]
+                classes = state["classes"]
+                backClasses = state["backClasses"]
+                converted = state["converted"]
+                if self.eventLog is not None:
+                    self.eventLog.truncate(state["events"])
+                if self.domains is not None:
+                    self.domains.percolationSize = state["percolationSize"]
+
+            # the whole rule set becomes a few lookup tables
+            rules = self.compile_rules(reactivityModifiers)
+            backRules = self.compile_rules(backReactionModifiers) if backReactionModifiers else None
 
-        print("Starting MC simulation...")
+            print("Starting MC simulation...")
+            self.log.log_text("Starting MC simulation")
+            convertedBefore = converted
+            self.stats.start()
+            if mode == "sequential":
+                MCcycle, converted = self.run_sequential(rules, MCcycleMax, imageCycle, converted, MCcycle, backRules)
+            elif mode == "rejectionfree":
+                MCcycle, converted = self.run_rejection_free(rules, MCcycleMax, imageCycle, converted, MCcycle, classes, backRules, backClasses)
+            elif mode == "synchronous":
+                MCcycle, converted = self.run_synchronous(rules, MCcycleMax, imageCycle, converted, MCcycle, backRules)
+            elif mode == "block":
+                MCcycle, converted = self.run_block(rules, MCcycleMax, imageCycle, converted, MCcycle)
+            elif mode == "parallel":
+                MCcycle, converted = self.run_parallel(rules, MCcycleMax, imageCycle, converted, MCcycle)
+            else:
+                raise ValueError("Unknown simulation mode %s" % mode)
+            self.stats.steps = MCcycle - (state["MCcycle"] if state is not None else 0)
+            if mode != "synchronous":
+                # every Monte Carlo step selects one rhomb, also the ones skipped by the rejection-free mode
+                self.stats.attempts = self.stats.steps
+            self.stats.reactions = converted - convertedBefore + self.stats.backReactions
+            # writing out the last state
+            self.snapshot(MCcycle, converted)
+            self.stats.stop()
+        except BaseException:
+            # all images and events are written when the run fails, without hiding the reason of the failure
+            self.progress.finish()
+            self.close_writer(raiseError=False)
+            self.close_event_log()
+            self.flush_logs()
+            raise
+        self.close_writer()
+        self.close_event_log()
+
+        self.progress.finish()
+        print("Done!")
+        self.log.log_text("MC ended")
+        if self.domains is not None and self.domains.percolates():
+            self.log.log_text("A domain wraps around the torus since %i rhombs have reacted" % self.domains.percolationSize)
+        self.log.log_text(str(self.stats))
+        if statsFile is not None:
+            self.stats.dump(statsFile)
+        self.flush_logs()
+
+
+    def run_sequential(self, rules, MCcycleMax, imageCycle, converted, MCcycle=0, backRules=None):
+        """
+        Random sequential dynamics, each Monte Carlo step selects a random rhomb which might react.
+        With back reactions every step also selects a random rhomb out of all of them, if it has reacted it might react back.
+        rules ... CompiledRules rule set which is applied to the simulation
+        MCcycleMax ... int or float stop criterion, see model2DPropagation
+        imageCycle ... int number of Monte Carlo steps between two snapshots, 0 turns them off
+        converted ... int number of rhombs which have reacted before the simulation
+        MCcycle ... int Monte Carlo cycle at which the simulation starts
+        backRules ... CompiledRules rule set of the back reaction, None for irreversible reactions
+        returns (int, int) the Monte Carlo cycle and the number of converted rhombs at the end
+        """
         runSimulation = True
-        MCcycle = 0
-        self.log.log_text("Starting MC simulation")
+        nextCheckpoint = self.next_checkpoint(MCcycle)
+        rowStart = self.geometry.rowStart.tolist()
+        # the clock is only read if the time split is measured
+        timing = self.stats.timing
+        clock = time.perf_counter
+        evaluations = 0
+        backReactions = 0
+        selectionTime = rulesTime = loggingTime = 0.0
         while runSimulation:
             # each run is a single time step
-            if type(MCcycleMax) == float:
-                print("Current step: %i, conversion is %0.02f" % (MCcycle, converted / self.numberAllLatticePoints), end='\r')
-            else:
-                print("Current step: %i of %i" % (MCcycle + 1, MCcycleMax), end='\r')
+            if MCcycle % 1024 == 0 and self.progress.due():
+                self.show_progress("step", MCcycle, MCcycleMax, converted)
+            if MCcycle >= nextCheckpoint:
+                self.write_checkpoint(MCcycle, converted)
+                nextCheckpoint = self.next_checkpoint(MCcycle)
 
             # select a rhomb a do stuff with it
+            if timing: start = clock()
             x, y = self.get_random_point()
-            currentRhomb = self.getRhomb(x, y)
-            if not currentRhomb.reacted:
-                chanceToReact = 1 # when a photon arrives, it reacts
-                # applying all modifiers to reactivity
-                for modifier in reactivityModifiers:
-                    if self.modifierApplies(currentRhomb, modifier):
-                        chanceToReact *= modifier.r
-
-                if random.random() <= chanceToReact:
-                    self.lattice[y][x].reacted = True
+            i = rowStart[y] + x
+            if timing:
+                selected = clock()
+                selectionTime += selected - start
+            if not self.reacted[i]:
+                evaluations += 1
+                # when a photon arrives, it reacts with the probability given by all modifiers
+                chanceToReact = rules.chance(self.neighborCounts, self.neighborSizes, i)
+
+                reacts = self.random.random() <= chanceToReact
+                if reacts:
+                    self.set_reacted(i)
                     converted += 1
+                if timing:
+                    evaluated = clock()
+                    rulesTime += evaluated - selected
+                if reacts and self.eventLog is not None:
+                    self.eventLog.record(MCcycle, i)
+                    if timing: loggingTime += clock() - evaluated
+
+            if backRules is not None:
+                # a position beyond the index of reacted rhombs selects an unreacted one, which cannot react back
+                if timing: start = clock()
+                k = int(self.random.random() * self.numberAllLatticePoints)
+                if timing:
+                    selected = clock()
+                    selectionTime += selected - start
+                if k < len(self.reactedSites):
+                    i = self.reactedSites.dense[k]
+                    evaluations += 1
+                    reactsBack = self.random.random() <= backRules.chance(self.neighborCounts, self.neighborSizes, i)
+                    if reactsBack:
+                        self.set_reacted(i, False)
+                        converted -= 1
+                        backReactions += 1
+                    if timing:
+                        evaluated = clock()
+                        rulesTime += evaluated - selected
+                    if reactsBack and self.eventLog is not None:
+                        self.eventLog.record(MCcycle, ~i)
+                        if timing: loggingTime += clock() - evaluated
 
             # save an image after ever imageCycle Monte Carlo interations
             if imageCycle > 0:
                 if MCcycle % imageCycle == 0:
-                    self.log_conversion.log_xy(MCcycle, converted / self.numberAllLatticePoints)
-                    self.image = Image.new('RGB', self.image.size, 'white')
-                    self.draw = ImageDraw.Draw(self.image)
-                    self.draw_image()
-                    self.save_image(MCcycle)
+                    self.snapshot(MCcycle, converted)
 
             # step up in the Monte Carlo cycle
             MCcycle += 1
@@ -331,37 +794,595 @@ class Kagome():
             elif type(MCcycleMax) == int:
                 if MCcycle >= MCcycleMax:
                     runSimulation = False
-        # writing out the last state
+        self.stats.evaluations += evaluations
+        self.stats.backReactions += backReactions
+        self.stats.add("selection", selectionTime)
+        self.stats.add("rules", rulesTime)
+        self.stats.add("logging", loggingTime)
+        return MCcycle, converted
+
+
+    def run_rejection_free(self, rules, MCcycleMax, imageCycle, converted, MCcycle=0, classes=None, backRules=None, backClasses=None):
+        """
+        Rejection-free (n-fold way) version of the random sequential dynamics.
+        Unreacted rhombs are grouped by the probability that a single Monte Carlo step selects them and they react, see reaction_rates.
+        Every event is a reaction, the number of Monte Carlo steps until it happens is drawn from the geometric distribution,
+        so MCcycle, snapshots and conversion curves are statistically the same as for run_sequential.
+        With back reactions the reacted rhombs are grouped in the same way by the probability that they react back. A step of run_sequential
+        attempts a reaction and then a back reaction, so a step with a reaction is followed by a back reaction attempt on the changed lattice.
+        rules ... CompiledRules rule set which is applied to the simulation
+        MCcycleMax ... int or float stop criterion, see model2DPropagation
+        imageCycle ... int number of Monte Carlo steps between two snapshots, 0 turns them off
+        converted ... int number of rhombs which have reacted before the simulation
+        MCcycle ... int Monte Carlo cycle at which the simulation starts
+        classes ... lattice.RateClasses rates of all rhombs restored from a checkpoint, None calculates them
+        backRules ... CompiledRules rule set of the back reaction, None for irreversible reactions
+        backClasses ... lattice.RateClasses back reaction rates of all rhombs restored from a checkpoint, None calculates them
+        returns (int, int) the Monte Carlo cycle and the number of converted rhombs at the end
+        """
+        # get_random_point selects a row first, so rhombs in the shorter odd rows are picked twice as often
+        selection = 1 / (self.latticePointsY * self.geometry.rowLength[self.geometry.siteY])
+        if classes is None:
+            classes = lattice.RateClasses(self.numberAllLatticePoints, self.reaction_rates(rules, selection))
+        if backRules is None:
+            backClasses = None
+        elif backClasses is None:
+            backClasses = lattice.RateClasses(self.numberAllLatticePoints, self.back_reaction_rates(backRules))
+        reverseShells = [self.shells.reverse(order) for order in range(1, len(self.neighborCounts) + 1)]
+
+        timing = self.stats.timing
+        clock = time.perf_counter
+        nextCheckpoint = self.next_checkpoint(MCcycle)
+        while True:
+            if self.progress.due():
+                self.show_progress("step", MCcycle, MCcycleMax, converted)
+            if MCcycle >= nextCheckpoint:
+                self.write_checkpoint(MCcycle, converted, classes, backClasses)
+                nextCheckpoint = self.next_checkpoint(MCcycle)
+
+            if timing: start = clock()
+            # probability that the next Monte Carlo step leads to a reaction
+            total = classes.total()
+            if backClasses is not None:
+                # the step changes the lattice unless both of its attempts fail
+                backTotal = backClasses.total()
+                total = total + backTotal - total * backTotal
+            if total <= 0:
+                if type(MCcycleMax) == float:
+                    self.log.log_text("No rhomb can react anymore, conversion %0.04f is final" % (converted / self.numberAllLatticePoints))
+                    return MCcycle, converted
+                reactionCycle = MCcycleMax
+            elif total >= 1:
+                reactionCycle = MCcycle
+            else:
+                reactionCycle = MCcycle + int(math.log(1 - self.random.random()) / math.log1p(-total))
+            if timing: self.stats.add("selection", clock() - start)
+
+            # the steps before the reaction leave the lattice unchanged
+            lastCycle = reactionCycle if type(MCcycleMax) != int else min(reactionCycle, MCcycleMax)
+            if imageCycle > 0:
+                for cycle in range(-(-MCcycle // imageCycle) * imageCycle, lastCycle, imageCycle):
+                    self.snapshot(cycle, converted)
+            if type(MCcycleMax) == int and reactionCycle >= MCcycleMax:
+                return MCcycleMax, converted
+
+            # the step either has a reaction, which may be followed by a back reaction, or only a back reaction
+            reactsBack = backClasses is not None and self.random.random() * total >= classes.total()
+            while True:
+                if timing: start = clock()
+                i = (backClasses if reactsBack else classes).choice(self.random.random())
+                if timing:
+                    selected = clock()
+                    self.stats.add("selection", selected - start)
+                self.set_reacted(i, not reactsBack)
+                if reactsBack:
+                    converted -= 1
+                    self.stats.backReactions += 1
+                else:
+                    converted += 1
+                # only the rhombs which have the changed one in a neighbor shell change their reactivity
+                affected = np.unique(np.concatenate([indices[offsets[i]:offsets[i + 1]] for offsets, indices in reverseShells] + [[i]]))
+                for j, rate in zip(affected.tolist(), self.reaction_rates(rules, selection, affected).tolist()):
+                    classes.update(j, rate)
+                if backClasses is not None:
+                    for j, rate in zip(affected.tolist(), self.back_reaction_rates(backRules, affected).tolist()):
+                        backClasses.update(j, rate)
+                self.stats.evaluations += len(affected)
+                if timing:
+                    evaluated = clock()
+                    self.stats.add("rules", evaluated - selected)
+                if self.eventLog is not None:
+                    self.eventLog.record(reactionCycle, ~i if reactsBack else i)
+                    if timing: self.stats.add("logging", clock() - evaluated)
+                if reactsBack or backClasses is None or self.random.random() >= backClasses.total():
+                    break
+                reactsBack = True
+
+            if imageCycle > 0 and reactionCycle % imageCycle == 0:
+                self.snapshot(reactionCycle, converted)
+            MCcycle = reactionCycle + 1
+            if type(MCcycleMax) == float and converted / self.numberAllLatticePoints >= MCcycleMax:
+                return MCcycle, converted
+
+
+    def reaction_rates(self, rules, selection, sites=None):
+        """
+        Probability that a single Monte Carlo step of the random sequential dynamics selects a rhomb and it reacts.
+        rules ... CompiledRules rule set of the reaction
+        selection ... array float probability that a step selects each rhomb
+        sites ... array int flat indices of the rhombs, None selects all of them
+        returns array float rate of each rhomb, 0 for reacted ones
+        """
+        index = slice(None) if sites is None else sites
+        return np.where(self.reacted[index], 0, np.clip(self.chance_to_react(rules, sites), 0, 1) * selection[index])
+
+
+    def back_reaction_rates(self, backRules, sites=None):
+        """
+        Probability that a single Monte Carlo step of the random sequential dynamics selects a rhomb for the back reaction and it reacts back.
+        backRules ... CompiledRules rule set of the back reaction
+        sites ... array int flat indices of the rhombs, None selects all of them
+        returns array float rate of each rhomb, 0 for unreacted ones
+        """
+        index = slice(None) if sites is None else sites
+        # the back reaction selects every rhomb with the same probability, see run_sequential
+        return np.where(self.reacted[index], np.clip(self.chance_to_react(backRules, sites), 0, 1) / self.numberAllLatticePoints, 0)
+
+
+    def run_synchronous(self, rules, MCcycleMax, imageCycle, converted, MCcycle=0, backRules=None):
+        """
+        Synchronous dynamics, every Monte Carlo cycle is a sweep over all rhombs.
+        The reaction probability of each rhomb is calculated from the state at the beginning of the sweep,
+        all reactions of the sweep are committed together at its end. With back reactions the reacted rhombs of the sweep react back the same way.
+        rules ... CompiledRules rule set which is applied to the simulation
+        MCcycleMax ... int or float stop criterion, see model2DPropagation
+        imageCycle ... int number of sweeps between two snapshots, 0 turns them off
+        converted ... int number of rhombs which have reacted before the simulation
+        MCcycle ... int sweep at which the simulation starts
+        backRules ... CompiledRules rule set of the back reaction, None for irreversible reactions
+        returns (int, int) the sweep and the number of converted rhombs at the end
+        """
+        runSimulation = True
+        timing = self.stats.timing
+        clock = time.perf_counter
+        nextCheckpoint = self.next_checkpoint(MCcycle)
+        while runSimulation:
+            if self.progress.due():
+                self.show_progress("sweep", MCcycle, MCcycleMax, converted)
+            if MCcycle >= nextCheckpoint:
+                self.write_checkpoint(MCcycle, converted)
+                nextCheckpoint = self.next_checkpoint(MCcycle)
+
+            # go over each pair, check against a random number and commit all reactions at the end of the sweep
+            if timing: start = clock()
+            chanceToReact = self.chance_to_react(rules)
+            chanceToReact[self.reacted] = 0
+            self.stats.attempts += self.numberAllLatticePoints - converted
+            self.stats.evaluations += self.numberAllLatticePoints - converted
+            if backRules is not None:
+                # the chance of a reacted rhomb is the one to react back
+                chanceToReact[self.reacted] = self.chance_to_react(backRules, np.flatnonzero(self.reacted))
+                self.stats.attempts += converted
+                self.stats.evaluations += converted
+            if timing:
+                evaluated = clock()
+                self.stats.add("rules", evaluated - start)
+            changed = self.numpyRandom.random(self.numberAllLatticePoints) <= chanceToReact
+            newlyReacted = np.flatnonzero(changed & ~self.reacted)
+            reactedBack = np.flatnonzero(changed & self.reacted) if backRules is not None else newlyReacted[:0]
+            if timing:
+                selected = clock()
+                self.stats.add("selection", selected - evaluated)
+            self.set_reacted_many(newlyReacted)
+            self.set_reacted_many(reactedBack, False)
+            converted += len(newlyReacted) - len(reactedBack)
+            self.stats.backReactions += len(reactedBack)
+            if timing:
+                updated = clock()
+                self.stats.add("rules", updated - selected)
+            if self.eventLog is not None:
+                self.eventLog.record_many(MCcycle, np.concatenate([newlyReacted, ~reactedBack]))
+                if timing: self.stats.add("logging", clock() - updated)
+
+            if imageCycle > 0:
+                if MCcycle % imageCycle == 0:
+                    self.snapshot(MCcycle, converted)
+
+            MCcycle += 1
+            if type(MCcycleMax) == float:
+                if converted / self.numberAllLatticePoints >= MCcycleMax:
+                    runSimulation = False
+                elif not np.any(chanceToReact > 0):
+                    self.log.log_text("No rhomb can react anymore, conversion %0.04f is final" % (converted / self.numberAllLatticePoints))
+                    runSimulation = False
+            elif type(MCcycleMax) == int:
+                if MCcycle >= MCcycleMax:
+                    runSimulation = False
+        return MCcycle, converted
+
+
+    def run_block(self, rules, MCcycleMax, imageCycle, converted, MCcycle=0):
+        """
+        Random sequential dynamics in blocks of Monte Carlo steps, the rhombs and random numbers of a block are drawn at once.
+        A step can only depend on an earlier step of its block if that one selected the same rhomb or a rhomb in one of the shells the rules use.
+        Steps without such an earlier step see the state at the start of the block and are evaluated together, the others one by one in their order.
+        The reactions are applied in the order of their steps, so this is statistically the same as run_sequential, only the random numbers are used differently.
+        rules ... CompiledRules rule set which is applied to the simulation
+        MCcycleMax ... int or float stop criterion, see model2DPropagation
+        imageCycle ... int number of Monte Carlo steps between two snapshots, 0 turns them off
+        converted ... int number of rhombs which have reacted before the simulation
+        MCcycle ... int Monte Carlo cycle at which the simulation starts
+        returns (int, int) the Monte Carlo cycle and the number of converted rhombs at the end
+        """
+        geometry = self.geometry
+        # the shells in which a reaction changes the probability of a rhomb
+        conflictShells = [(self.shells.offsets[order - 1], self.shells.indices[order - 1]) for order in rules.orders]
+        blockSize = self.blockSize
+        if blockSize <= 0:
+            # about one step in twenty depends on an earlier one of its block
+            neighborhood = 1 + sum(int(self.neighborSizes[order - 1].max(initial=0)) for order in rules.orders)
+            blockSize = min(max(16, self.numberAllLatticePoints // (10 * neighborhood)), 65536)
+        timing = self.stats.timing
+        clock = time.perf_counter
+        nextCheckpoint = self.next_checkpoint(MCcycle)
+        runSimulation = True
+        while runSimulation:
+            if self.progress.due():
+                self.show_progress("step", MCcycle, MCcycleMax, converted)
+            if MCcycle >= nextCheckpoint:
+                self.write_checkpoint(MCcycle, converted)
+                nextCheckpoint = self.next_checkpoint(MCcycle)
+
+            # a block ends at the next snapshot, checkpoint or the end of the run
+            end = min(MCcycle + blockSize, nextCheckpoint)
+            if imageCycle > 0:
+                end = min(end, -(-MCcycle // imageCycle) * imageCycle + 1)
+            if type(MCcycleMax) == int:
+                end = min(end, MCcycleMax)
+            elif converted / self.numberAllLatticePoints >= MCcycleMax:
+                end = MCcycle + 1
+            count = max(int(end) - MCcycle, 1)
+
+            # select the rhombs in the same way as get_random_point, a row first and then a rhomb in it
+            if timing: start = clock()
+            rows = (self.numpyRandom.random(count) * self.latticePointsY).astype(np.int64)
+            sites = geometry.rowStart[rows] + (self.numpyRandom.random(count) * geometry.rowLength[rows]).astype(np.int64)
+            uniforms = self.numpyRandom.random(count)
+            conflict = lattice.dependent_steps(sites, conflictShells)
+            if timing:
+                selectedTime = clock()
+                self.stats.add("selection", selectedTime - start)
+
+            # outcome of the independent steps from the state at the start of the block
+            unreacted = ~self.reacted[sites]
+            reacts = unreacted & (uniforms <= rules.chance_many(self.neighborCounts, self.neighborSizes, sites))
+            self.stats.evaluations += int(np.count_nonzero(unreacted & ~conflict))
+            # only the states change during the block, the counters and domains follow at its end
+            reactedSteps = []
+            lastStep = count - 1
+            first = 0
+            for t in np.flatnonzero(conflict).tolist() + [count]:
+                # the independent steps up to the next dependent one
+                batch = first + np.flatnonzero(reacts[first:t])
+                if type(MCcycleMax) == float and len(batch) > 0:
+                    reached = np.flatnonzero((converted + np.arange(1, len(batch) + 1)) / self.numberAllLatticePoints >= MCcycleMax)
+                    if len(reached) > 0:
+                        batch = batch[:reached[0] + 1]
+                        lastStep = int(batch[-1])
+                self.reacted[sites[batch]] = True
+                reactedSteps.append(batch)
+                converted += len(batch)
+                if t == count or lastStep < count - 1:
+                    break
+                # a dependent step sees the reactions of all earlier steps, its neighbors are counted from the states
+                i = int(sites[t])
+                if not self.reacted[i]:
+                    self.stats.evaluations += 1
+                    chanceToReact = 1
+                    for order in rules.orders:
+                        reactedNeighbors = int(np.count_nonzero(self.reacted[self.shells.shell(order, i)]))
+                        chanceToReact *= rules.tables[order][self.neighborSizes[order - 1][i], reactedNeighbors]
+                    if uniforms[t] <= chanceToReact:
+                        self.reacted[i] = True
+                        reactedSteps.append([t])
+                        converted += 1
+                        if type(MCcycleMax) == float and converted / self.numberAllLatticePoints >= MCcycleMax:
+                            lastStep = t
+                            break
+                first = t + 1
+            reactedSteps = np.concatenate(reactedSteps).astype(np.int64)
+            if len(reactedSteps) > 0:
+                # the states are already set, this updates the counters and domains in the order of the steps
+                self.set_reacted_many(sites[reactedSteps])
+                if self.eventLog is not None:
+                    self.eventLog.record_many(MCcycle + reactedSteps, sites[reactedSteps])
+            if timing: self.stats.add("rules", clock() - selectedTime)
+
+            if imageCycle > 0 and (MCcycle + lastStep) % imageCycle == 0:
+                self.snapshot(MCcycle + lastStep, converted)
+            MCcycle += lastStep + 1
+            if type(MCcycleMax) == float:
+                runSimulation = converted / self.numberAllLatticePoints < MCcycleMax
+            elif type(MCcycleMax) == int:
+                runSimulation = MCcycle < MCcycleMax
+        return MCcycle, converted
+
+
+    def run_parallel(self, rules, MCcycleMax, imageCycle, converted, MCcycle=0):
+        """
+        Random sequential dynamics on several processes. The rows of the torus are split into an even number of stripes which are at least
+        as high as the shells of the rules reach, see parallel.stripes. In every phase the workers run the steps of all stripes of one color
+        at the same time, rhombs in different stripes of the same color cannot influence each other.
+        The states and shells are shared with the workers through multiprocessing.shared_memory, or through the files in the large-lattice mode,
+        the workers count the reacted neighbors from the states when they need them.
+        The steps of two phases are split over the stripes as random sequential steps would be, only their order within the two phases differs,
+        so phaseSteps should be small compared to the number of rhombs. Stop criteria, snapshots and checkpoints are checked between pairs of phases.
+        rules ... CompiledRules rule set which is applied to the simulation
+        MCcycleMax ... int or float stop criterion, see model2DPropagation
+        imageCycle ... int number of Monte Carlo steps between two snapshots, 0 turns them off
+        converted ... int number of rhombs which have reacted before the simulation
+        MCcycle ... int Monte Carlo cycle at which the simulation starts
+        returns (int, int) the Monte Carlo cycle and the number of converted rhombs at the end
+        """
+        # multiprocessing is only loaded by parallel runs, short serial jobs start faster without it
+        import parallel
+        reach = max([self.geometry.row_reach(order) for order in rules.orders], default=0)
+        stripes = parallel.stripes(self.latticePointsY, reach, self.parallelWorkers if self.parallelWorkers > 0 else os.cpu_count())
+        # selection probability of each stripe as in get_random_point
+        stripeShare = np.array([stop - start for start, stop in stripes]) / self.latticePointsY
+        phaseSteps = self.phaseSteps if self.phaseSteps > 0 else max(len(stripes), self.numberAllLatticePoints // 20)
+        timing = self.stats.timing
+        clock = time.perf_counter
+        nextCheckpoint = self.next_checkpoint(MCcycle)
+        shared = parallel.SharedArrays()
+        state = self.reacted
+        workers = None
+        try:
+            # the workers change the shared states, the counters and domains of this process follow after each phase
+            self.reacted = shared.add("reacted", self.reacted)
+            for order in rules.orders:
+                shared.add("offsets%i" % order, self.shells.offsets[order - 1])
+                shared.add("indices%i" % order, self.shells.indices[order - 1])
+            workers = parallel.StripeWorkers(len(stripes) // 2, shared.descriptors, self.geometry.rowStart, self.geometry.rowLength,
+                                             {order: rules.tables[order] for order in rules.orders})
+            runSimulation = True
+            while runSimulation:
+                if self.progress.due():
+                    self.show_progress("step", MCcycle, MCcycleMax, converted)
+                if MCcycle >= nextCheckpoint:
+                    self.write_checkpoint(MCcycle, converted)
+                    nextCheckpoint = self.next_checkpoint(MCcycle)
+
+                # two phases end at the next snapshot, checkpoint or the end of the run
+                end = min(MCcycle + phaseSteps, nextCheckpoint)
+                if imageCycle > 0:
+                    end = min(end, -(-MCcycle // imageCycle) * imageCycle + 1)
+                if type(MCcycleMax) == int:
+                    end = min(end, MCcycleMax)
+                count = max(int(end) - MCcycle, 1)
+                if timing: start = clock()
+                # the number of steps in each stripe is distributed as for count random sequential steps
+                stripeSteps = self.numpyRandom.multinomial(count, stripeShare)
+                seed = int(self.numpyRandom.random() * 2 ** 53)
+                cycle = MCcycle
+                for color in (0, 1):
+                    jobs = [(stripe, stripes[stripe][0], stripes[stripe][1], int(stripeSteps[stripe])) for stripe in range(color, len(stripes), 2)]
+                    phaseLength = int(stripeSteps[color::2].sum())
+                    reactedCycles = [np.zeros(0, dtype=np.int64)]
+                    reactedSites = [np.zeros(0, dtype=np.int64)]
+                    for stripe, steps, sites, evaluations in workers.run_phase(seed, jobs):
+                        # the steps of each stripe are spread evenly over the phase
+                        reactedCycles.append(cycle + steps * phaseLength // max(int(stripeSteps[stripe]), 1))
+                        reactedSites.append(sites)
+                        self.stats.evaluations += evaluations
+                    reactedCycles = np.concatenate(reactedCycles)
+                    reactedSites = np.concatenate(reactedSites)
+                    order = np.argsort(reactedCycles, kind='stable')
+                    if len(order) > 0:
+                        # the states are already set by the workers, this updates the counters and domains
+                        self.set_reacted_many(reactedSites[order])
+                        converted += len(order)
+                        if self.eventLog is not None:
+                            if timing: logged = clock()
+                            self.eventLog.record_many(reactedCycles[order], reactedSites[order])
+                            if timing: self.stats.add("logging", clock() - logged)
+                    cycle += phaseLength
+                if timing: self.stats.add("rules", clock() - start)
+
+                if imageCycle > 0 and (MCcycle + count - 1) % imageCycle == 0:
+                    self.snapshot(MCcycle + count - 1, converted)
+                MCcycle += count
+                if type(MCcycleMax) == float:
+                    runSimulation = converted / self.numberAllLatticePoints < MCcycleMax
+                elif type(MCcycleMax) == int:
+                    runSimulation = MCcycle < MCcycleMax
+        finally:
+            if workers is not None:
+                workers.close()
+            if self.reacted is not state:
+                state[:] = self.reacted
+                self.reacted = state
+            shared.close()
+        return MCcycle, converted
+
+
+    def snapshot(self, MCcycle, converted):
+        """
+        Logs the conversion and saves an image of the current state if there is an output folder.
+        MCcycle ... int current Monte Carlo cycle
+        converted ... int number of converted rhombs
+        """
+        start = time.perf_counter()
         self.log_conversion.log_xy(MCcycle, converted / self.numberAllLatticePoints)
-        self.image = Image.new('RGB', self.image.size, 'white')
-        self.draw = ImageDraw.Draw(self.image)
-        self.draw_image()
-        self.save_image(MCcycle)
+        self.conversionHistory.append((MCcycle, converted / self.numberAllLatticePoints))
+        if self.correlation is not None:
+            correlations = self.correlation.correlations(self.reacted, self.neighborCounts)
+            self.correlationHistory.append((MCcycle, correlations))
+            self.log_correlation.log_row([MCcycle, converted / self.numberAllLatticePoints] + correlations.ravel().tolist())
+        if self.domains is not None:
+            self.refresh_domains()
+            self.domainHistory.append((MCcycle, self.domains.clusters, self.domains.largest))
+            self.log_domains.log_row((MCcycle, converted / self.numberAllLatticePoints, self.domains.clusters, self.domains.largest,
+                                      int(self.domains.wrappingX), int(self.domains.wrappingY)))
+        logged = time.perf_counter()
+        if self.outputFolder is not None and self.mappedFolder is not None:
+            # a copy of a mapped state would not fit into memory, the renderer reads the visible rhombs from the file and only the image is saved in the background
+            self.get_writer().submit(self.image_file_name(MCcycle), self.get_renderer().to_image, self.get_renderer().render_indexed(self.reacted))
+        elif self.outputFolder is not None:
+            # the copy of the state is rendered and saved in the background, waiting for a full queue counts as rendering
+            self.get_writer().submit(self.image_file_name(MCcycle), self.get_renderer().render, self.reacted.copy())
+        if self.stats is not None:
+            self.stats.add("logging", logged - start)
+            self.stats.add("rendering", time.perf_counter() - logged)
 
-        print("\nDone!")
-        self.log.log_text("MC ended")
 
-        # ****************************************************************************
-        # old code snippet about bond breaking
-        # destroy a reacted dimer but only if there was a change in the crystal
-        # if random.random() < destroy:
-        #     converted -= 1
-        #     allreacted = []
-        #     for y in range(len(self.lattice)):
-        #         for x in range(len(self.lattice[y])):
-        #             if self.lattice[y][x].reacted:
-        #                 allreacted.append((x,y))
-        #     x, y = random.choice(allreacted)
-        #     self.lattice[y][x].reacted = False
-        #     self.getRhomb(x, y).reacted = False
-        #     self.reactionSites[y][x] = False
-        # ****************************************************************************
+    def show_progress(self, unit, MCcycle, MCcycleMax, converted):
+        """
+        Updates the progress line.
+        unit ... str name of a Monte Carlo cycle, i.e. step or sweep
+        MCcycle ... int current Monte Carlo cycle
+        MCcycleMax ... int or float stop criterion, see model2DPropagation
+        converted ... int number of converted rhombs
+        """
+        if type(MCcycleMax) == float:
+            message = "Current %s: %i, conversion is %0.02f" % (unit, MCcycle, converted / self.numberAllLatticePoints)
+        else:
+            message = "Current %s: %i of %i" % (unit, MCcycle + 1, MCcycleMax)
+        elapsed = self.stats.elapsed()
+        if elapsed > 0:
+            message += ", %0.0f %ss/s" % (MCcycle / elapsed, unit)
+        self.progress.show(message)
+
+
+    def next_checkpoint(self, MCcycle):
+        """
+        Monte Carlo cycle of the next checkpoint.
+        MCcycle ... int current Monte Carlo cycle
+        returns int or float the next multiple of checkpointCycle, infinity if checkpoints are turned off
+        """
+        if self.checkpointCycle <= 0:
+            return float('inf')
+        return (MCcycle // self.checkpointCycle + 1) * self.checkpointCycle
+
+
+    def write_checkpoint(self, MCcycle, converted, classes=None, backClasses=None):
+        """
+        Saves everything which is needed to continue the running simulation at the current Monte Carlo cycle, see checkpoint.resume.
+        Pending images, events and log messages are written first, so the checkpoint matches the output files.
+        MCcycle ... int current Monte Carlo cycle
+        converted ... int number of converted rhombs
+        classes ... lattice.RateClasses rates of the rejection-free mode, None for the other modes
+        backClasses ... lattice.RateClasses back reaction rates of the rejection-free mode, None for the other modes and irreversible reactions
+        """
+        self.log.log_text("Checkpoint at cycle %i" % MCcycle)
+        # a resumed run starts with domains rebuilt from the state
+        self.refresh_domains()
+        if self.writer is not None:
+            self.writer.flush()
+        metadata = {"lattice": {"latticeWidth": self.latticeWidth,
+                                "latticePoints": [self.latticePointsX, self.latticePointsY],
+                                "imageSize": list(self.imageSize),
+                                "outputFolder": self.outputFolder,
+                                "runName": self.runName,
+                                "ascLogs": self.ascLogs,
+                                "mappedFolder": self.mappedFolder,
+                                "blockSize": self.blockSize,
+                                "parallelWorkers": self.parallelWorkers,
+                                "phaseSteps": self.phaseSteps},
+                    "run": self.runSettings,
+                    "state": {"MCcycle": MCcycle,
+                              "converted": converted,
+                              "events": self.eventLog.position() if self.eventLog is not None else 0,
+                              "logs": {"log": self.log.position(), "conversion": self.log_conversion.position(),
+                                       "correlation": self.log_correlation.position(), "domains": self.log_domains.position()},
+                              "percolationSize": self.domains.percolationSize if self.domains is not None else None},
+                    "random": {"global": self.random is random,
+                               "python": checkpoint.random_state(self.random),
+                               "numpy": checkpoint.random_state(self.numpyRandom)}}
+        arrays = {"reacted": np.packbits(self.reacted),
+                  "historyCycles": np.array([cycle for cycle, conversion in self.conversionHistory], dtype=np.int64),
+                  "historyConversions": np.array([conversion for cycle, conversion in self.conversionHistory], dtype=np.float64),
+                  "correlationCycles": np.array([cycle for cycle, correlations in self.correlationHistory], dtype=np.int64),
+                  "correlationValues": np.array([correlations for cycle, correlations in self.correlationHistory], dtype=np.float64),
+                  "domainHistory": np.array(self.domainHistory, dtype=np.int64).reshape(-1, 3)}
+        if classes is not None:
+            arrays["classRates"], arrays["classSizes"], arrays["classMembers"] = classes.to_arrays()
+        if backClasses is not None:
+            arrays["backClassRates"], arrays["backClassSizes"], arrays["backClassMembers"] = backClasses.to_arrays()
+        if self.reactedSites is not None:
+            arrays["reactedSites"] = np.array(self.reactedSites.dense, dtype=np.int64)
+        checkpoint.save(self.checkpointFile, metadata, arrays)
+
+
+    def resume(self, metadata, arrays):
+        """
+        Continues the simulation of a checkpoint on this lattice, use checkpoint.resume to create a matching lattice from the checkpoint.
+        metadata ... dict metadata of the checkpoint
+        arrays ... dict arrays of the checkpoint
+        """
+        state = metadata["state"]
+        settings = metadata["run"]
+        if [self.latticePointsX, self.latticePointsY] != metadata["lattice"]["latticePoints"]:
+            raise ValueError("The checkpoint belongs to a %ix%i lattice" % tuple(metadata["lattice"]["latticePoints"]))
+        self.reacted[:] = np.unpackbits(arrays["reacted"], count=self.numberAllLatticePoints).astype(bool)
+        # neighbor counters are recounted from the restored state by model2DPropagation
+        self.neighborCounts = None
+        self.neighborSizes = None
+        self.conversionHistory = list(zip(arrays["historyCycles"].tolist(), arrays["historyConversions"].tolist()))
+        self.correlationHistory = list(zip(arrays["correlationCycles"].tolist(), arrays["correlationValues"]))
+        self.domainHistory = [tuple(row) for row in arrays["domainHistory"].tolist()]
+        # the output after the checkpoint is dropped, it is written again
+        self.log.restore(state["logs"]["log"])
+        self.log_conversion.restore(state["logs"]["conversion"])
+        self.log_correlation.restore(state["logs"]["correlation"])
+        self.log_domains.restore(state["logs"]["domains"])
+        checkpoint.set_random_state(self.random, metadata["random"]["python"])
+        checkpoint.set_random_state(self.numpyRandom, metadata["random"]["numpy"])
+        classes = None
+        if "classRates" in arrays:
+            classes = lattice.RateClasses(self.numberAllLatticePoints, arrays=(arrays["classRates"], arrays["classSizes"], arrays["classMembers"]))
+        backClasses = None
+        if "backClassRates" in arrays:
+            backClasses = lattice.RateClasses(self.numberAllLatticePoints, arrays=(arrays["backClassRates"], arrays["backClassSizes"], arrays["backClassMembers"]))
+        self.log.log_text("Resuming from the checkpoint at cycle %i" % state["MCcycle"])
+        self.model2DPropagation(checkpoint.rules_from_list(settings["rules"]), settings["MCcycleMax"], settings["seeds"], settings["imageCycle"],
+                                settings["mode"], settings["eventLog"], settings["timing"], settings["statsFile"],
+                                settings["checkpointFile"], settings["checkpointCycle"], settings["correlationOrder"], settings["trackDomains"],
+                                {"MCcycle": state["MCcycle"], "converted": state["converted"], "classes": classes, "backClasses": backClasses, "events": state["events"],
+                                 "percolationSize": state["percolationSize"], "reactedSites": arrays.get("reactedSites")},
+                                checkpoint.rules_from_list(settings.get("backRules", [])))
+
+
+    def compile_rules(self, reactivityModifiers):
+        """
+        Compiles a rule set into lookup tables which fit the neighbor shells of this lattice.
+        reactivityModifiers ... array of ReactivityModifier rule set
+        returns CompiledRules the compiled rule set
+        """
+        maxNeighbors = list(rhomb.MAXNEIGHBORS)
+        if self.neighborSizes is not None:
+            # broken tori can have more neighbors than possible, see lattice.NeighborShells.calculate_next_shell
+            for order in range(1, len(self.neighborSizes) + 1):
+                maxNeighbors[order - 1] = max(maxNeighbors[order - 1], int(self.neighborSizes[order - 1].max(initial=0)))
+        return reactivityModifier.CompiledRules(reactivityModifiers, maxNeighbors)
+
+
+    def chance_to_react(self, rules, sites=None):
+        """
+        Calculates the reaction probability of many rhombs at once from the reacted neighbor counters.
+        rules ... CompiledRules or array of ReactivityModifier rule set which is applied
+        sites ... array int flat indices of the rhombs, None selects all of them
+        returns array float probability that each rhomb reacts when it is selected
+        """
+        if not isinstance(rules, reactivityModifier.CompiledRules):
+            rules = self.compile_rules(rules)
+        return rules.chance_many(self.neighborCounts, self.neighborSizes, sites)
 
 
     def modifierApplies(self, currentRhomb, modifier):
         """
         Verifies wether or not a given modifer apllies to a given rhomb.
-        currentRhomb ... rhomb the rhomb for which the reactivity conditions should be tested for
+        currentRhomb ... Rhomb or int the rhomb or its flat index for which the reactivity conditions should be tested for
         modifier ... ReactivityModifier the rule set which is tested
         returns bool wether or not the given rule should be applied
         """
@@ -376,32 +1397,36 @@ class Kagome():
 
     def count_reacted_neighbors(self, rhomb, order):
         """Counts how mean of the neighbors of a given order have reacted.
-        rhomb ... rhomb center of neighbor finding
+        rhomb ... Rhomb or int center of neighbor finding or its flat index
         order ... order of the nearest neighbor
         returns (int, int) a tuple with the number of reacted neighbors and the total amount of neighbors
         """
-        neighborRhombs = rhomb.neighbors[order - 1]
-        reactedNeighbors = 0
-        allNeighbors = 0
-        # count through the neighbors
-        for currentRhomb in neighborRhombs:
-            allNeighbors += 1 # counts all possible neighbors, independent of their state
-            if self.getRhomb(currentRhomb[0], currentRhomb[1]).reacted:
-                reactedNeighbors += 1 # counts all reacted neighbors
-        return reactedNeighbors, allNeighbors
+        i = self.site_index(rhomb)
+        if self.neighborCounts is not None and order <= len(self.neighborCounts):
+            return int(self.neighborCounts[order - 1][i]), int(self.neighborSizes[order - 1][i])
+        neighborRhombs = self.shells.shell(order, i)
+        return int(np.count_nonzero(self.reacted[neighborRhombs])), len(neighborRhombs)
 
 
     def generate_seeds(self, seeds):
         """
         Turns a given number of rhombs at random locations into a reacted state.
         seeds ... int number of how many rhombs should be turned into the reacted state
+        returns int number of rhombs which have reacted, seeds on rhombs which have reacted before are not counted
         """
-        self.rhombColor = 'blue' # change of color to highlight the random seeds
+        seedSites = []
+        changed = 0
         for i in range(seeds):
             coords = self.get_random_point()
             # set the new state and mark it
-            self.lattice[coords[1]][coords[0]].reacted = True
-            self.rhomb_at_kagome(coords[0], coords[1])
-        self.rhombColor = 'red' # revert color
-        self.draw_tiling()
-        self.save_image("start.png")
\ No newline at end of file
+            seedSites.append(self.geometry.index(coords[0], coords[1]))
+            if not self.reacted[seedSites[-1]]:
+                changed += 1
+                # seeds are logged before the first Monte Carlo cycle
+                if self.eventLog is not None:
+                    self.eventLog.record(-1, seedSites[-1])
+            self.set_reacted(seedSites[-1])
+        if self.outputFolder is not None:
+            # the seeds are highlighted in blue
+            self.get_writer().submit(self.outputFolder + "start.png", self.get_renderer().render, None, seedSites)
+        return changed
\ No newline at end of file
@@ -0,0 +1,646 @@
+import rhomb
+import os
+import warnings
+import numpy as np
+
+# default folder for cached neighbor shells, set to None to disable caching
+CACHEFOLDER = os.path.join(os.path.expanduser("~"), ".cache", "aceofdiamonds")
+# number of sites which are handled at once by the chunked calculations
+CHUNKSITES = 2 ** 22
+
+class Lattice():
+    """
+    Compact array representation of the Kagome lattice geometry.
+    Every rhomb is addressed by a flat site index, rows are stored one after the other.
+    Even rows hold latticePointsX rhombs, odd rows hold latticePointsX / 2 rhombs.
+    For very large lattices the per site arrays and the neighbor shells can live in memory-mapped files instead of memory.
+    """
+
+    def __init__(self, latticePointsX, latticePointsY, folder=None):
+        """
+        Constructor
+        latticePointsX ... int even number of lattice points in x direction
+        latticePointsY ... int even number of lattice points in y direction
+        folder ... str folder of the memory-mapped files of this geometry, they are reused by later runs, None keeps everything in memory
+        """
+        self.latticePointsX = latticePointsX
+        self.latticePointsY = latticePointsY
+        self.folder = folder
+
+        # row layout of the flat site index
+        self.rowLength = np.where(np.arange(latticePointsY) % 2 == 0, latticePointsX, latticePointsX // 2).astype(np.int64)
+        self.rowStart = np.zeros(latticePointsY + 1, dtype=np.int64)
+        np.cumsum(self.rowLength, out=self.rowStart[1:])
+        self.siteCount = int(self.rowStart[-1])
+
+        if folder is None:
+            # lattice coordinates of each site
+            self.siteY = np.repeat(np.arange(latticePointsY, dtype=np.int32), self.rowLength)
+            self.siteX = (np.arange(self.siteCount, dtype=np.int64) - self.rowStart[self.siteY]).astype(np.int32)
+            self.firstNeighbors = self.calculate_first_neighbors()
+        else:
+            # the same arrays are calculated chunk by chunk into files
+            os.makedirs(folder, exist_ok=True)
+            self.siteY = mapped_array(os.path.join(folder, "siteY.bin"), np.int32, (self.siteCount,),
+                                      lambda start, stop: np.searchsorted(self.rowStart, np.arange(start, stop), side='right') - 1)
+            self.siteX = mapped_array(os.path.join(folder, "siteX.bin"), np.int32, (self.siteCount,),
+                                      lambda start, stop: np.arange(start, stop) - self.rowStart[self.siteY[start:stop]])
+            self.firstNeighbors = mapped_array(os.path.join(folder, "neighbors1.bin"), np.int32, (self.siteCount, 4), self.calculate_first_neighbors)
+        # higher neighbor shells are added on demand
+        self.shells = NeighborShells(self.firstNeighbors, folder)
+
+
+    def __len__(self):
+        """
+        returns int number of sites in the lattice
+        """
+        return self.siteCount
+
+
+    def index(self, x, y):
+        """
+        Flat index of a lattice point. This also ensures the torus like shape of the sheet.
+        x ... int or array x coordinate in the lattice
+        y ... int or array y coordinate in the lattice
+        returns int or array flat site index
+        """
+        y = y % self.latticePointsY
+        x = x % self.rowLength[y]
+        return self.rowStart[y] + x
+
+
+    def coordinates(self, i):
+        """
+        Lattice coordinates of a flat site index.
+        i ... int flat site index
+        returns (int, int) x and y coordinate in the lattice
+        """
+        return (int(self.siteX[i]), int(self.siteY[i]))
+
+
+    def row_reach(self, order):
+        """
+        Largest distance in rows between a site and a member of its neighbor shell, taking the shortest way around the torus.
+        order ... int order of the neighbor shell, it has to be calculated already
+        returns int number of rows
+        """
+        reach = 0
+        for start, stop in chunk_ranges(0, self.siteCount, max(1, CHUNKSITES // rhomb.MAXNEIGHBORS[order - 1])):
+            owner, members = self.shells.chunk(order, start, stop)
+            distance = np.abs(self.siteY[members].astype(np.int64) - self.siteY[owner])
+            reach = max(reach, int(np.minimum(distance, self.latticePointsY - distance).max(initial=0)))
+        return reach
+
+
+    def calculate_first_neighbors(self, start=0, stop=None):
+        """
+        Calculates the first neighbors of all sites or of a range of sites at once, this follows the construction in rhomb.Rhomb.
+        start ... int first flat site index
+        stop ... int flat site index after the last one, None calculates up to the last site
+        returns array[N, 4] int32 flat indices of the first neighbors
+        """
+        x = self.siteX[start:stop].astype(np.int64)
+        y = self.siteY[start:stop].astype(np.int64)
+        line = y % 4
+        nx = np.empty((len(x), 4), dtype=np.int64)
+        ny = np.empty((len(x), 4), dtype=np.int64)
+
+        # identify line, see rhomb.Rhomb for a sketch
+        m = line == 0
+        nx[m] = np.stack((x[m] - 1, x[m] + 1, x[m] // 2, x[m] // 2 + x[m] % 2), axis=1)
+        ny[m] = np.stack((y[m], y[m], y[m] - 1, y[m] + 1), axis=1)
+        m = line == 1
+        nx[m] = np.stack((x[m] * 2 - 1, x[m] * 2, x[m] * 2 - 1, x[m] * 2), axis=1)
+        ny[m] = np.stack((y[m] - 1, y[m] - 1, y[m] + 1, y[m] + 1), axis=1)
+        m = line == 2
+        nx[m] = np.stack((x[m] - 1, x[m] + 1, x[m] // 2 + x[m] % 2, x[m] // 2), axis=1)
+        ny[m] = np.stack((y[m], y[m], y[m] - 1, y[m] + 1), axis=1)
+        m = line == 3
+        nx[m] = np.stack((x[m] * 2, x[m] * 2 + 1, x[m] * 2, x[m] * 2 + 1), axis=1)
+        ny[m] = np.stack((y[m] - 1, y[m] - 1, y[m] + 1, y[m] + 1), axis=1)
+
+        # make torus, in the same way as rhomb.Rhomb does it
+        wrappedX = nx.copy()
+        rowLength = self.latticePointsX / (1 + ny % 2)
+        wrappedX[nx < 0] = (rowLength[nx < 0] - 1).astype(np.int64)
+        wrappedX[nx >= rowLength] = 0
+        wrappedY = ny.copy()
+        wrappedY[ny < 0] = self.latticePointsY - 1
+        wrappedY[ny >= self.latticePointsY] = 0
+        # a wrap in y discards the wrap in x
+        yWrapped = (ny < 0) | (ny >= self.latticePointsY)
+        wrappedX[yWrapped] = nx[yWrapped]
+
+        return self.index(wrappedX, wrappedY).astype(np.int32)
+
+
+class NeighborShells():
+    """
+    Neighbor shells of all sites stored in compressed sparse row form.
+    The members of the shell of order n around site i are indices[n - 1][offsets[n - 1][i]:offsets[n - 1][i + 1]].
+    With a folder every shell is written to raw binary files offsets<n>.bin and indices<n>.bin which are memory-mapped,
+    so the shells of lattices which do not fit into memory are built and used chunk by chunk.
+    """
+
+    def __init__(self, firstNeighbors, folder=None):
+        """
+        Constructor
+        firstNeighbors ... array[N, 4] int32 flat indices of the first neighbors
+        folder ... str folder of the memory-mapped shells, None keeps them in memory
+        """
+        siteCount = len(firstNeighbors)
+        self.folder = folder
+        if folder is None:
+            self.offsets = [np.arange(0, 4 * siteCount + 1, 4, dtype=np.int64)]
+        else:
+            self.offsets = [mapped_array(self.file_name("offsets", 1), np.int64, (siteCount + 1,), lambda start, stop: 4 * np.arange(start, stop))]
+        self.indices = [np.ascontiguousarray(firstNeighbors, dtype=np.int32).reshape(-1)]
+        self.reversed = {} # transposed shells by order, see reverse
+
+
+    def __len__(self):
+        """
+        returns int highest neighbor order which is available
+        """
+        return len(self.offsets)
+
+
+    def append(self, offsets, indices):
+        """
+        Adds the next higher neighbor shell.
+        offsets ... array[N + 1] int64 start of the shell of each site in indices
+        indices ... array int32 flat indices of the shell members
+        """
+        self.offsets.append(np.asarray(offsets, dtype=np.int64))
+        self.indices.append(np.asarray(indices, dtype=np.int32))
+
+
+    def shell(self, order, i):
+        """
+        Members of a single neighbor shell.
+        order ... int order of the neighbor shell
+        i ... int flat site index
+        returns array int32 flat indices of the neighbors
+        """
+        offsets = self.offsets[order - 1]
+        return self.indices[order - 1][offsets[i]:offsets[i + 1]]
+
+
+    def file_name(self, kind, order):
+        """
+        Location of a memory-mapped shell.
+        kind ... str offsets or indices
+        order ... int order of the neighbor shell
+        returns str path of the file
+        """
+        return os.path.join(self.folder, "%s%i.bin" % (kind, order))
+
+
+    def sizes(self, order, start=0, stop=None):
+        """
+        Number of neighbors of every site in a given shell.
+        order ... int order of the neighbor shell
+        start ... int first flat site index
+        stop ... int flat site index after the last one, None counts up to the last site
+        returns array int number of neighbors per site
+        """
+        offsets = self.offsets[order - 1]
+        stop = len(offsets) - 1 if stop is None else stop
+        return np.diff(offsets[start:stop + 1])
+
+
+    def count(self, order, reacted, start=0, stop=None):
+        """
+        Counts the reacted neighbors of all sites in a given shell, chunk by chunk to limit the memory usage.
+        order ... int order of the neighbor shell
+        reacted ... array bool state of all sites
+        start ... int first flat site index
+        stop ... int flat site index after the last one, None counts up to the last site
+        returns array int64 number of reacted neighbors per site
+        """
+        stop = len(self.offsets[order - 1]) - 1 if stop is None else stop
+        counts = np.empty(stop - start, dtype=np.int64)
+        for first, last in chunk_ranges(start, stop, max(1, CHUNKSITES // rhomb.MAXNEIGHBORS[order - 1])):
+            owner, members = self.chunk(order, first, last)
+            counts[first - start:last - start] = np.bincount(owner - first, weights=reacted[members], minlength=last - first)
+        return counts
+
+
+    def reverse(self, order):
+        """
+        Transposed neighbor shell, i.e. for every site all sites which have it in their shell.
+        Counters of the shell have to be updated through the transposed shell when a site changes its state.
+        order ... int order of the neighbor shell
+        returns (array, array) int64 offsets and int32 indices of the transposed shell in the same form as the shell
+        """
+        if order not in self.reversed:
+            offsets = self.offsets[order - 1]
+            siteCount = len(offsets) - 1
+            if self.folder is not None and self.symmetric(order):
+                self.reversed[order] = (offsets, self.indices[order - 1])
+                return self.reversed[order]
+            # memory-mapped shells of broken tori end up here as well, their transposed shell is held in memory
+            owner = np.repeat(np.arange(siteCount, dtype=np.int64), np.diff(offsets))
+            members = self.indices[order - 1].astype(np.int64)
+            forward = owner * siteCount + members
+            backward = members * siteCount + owner
+            backward.sort()
+            # the shells of the Kagome lattice are symmetric, the transposed shell is only stored if they are not
+            if np.array_equal(np.sort(forward), backward):
+                self.reversed[order] = (offsets, self.indices[order - 1])
+            else:
+                reverseOffsets = np.zeros(siteCount + 1, dtype=np.int64)
+                np.cumsum(np.bincount(backward // siteCount, minlength=siteCount), out=reverseOffsets[1:])
+                self.reversed[order] = (reverseOffsets, (backward % siteCount).astype(np.int32))
+        return self.reversed[order]
+
+
+    def symmetric(self, order):
+        """
+        Checks chunk by chunk that every site is a member of the shells of all its shell members, which needs far less memory than the sort in reverse.
+        order ... int order of the neighbor shell
+        returns bool the shell is its own transposed shell
+        """
+        offsets = self.offsets[order - 1]
+        indices = self.indices[order - 1]
+        maxNeighbors = rhomb.MAXNEIGHBORS[order - 1]
+        for start, stop in chunk_ranges(0, len(offsets) - 1, max(1, CHUNKSITES // maxNeighbors ** 2)):
+            owner, members = self.chunk(order, start, stop)
+            # the shells of all members, each shell has to contain the site the member belongs to
+            pair, memberShells = gather(offsets, indices, members)
+            found = np.bincount(pair, weights=memberShells == owner[pair], minlength=len(members))
+            if not np.all(found > 0):
+                return False
+        return True
+
+
+    def calculate_next_shell(self, chunkSize=0):
+        """
+        Calculates the neighbor shell of the next higher order for all sites at once.
+        The shell of order n holds all neighbors of the shell n - 1 which are neither in the shell n - 1 nor in the shell n - 2.
+        chunkSize ... int number of sites handled at once to limit the memory usage, 0 selects it automatically
+        """
+        order = len(self) + 1
+        if order > len(rhomb.MAXNEIGHBORS):
+            raise ValueError("Neighbors are only known up to order %i" % len(rhomb.MAXNEIGHBORS))
+        siteCount = len(self.offsets[0]) - 1
+        firstNeighbors = self.indices[0].reshape(-1, 4)
+        if chunkSize <= 0:
+            chunkSize = max(1, CHUNKSITES // (4 * rhomb.MAXNEIGHBORS[order - 2]))
+
+        if self.folder is None:
+            offsets = np.zeros(siteCount + 1, dtype=np.int64)
+            chunks = []
+        else:
+            # the shell is written to temporary files which are renamed once they are complete
+            offsetsName = self.file_name("offsets", order)
+            indicesName = self.file_name("indices", order)
+            offsets = np.memmap("%s.%i.tmp" % (offsetsName, os.getpid()), dtype=np.int64, mode='w+', shape=(siteCount + 1,))
+            chunks = open("%s.%i.tmp" % (indicesName, os.getpid()), 'wb')
+        maxCount = 0
+        for start, stop in chunk_ranges(0, siteCount, chunkSize):
+            # members of the two lower shells with the site they belong to
+            owner1, members1 = self.chunk(order - 1, start, stop)
+            if order == 2:
+                owner2 = members2 = np.arange(start, stop, dtype=np.int64)
+            else:
+                owner2, members2 = self.chunk(order - 2, start, stop)
+            # all first neighbors of the shell n - 1 as (owner, member) pairs encoded in a single integer
+            candidates = np.repeat(owner1, 4) * siteCount + firstNeighbors[members1].reshape(-1)
+            lower = np.concatenate((owner1 * siteCount + members1, owner2 * siteCount + members2))
+            # remove duplicates and members of the lower shells via sorted arrays
+            candidates.sort()
+            unique = np.ones(len(candidates), dtype=bool)
+            unique[1:] = candidates[1:] != candidates[:-1]
+            candidates = candidates[unique]
+            if len(lower) > 0:
+                lower.sort()
+                position = np.minimum(np.searchsorted(lower, candidates), len(lower) - 1)
+                candidates = candidates[lower[position] != candidates]
+            counts = np.bincount(candidates // siteCount - start, minlength=stop - start)
+            maxCount = max(maxCount, int(counts.max(initial=0)))
+            offsets[start + 1:stop + 1] = offsets[start] + np.cumsum(counts)
+            if self.folder is None:
+                chunks.append((candidates % siteCount).astype(np.int32))
+            else:
+                (candidates % siteCount).astype(np.int32).tofile(chunks)
+
+        # only happens if the torus does not close properly, i.e. if the number of rows is not a multiple of four
+        if maxCount > rhomb.MAXNEIGHBORS[order - 1]:
+            warnings.warn("Found %i neighbors of order %i, but only %i are possible, the number of lattice points in y direction should be a multiple of 4" % (maxCount, order, rhomb.MAXNEIGHBORS[order - 1]))
+        if self.folder is None:
+            self.append(offsets, np.concatenate(chunks))
+        else:
+            offsets.flush()
+            del offsets
+            chunks.close()
+            os.replace("%s.%i.tmp" % (offsetsName, os.getpid()), offsetsName)
+            os.replace("%s.%i.tmp" % (indicesName, os.getpid()), indicesName)
+            self.load_mapped(order)
+
+
+    def chunk(self, order, start, stop):
+        """
+        Members of the neighbor shells of a range of sites.
+        order ... int order of the neighbor shell
+        start ... int first flat site index
+        stop ... int flat site index after the last one
+        returns (array, array) int64 site each member belongs to and int64 flat index of the member
+        """
+        offsets = self.offsets[order - 1]
+        owner = np.repeat(np.arange(start, stop, dtype=np.int64), np.diff(offsets[start:stop + 1]))
+        members = self.indices[order - 1][offsets[start]:offsets[stop]].astype(np.int64)
+        return owner, members
+
+
+    def save(self, fileName):
+        """
+        Writes all shells above the first order to a npz file. The file is replaced atomically so that parallel runs never see a partial file.
+        fileName ... str path of the file
+        """
+        arrays = {}
+        for order in range(2, len(self) + 1):
+            arrays["offsets%i" % order] = self.offsets[order - 1]
+            arrays["indices%i" % order] = self.indices[order - 1]
+        temporary = "%s.%i.tmp" % (fileName, os.getpid())
+        with open(temporary, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(temporary, fileName)
+
+
+    def load(self, fileName, maxOrder):
+        """
+        Reads the shells written by save.
+        fileName ... str path of the file
+        maxOrder ... int highest order which should be read
+        """
+        with np.load(fileName) as cached:
+            for order in range(len(self) + 1, maxOrder + 1):
+                self.append(cached["offsets%i" % order], cached["indices%i" % order])
+
+
+    def load_mapped(self, maxOrder):
+        """
+        Maps the shells which are already in the folder, e.g. from earlier runs, up to a given order.
+        maxOrder ... int highest order which should be mapped
+        """
+        while len(self) < maxOrder and os.path.exists(self.file_name("indices", len(self) + 1)):
+            order = len(self) + 1
+            self.append(np.memmap(self.file_name("offsets", order), dtype=np.int64, mode='r'),
+                        np.memmap(self.file_name("indices", order), dtype=np.int32, mode='r'))
+
+
+def chunk_ranges(start, stop, chunkSize=CHUNKSITES):
+    """
+    Splits a range of flat site indices into consecutive chunks.
+    start ... int first flat site index
+    stop ... int flat site index after the last one
+    chunkSize ... int number of sites per chunk
+    returns iterator of (int, int) start and stop of every chunk
+    """
+    for first in range(start, stop, chunkSize):
+        yield first, min(first + chunkSize, stop)
+
+
+def mapped_array(fileName, dtype, shape, calculate):
+    """
+    Array in a raw binary file which is memory-mapped read only. A missing file is calculated chunk by chunk
+    under a temporary name and renamed once it is complete, so runs never see a partial file.
+    fileName ... str path of the file
+    dtype ... numpy.dtype type of the elements
+    shape ... tuple shape of the array
+    calculate ... function (start, stop) -> array which returns the rows start to stop of the array
+    returns numpy.memmap the array
+    """
+    if not os.path.exists(fileName):
+        temporary = "%s.%i.tmp" % (fileName, os.getpid())
+        array = np.memmap(temporary, dtype=dtype, mode='w+', shape=shape)
+        for start, stop in chunk_ranges(0, shape[0]):
+            array[start:stop] = calculate(start, stop)
+        array.flush()
+        del array
+        os.replace(temporary, fileName)
+    return np.memmap(fileName, dtype=dtype, mode='r', shape=shape)
+
+
+def gather(offsets, indices, sites):
+    """
+    Members of the compressed sparse rows of many sites at once.
+    offsets ... array int64 offsets of the rows
+    indices ... array int members of all rows
+    sites ... array int flat indices of the sites whose rows are gathered
+    returns (array, array) int64 position in sites each member belongs to and int64 members
+    """
+    sites = np.asarray(sites, dtype=np.int64)
+    starts = offsets[sites]
+    sizes = offsets[sites + 1] - starts
+    owner = np.repeat(np.arange(len(sites), dtype=np.int64), sizes)
+    # position of every member inside its own row
+    within = np.arange(len(owner), dtype=np.int64) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    return owner, indices[np.repeat(starts, sizes) + within].astype(np.int64)
+
+
+def dependent_steps(sites, shells):
+    """
+    Finds the Monte Carlo steps of a block which can depend on an earlier step of the block,
+    i.e. an earlier step selected the same site or a member of one of the given shells of the site.
+    sites ... array int64 flat index of the site selected by each step
+    shells ... array of (array, array) offsets and indices of the shells which decide the outcome of a step
+    returns array bool which steps depend on an earlier one
+    """
+    # first step of the block which selects each of the sites
+    selected, firstStep = np.unique(sites, return_index=True)
+    dependent = firstStep[np.searchsorted(selected, sites)] < np.arange(len(sites))
+    for offsets, indices in shells:
+        owner, members = gather(offsets, indices, sites)
+        position = np.minimum(np.searchsorted(selected, members), len(selected) - 1)
+        earlier = (selected[position] == members) & (firstStep[position] < owner)
+        dependent[owner[earlier]] = True
+    return dependent
+
+
+def cache_file_name(cacheFolder, latticePointsX, latticePointsY, order):
+    """
+    Name of the cached neighbor shells of a lattice geometry.
+    cacheFolder ... str folder of the cache
+    latticePointsX ... int lattice points in x direction
+    latticePointsY ... int lattice points in y direction
+    order ... int highest neighbor order in the file
+    returns str path of the cache file
+    """
+    return os.path.join(cacheFolder, "shells_%ix%i_%i.npz" % (latticePointsX, latticePointsY, order))
+
+
+def build_neighbor_shells(geometry, shells, maxOrder, cacheFolder=CACHEFOLDER):
+    """
+    Extends the neighbor shells of a lattice up to a given order. Shells are read from the cache if possible, newly calculated shells are written to it.
+    geometry ... Lattice geometry the shells belong to
+    shells ... NeighborShells shells which should be extended
+    maxOrder ... int highest order of neighbors which is required
+    cacheFolder ... str folder of the on-disk cache, None disables the cache
+    """
+    if len(shells) >= maxOrder:
+        return
+    if shells.folder is not None:
+        # memory-mapped shells are their own cache
+        shells.load_mapped(maxOrder)
+        while len(shells) < maxOrder:
+            shells.calculate_next_shell()
+        return
+    if cacheFolder is not None:
+        # any cached file of the same or a higher order holds the required shells
+        for order in range(maxOrder, len(rhomb.MAXNEIGHBORS) + 1):
+            fileName = cache_file_name(cacheFolder, geometry.latticePointsX, geometry.latticePointsY, order)
+            if os.path.exists(fileName):
+                shells.load(fileName, maxOrder)
+                return
+    while len(shells) < maxOrder:
+        shells.calculate_next_shell()
+    if cacheFolder is not None:
+        os.makedirs(cacheFolder, exist_ok=True)
+        shells.save(cache_file_name(cacheFolder, geometry.latticePointsX, geometry.latticePointsY, maxOrder))
+
+
+class SiteSet():
+    """
+    Set of sites with constant time insertion, removal and random choice.
+    The members are kept in a dense list, a position map points from each site to its place in that list.
+    """
+
+    def __init__(self, siteCount, members=(), position=None):
+        """
+        Constructor
+        siteCount ... int number of sites in the lattice
+        members ... array int initial members of the set
+        position ... array int64 position map which can be shared by several sets whose members never overlap, None creates a new one
+        """
+        self.position = np.full(siteCount, -1, dtype=np.int64) if position is None else position
+        self.dense = [int(i) for i in members]
+        self.position[np.asarray(self.dense, dtype=np.int64)] = np.arange(len(self.dense))
+
+
+    def __len__(self):
+        return len(self.dense)
+
+
+    def __contains__(self, i):
+        p = self.position[i]
+        return 0 <= p < len(self.dense) and self.dense[p] == i
+
+
+    def add(self, i):
+        """
+        Adds a site to the set.
+        i ... int flat site index
+        """
+        if i not in self:
+            self.position[i] = len(self.dense)
+            self.dense.append(i)
+
+
+    def remove(self, i):
+        """
+        Removes a site from the set by moving the last member into its place.
+        i ... int flat site index
+        """
+        if i in self:
+            p = self.position[i]
+            last = self.dense.pop()
+            if last != i:
+                self.dense[p] = last
+                self.position[last] = p
+            self.position[i] = -1
+
+
+    def choice(self, u):
+        """
+        Picks a member of the set.
+        u ... float uniform random number from [0, 1)
+        returns int flat site index
+        """
+        return self.dense[min(int(u * len(self.dense)), len(self.dense) - 1)]
+
+
+class RateClasses():
+    """
+    Groups sites by their rate to allow rejection-free (n-fold way) selection of the next event.
+    Sites with the same rate share a class, so picking an event only needs a walk over the few classes.
+    """
+
+    def __init__(self, siteCount, rates=None, arrays=None):
+        """
+        Constructor
+        siteCount ... int number of sites in the lattice
+        rates ... array float rate of every site, sites with a rate of 0 are not part of any class
+        arrays ... (array, array, array) result of to_arrays, restores the classes with the same order of classes and members instead
+        """
+        self.position = np.full(siteCount, -1, dtype=np.int64)
+        self.rate = np.zeros(siteCount)
+        self.classes = {} # rate -> SiteSet
+        if arrays is not None:
+            # the order decides which site a random number picks, so it is kept exactly
+            classRates, classSizes, members = arrays
+            ends = np.cumsum(classSizes)
+            for rate, start, end in zip(classRates.tolist(), (ends - classSizes).tolist(), ends.tolist()):
+                self.classes[rate] = SiteSet(siteCount, members[start:end], self.position)
+            self.rate[members] = np.repeat(classRates, classSizes)
+            return
+        active = np.flatnonzero(rates > 0)
+        values, inverse = np.unique(rates[active], return_inverse=True)
+        for c in range(len(values)):
+            self.classes[float(values[c])] = SiteSet(siteCount, active[inverse == c], self.position)
+        self.rate[active] = rates[active]
+
+
+    def to_arrays(self):
+        """
+        Compact form of the classes, e.g. for checkpoints.
+        returns (array, array, array) float64 rate and int64 size of every class and int32 members of all classes in order
+        """
+        classRates = np.array(list(self.classes), dtype=np.float64)
+        classSizes = np.array([len(members) for members in self.classes.values()], dtype=np.int64)
+        members = np.array([i for siteSet in self.classes.values() for i in siteSet.dense], dtype=np.int32)
+        return classRates, classSizes, members
+
+
+    def total(self):
+        """
+        returns float sum of the rates of all sites
+        """
+        return sum(rate * len(members) for rate, members in self.classes.items())
+
+
+    def update(self, i, rate):
+        """
+        Moves a site into the class of its new rate.
+        i ... int flat site index
+        rate ... float new rate of the site, 0 removes it from all classes
+        """
+        old = self.rate[i]
+        if old == rate:
+            return
+        if old > 0:
+            self.classes[old].remove(i)
+            if len(self.classes[old]) == 0:
+                del self.classes[old]
+        if rate > 0:
+            if rate not in self.classes:
+                self.classes[rate] = SiteSet(len(self.rate), position=self.position)
+            self.classes[rate].add(i)
+        self.rate[i] = rate
+
+
+    def choice(self, u):
+        """
+        Picks a site with a probability proportional to its rate.
+        u ... float uniform random number from [0, 1)
+        returns int flat site index
+        """
+        target = u * self.total()
+        for rate, members in self.classes.items():
+            weight = rate * len(members)
+            if target < weight:
+                return members.choice(target / weight)
+            target -= weight
+        # only reached through rounding errors
+        return members.choice(1)
@@ -1,37 +1,199 @@
+import os
 import time
+import atexit
+import weakref
+import itertools
+import numpy as np
+
+# loggers which still have to be flushed when the interpreter exits
+OPENLOGGERS = weakref.WeakSet()
+# counter that keeps run names of the same process unique
+RUNCOUNTER = itertools.count()
+
+def run_name():
+    """
+    Creates a name which is unique for every run, also for runs started in parallel in the same second.
+    returns string time stamp with second resolution, process id and a counter
+    """
+    return "%s_%i_%i" % (time.strftime("%Y%m%d_%H%M%S"), os.getpid(), next(RUNCOUNTER))
+
+
+def read_xy(fileName):
+    """
+    Reads the xy-data written by a logger.
+    fileName ... string path of the csv file
+    returns (array, array) values of the x and y axis
+    """
+    data = np.loadtxt(fileName, delimiter=",", skiprows=1, ndmin=2)
+    return data[:, 0], data[:, 1]
+
+
+def read_columns(fileName):
+    """
+    Reads the rows written by a logger with named columns.
+    fileName ... string path of the csv file
+    returns dict column name -> array values of the column
+    """
+    with open(fileName) as f:
+        names = f.readline().strip().split(",")
+    data = np.loadtxt(fileName, delimiter=",", skiprows=1, ndmin=2).reshape(-1, len(names))
+    return {name: data[:, c] for c, name in enumerate(names)}
+
+
+@atexit.register
+def close_all():
+    """
+    Flushes and closes all loggers which are still open.
+    """
+    for logger in list(OPENLOGGERS):
+        logger.close()
+
 
 class Logger():
-    """Handles the file IO for the Kagome lattice"""
+    """Handles the file IO for the Kagome lattice.
+    Messages and data are collected in memory and written in blocks: text goes to a .log file, xy-data to a .csv file.
+    The old text format with both in a single .asc file can be written in addition."""
 
-    def __init__(self, fileName, filePath):
+    def __init__(self, fileName, filePath, runName=None, asc=False, bufferSize=10000, columns=("x", "y")):
         """Constructor
-        fileName ... string name of the file created by the logger"""
-        now = time.localtime()
-        self.fileName = "%s_%s%s%s_%s%s.asc" % (fileName, now[0], now[1], now[2], now[3], now[4])
+        fileName ... string name of the file created by the logger
+        filePath ... string folder of the file, None discards all messages
+        runName ... string unique name of the run which is added to the file name, None creates a new one
+        asc ... bool also write everything in the old .asc text format
+        bufferSize ... int number of buffered messages and data points which trigger a flush
+        columns ... array of string names of the columns of the csv file"""
+        if runName is None:
+            runName = run_name()
+        self.fileName = "%s_%s" % (fileName, runName)
         self.filePath = filePath
-        # file creation
-        self.log = open(self.filePath + self.fileName, 'w+', 1)
+        self.asc = asc
+        self.bufferSize = bufferSize
+        self.closed = False
+        self.lines = [] # buffered text messages
+        self.columns = columns
+        self.rows = [] # buffered data
+        self.ascLines = [] # buffered lines of the .asc file
+        self.written = 0 # number of rows which have been written
+        # extensions of the files which already exist, a file is only created when something is written to it
+        self.created = set()
+        if self.filePath is not None:
+            OPENLOGGERS.add(self)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
 
 
     def __del__(self):
-        """Destructor, cleaning up"""
-        self.log.close()
+        """Destructor, writes what is left if close was not called"""
+        self.close()
+
+
+    def file(self, extension):
+        """Location of one of the files of the logger.
+        extension ... string file extension
+        returns string path of the file"""
+        return self.filePath + self.fileName + extension
+
+
+    def open(self, extension):
+        """Opens one of the files of the logger, it is replaced by the first write of the run and appended to afterwards.
+        extension ... string file extension
+        returns file the opened file"""
+        mode = 'a' if extension in self.created else 'w'
+        self.created.add(extension)
+        return open(self.file(extension), mode)
 
 
     def log_text(self, message):
         """Writes a textline with time stamp to the logger.
         message ... string text to be written"""
-        self.log.write(time.strftime("%c") + ": %s\n" % message)
+        self.log_simple_text(time.strftime("%c") + ": %s" % message)
 
 
     def log_simple_text(self, message):
         """Writes a textline to the logger.
         message ... string text to be written"""
-        self.log.write("%s\n" % message)
+        if self.filePath is None:
+            return
+        self.lines.append(message)
+        if self.asc:
+            self.ascLines.append(message)
+        self.check_buffer()
 
 
     def log_xy(self, x, y):
         """Writes data in the xy-format to the logger.
         x ... number value of x axis
         y ... number value of y axis"""
-        self.log.write("%s;%s\n" % (x, y))
\ No newline at end of file
+        self.log_row((x, y))
+
+
+    def log_row(self, values):
+        """Writes a row of data with one value per column to the logger.
+        values ... array of numbers values of all columns"""
+        if self.filePath is None:
+            return
+        self.rows.append(values)
+        if self.asc:
+            self.ascLines.append(";".join("%s" % value for value in values))
+        self.check_buffer()
+
+
+    def check_buffer(self):
+        """Flushes the logger when the buffer is full."""
+        if len(self.lines) + len(self.rows) >= self.bufferSize:
+            self.flush()
+
+
+    def flush(self):
+        """Writes all buffered messages and data to the files."""
+        if self.filePath is None or self.closed:
+            return
+        if self.lines:
+            with self.open(".log") as f:
+                f.writelines(line + "\n" for line in self.lines)
+        if self.rows:
+            with self.open(".csv") as f:
+                if f.tell() == 0:
+                    f.write(",".join(self.columns) + "\n")
+                np.savetxt(f, np.array(self.rows, dtype=np.float64), delimiter=",", fmt="%.17g")
+        if self.ascLines:
+            with self.open(".asc") as f:
+                f.writelines(line + "\n" for line in self.ascLines)
+        self.written += len(self.rows)
+        self.lines = []
+        self.rows = []
+        self.ascLines = []
+
+
+    def position(self):
+        """Writes everything and reports the size of the files, e.g. for checkpoints.
+        returns dict file extension -> int size in bytes"""
+        self.flush()
+        if self.filePath is None:
+            return {}
+        return {extension: os.path.getsize(self.file(extension)) for extension in self.created}
+
+
+    def restore(self, positions):
+        """Continues the files of an earlier logger of the same run, everything after the given positions is dropped.
+        positions ... dict file extension -> int size in bytes, the result of position"""
+        if self.filePath is None:
+            return
+        for extension, size in positions.items():
+            with open(self.file(extension), 'a') as f:
+                f.truncate(size)
+            self.created.add(extension)
+
+
+    def close(self):
+        """Writes everything and closes the logger, further messages are discarded."""
+        if not self.closed:
+            self.flush()
+            self.closed = True
+            self.filePath = None
@@ -0,0 +1,252 @@
+import lattice
+import traceback
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+class SharedArrays():
+    """
+    Arrays which the worker processes of a parallel run share with the main process.
+    Arrays in memory are copied into shared memory blocks, memory-mapped files are mapped by every process instead.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.blocks = []
+        self.descriptors = {} # name -> descriptor from which attach opens the array
+
+
+    def add(self, name, array):
+        """
+        Shares an array with the workers.
+        name ... str name of the array in the descriptors
+        array ... array the array, its content is copied unless it is a memory-mapped file
+        returns array the shared array of the main process, changes made by the workers are visible in it
+        """
+        if isinstance(array, np.memmap) and array.filename is not None and array.mode in ('r', 'r+', 'w+'):
+            self.descriptors[name] = ("file", array.filename, array.dtype.str, array.shape, array.offset, 'r' if array.mode == 'r' else 'r+')
+            return array
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.blocks.append(block)
+        shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+        shared[...] = array
+        self.descriptors[name] = ("memory", block.name, array.dtype.str, array.shape)
+        return shared
+
+
+    def close(self):
+        """
+        Releases the shared memory blocks, the arrays of the main process must not be used anymore.
+        """
+        for block in self.blocks:
+            try:
+                block.close()
+            except BufferError:
+                # an array of the main process still points into the block, it is freed together with that array
+                pass
+            block.unlink()
+        self.blocks = []
+
+
+def attach(descriptor):
+    """
+    Opens an array shared by SharedArrays in a worker process.
+    descriptor ... tuple entry of SharedArrays.descriptors
+    returns (array, SharedMemory) the array and its shared memory block, None for memory-mapped files
+    """
+    if descriptor[0] == "file":
+        kind, fileName, dtype, shape, offset, mode = descriptor
+        return np.memmap(fileName, dtype=dtype, mode=mode, offset=offset, shape=shape), None
+    kind, name, dtype, shape = descriptor
+    block = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=block.buf), block
+
+
+def stripes(latticePointsY, reach, workers):
+    """
+    Splits the rows of the torus into an even number of stripes which are at least reach rows high.
+    Stripes of even and odd index have different colors, two rhombs in different stripes of the same color are then
+    more than reach rows apart, so neither of them is in a shell of the other one.
+    latticePointsY ... int lattice points in y direction
+    reach ... int largest distance in rows between a rhomb and the members of the shells the rules use, see lattice.Lattice.row_reach
+    workers ... int number of worker processes, there are at most two stripes per worker
+    returns array of (int, int) first row and the row after the last one of each stripe
+    """
+    pairs = min(workers, latticePointsY // (2 * max(reach, 1)))
+    if pairs < 1:
+        raise ValueError("The parallel mode needs at least %i rows for shells which reach %i rows" % (2 * max(reach, 1), reach))
+    bounds = np.linspace(0, latticePointsY, 2 * pairs + 1).astype(np.int64).tolist()
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def run_steps(sites, uniforms, reacted, shells, tables):
+    """
+    Applies Monte Carlo steps to the state in their order, the reacted neighbors are counted from the states of the shell members.
+    Steps which do not depend on an earlier one are evaluated together, see lattice.dependent_steps, the others one by one.
+    sites ... array int64 flat index of the rhomb selected by each step
+    uniforms ... array float uniform random number of each step
+    reacted ... array bool state of all rhombs, the reactions are written to it
+    shells ... dict order -> (array, array) offsets and indices of the shells which the rules use
+    tables ... dict order -> array lookup tables of reactivityModifier.CompiledRules
+    returns (array, int) int64 steps which led to a reaction and the number of evaluated steps
+    """
+    if len(sites) == 0:
+        return np.zeros(0, dtype=np.int64), 0
+    dependent = lattice.dependent_steps(sites, list(shells.values()))
+    unreacted = ~reacted[sites]
+    chanceToReact = np.ones(len(sites))
+    for order, (offsets, indices) in shells.items():
+        owner, members = lattice.gather(offsets, indices, sites)
+        reactedNeighbors = np.bincount(owner, weights=reacted[members], minlength=len(sites)).astype(np.int64)
+        chanceToReact *= tables[order][offsets[sites + 1] - offsets[sites], reactedNeighbors]
+    independent = unreacted & ~dependent
+    reacts = independent & (uniforms <= chanceToReact)
+    evaluations = int(np.count_nonzero(independent))
+    reactedSteps = []
+    first = 0
+    for t in np.flatnonzero(dependent).tolist() + [len(sites)]:
+        # the independent steps up to the next dependent one
+        batch = first + np.flatnonzero(reacts[first:t])
+        reacted[sites[batch]] = True
+        reactedSteps.append(batch)
+        if t == len(sites):
+            break
+        # a dependent step sees the reactions of all earlier steps
+        i = int(sites[t])
+        if not reacted[i]:
+            evaluations += 1
+            chance = 1
+            for order, (offsets, indices) in shells.items():
+                chance *= tables[order][offsets[i + 1] - offsets[i], np.count_nonzero(reacted[indices[offsets[i]:offsets[i + 1]]])]
+            if uniforms[t] <= chance:
+                reacted[i] = True
+                reactedSteps.append([t])
+        first = t + 1
+    return np.concatenate(reactedSteps).astype(np.int64), evaluations
+
+
+def worker(connection, descriptors, rowStart, rowLength, tables):
+    """
+    Main function of a worker process. For every phase it receives (seed, jobs) with jobs as (stripe, first row, row after the last one, steps)
+    and answers with (stripe, steps which led to a reaction, reacted rhombs, evaluations) for each job, None ends the worker.
+    connection ... multiprocessing.connection.Connection pipe to the main process
+    descriptors ... dict SharedArrays.descriptors with the state as reacted and the shells as offsets<n> and indices<n>
+    rowStart ... array int64 flat index of the first site of every row
+    rowLength ... array int64 number of sites of every row
+    tables ... dict order -> array lookup tables of reactivityModifier.CompiledRules
+    """
+    blocks = []
+    arrays = {}
+    for name, descriptor in descriptors.items():
+        arrays[name], block = attach(descriptor)
+        if block is not None:
+            blocks.append(block)
+    reacted = arrays["reacted"]
+    shells = {order: (arrays["offsets%i" % order], arrays["indices%i" % order]) for order in tables}
+    # largest number of rhombs which decide the outcome of a step, the tables have a row for every possible number of neighbors
+    neighborhood = 1 + sum(len(table) - 1 for table in tables.values())
+    try:
+        while True:
+            task = connection.recv()
+            if task is None:
+                break
+            seed, jobs = task
+            results = []
+            for stripe, firstRow, stopRow, steps in jobs:
+                # every stripe has its own random stream, so the result does not depend on the number of workers
+                generator = np.random.default_rng([seed, stripe])
+                rows = firstRow + (generator.random(steps) * (stopRow - firstRow)).astype(np.int64)
+                sites = rowStart[rows] + (generator.random(steps) * rowLength[rows]).astype(np.int64)
+                uniforms = generator.random(steps)
+                # blocks in which about one step in twenty depends on an earlier one, as in Kagome.run_block
+                blockSize = max(16, int(rowStart[stopRow] - rowStart[firstRow]) // (10 * neighborhood))
+                reactedSteps = [np.zeros(0, dtype=np.int64)]
+                evaluations = 0
+                for start in range(0, steps, blockSize):
+                    blockSteps, blockEvaluations = run_steps(sites[start:start + blockSize], uniforms[start:start + blockSize], reacted, shells, tables)
+                    reactedSteps.append(start + blockSteps)
+                    evaluations += blockEvaluations
+                reactedSteps = np.concatenate(reactedSteps)
+                results.append((stripe, reactedSteps, sites[reactedSteps], evaluations))
+            connection.send(results)
+    except Exception:
+        connection.send(traceback.format_exc())
+    finally:
+        del reacted, shells, arrays
+        for block in blocks:
+            try:
+                block.close()
+            except BufferError:
+                pass
+        connection.close()
+
+
+class StripeWorkers():
+    """
+    Worker processes which run the Monte Carlo steps of several stripes at the same time.
+    """
+
+    def __init__(self, workers, descriptors, rowStart, rowLength, tables):
+        """
+        Constructor, starts the processes
+        workers ... int number of worker processes
+        descriptors ... dict SharedArrays.descriptors, see worker
+        rowStart ... array int64 flat index of the first site of every row
+        rowLength ... array int64 number of sites of every row
+        tables ... dict order -> array lookup tables of reactivityModifier.CompiledRules
+        """
+        context = multiprocessing.get_context("spawn")
+        self.connections = []
+        self.processes = []
+        for w in range(workers):
+            connection, workerConnection = context.Pipe()
+            process = context.Process(target=worker, args=(workerConnection, descriptors, rowStart, rowLength, tables), daemon=True)
+            process.start()
+            workerConnection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+
+    def __len__(self):
+        return len(self.processes)
+
+
+    def run_phase(self, seed, jobs):
+        """
+        Runs the steps of some stripes, which must not interact, and waits for all of them.
+        seed ... int seed of the random streams of this phase
+        jobs ... array of (int, int, int, int) stripe, first row, row after the last one and number of steps, they are spread over the workers
+        returns array of (int, array, array, int) for every job the stripe, int64 steps which led to a reaction, int64 reacted rhombs and the number of evaluated steps
+        """
+        for w, connection in enumerate(self.connections):
+            connection.send((seed, jobs[w::len(self.connections)]))
+        results = []
+        for connection in self.connections:
+            try:
+                result = connection.recv()
+            except (EOFError, OSError):
+                raise RuntimeError("A worker of the parallel mode stopped unexpectedly")
+            if isinstance(result, str):
+                raise RuntimeError("A worker of the parallel mode failed:\n%s" % result)
+            results.extend(result)
+        return results
+
+
+    def close(self):
+        """
+        Stops the worker processes.
+        """
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+            connection.close()
+        for process in self.processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        self.connections = []
+        self.processes = []
@@ -0,0 +1,169 @@
+import sys
+import json
+import time
+
+# parts of a run whose time is measured by Instrumentation
+SECTIONS = ("selection", "rules", "rendering", "logging")
+
+class ProgressReporter():
+    """
+    Shows the progress of a simulation on a single terminal line, at most once per interval.
+    Nothing is written if the output is not a terminal, e.g. in batch jobs or worker processes.
+    """
+
+    def __init__(self, interval=0.5, stream=None, enabled=None):
+        """
+        Constructor
+        interval ... float minimum time between two updates in seconds
+        stream ... file output of the progress, None uses sys.stdout
+        enabled ... bool show the progress, None shows it only if stream is a terminal
+        """
+        self.stream = sys.stdout if stream is None else stream
+        if enabled is None:
+            isatty = getattr(self.stream, "isatty", None)
+            enabled = isatty is not None and isatty()
+        self.enabled = enabled
+        self.interval = interval
+        self.lastUpdate = -float("inf")
+        self.shown = False
+
+
+    def due(self):
+        """
+        returns bool the interval since the last update has passed
+        """
+        return self.enabled and time.perf_counter() - self.lastUpdate >= self.interval
+
+
+    def show(self, message):
+        """
+        Replaces the progress line.
+        message ... str new content of the line
+        """
+        if not self.enabled:
+            return
+        self.stream.write("\r" + message)
+        self.stream.flush()
+        self.lastUpdate = time.perf_counter()
+        self.shown = True
+
+
+    def finish(self):
+        """
+        Ends the progress line, so following output starts on a new line.
+        """
+        if self.shown:
+            self.stream.write("\n")
+            self.stream.flush()
+            self.shown = False
+
+
+class Instrumentation():
+    """
+    Statistics of a simulation run: Monte Carlo steps per second, acceptance rate and where the time went.
+    The time split between selection, rules, rendering and logging is only measured if timing is set,
+    since the clock is read several times per Monte Carlo step.
+    """
+
+    def __init__(self, timing=False):
+        """
+        Constructor
+        timing ... bool measure the time of the sections of every Monte Carlo step
+        """
+        self.timing = timing
+        self.steps = 0 # Monte Carlo steps, sweeps in synchronous mode
+        self.attempts = 0 # selections of unreacted or reacted rhombs which could lead to a reaction
+        self.evaluations = 0 # unreacted rhombs for which the rules were evaluated and reacted ones for which the back reaction rules were
+        self.reactions = 0
+        self.backReactions = 0 # reacted rhombs which turned back, not included in the reactions
+        self.seconds = dict.fromkeys(SECTIONS, 0.0)
+        self.wallTime = 0.0
+        self.startTime = None
+
+
+    def start(self):
+        """
+        Starts the wall clock of the run.
+        """
+        self.startTime = time.perf_counter()
+
+
+    def stop(self):
+        """
+        Stops the wall clock of the run.
+        """
+        if self.startTime is not None:
+            self.wallTime += time.perf_counter() - self.startTime
+            self.startTime = None
+
+
+    def elapsed(self):
+        """
+        returns float seconds the run has taken so far
+        """
+        if self.startTime is None:
+            return self.wallTime
+        return self.wallTime + time.perf_counter() - self.startTime
+
+
+    def add(self, section, seconds):
+        """
+        Adds time to a section.
+        section ... str one of SECTIONS
+        seconds ... float time spent in the section
+        """
+        self.seconds[section] += seconds
+
+
+    def steps_per_second(self):
+        """
+        returns float Monte Carlo steps per second of wall time
+        """
+        elapsed = self.elapsed()
+        return self.steps / elapsed if elapsed > 0 else 0.0
+
+
+    def acceptance_rate(self):
+        """
+        returns float fraction of the attempts which led to a reaction
+        """
+        return self.reactions / self.attempts if self.attempts > 0 else 0.0
+
+
+    def report(self):
+        """
+        Collects all statistics.
+        returns dict statistics of the run, sections are only included if timing is set
+        """
+        result = {"steps": self.steps,
+                  "attempts": self.attempts,
+                  "evaluations": self.evaluations,
+                  "reactions": self.reactions,
+                  "backReactions": self.backReactions,
+                  "wallTime": self.elapsed(),
+                  "stepsPerSecond": self.steps_per_second(),
+                  "acceptanceRate": self.acceptance_rate()}
+        if self.timing:
+            result["seconds"] = dict(self.seconds)
+            result["seconds"]["other"] = max(0.0, self.elapsed() - sum(self.seconds.values()))
+        return result
+
+
+    def dump(self, fileName):
+        """
+        Writes the statistics as json.
+        fileName ... str path of the file
+        """
+        with open(fileName, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+
+    def __str__(self):
+        report = self.report()
+        text = "%i steps in %0.2f s, %0.0f steps/s, %i reactions, acceptance rate %0.4f" % (
+            report["steps"], report["wallTime"], report["stepsPerSecond"], report["reactions"], report["acceptanceRate"])
+        if self.backReactions > 0:
+            text += ", %i back reactions" % self.backReactions
+        if self.timing and report["wallTime"] > 0:
+            text += ", " + ", ".join("%s %0.1f%%" % (section, 100 * seconds / report["wallTime"]) for section, seconds in report["seconds"].items())
+        return text
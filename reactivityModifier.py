@@ -1,4 +1,6 @@
 import rhomb
+import math
+import numpy as np
 
 class ReactivityModifier():
     """
@@ -32,4 +34,78 @@ class ReactivityModifier():
         Creates the r - 1 condition for the rule itself
         returns ReactivityModifier the r - 1 condition for itself
         """
-        return ReactivityModifier(1 - self.r, self.neighborOrder, rhomb.MAXNEIGHBORS[self.neighborOrder - 1] - self.unreactedLateralNeighborsRequired + 1, rhomb.MAXNEIGHBORS[self.neighborOrder - 1] - self.reactedLateralNeighborsRequired + 1)
\ No newline at end of file
+        return ReactivityModifier(1 - self.r, self.neighborOrder, rhomb.MAXNEIGHBORS[self.neighborOrder - 1] - self.unreactedLateralNeighborsRequired + 1, rhomb.MAXNEIGHBORS[self.neighborOrder - 1] - self.reactedLateralNeighborsRequired + 1)
+
+
+class CompiledRules():
+    """
+    A rule set compiled into lookup tables.
+    Whether a modifier applies only depends on the number of reacted and unreacted neighbors of its order,
+    so all modifiers of one order are combined into a table indexed by (number of neighbors, number of reacted neighbors).
+    The reaction probability is the product of the table entries of all orders used by the rule set.
+    """
+
+    def __init__(self, reactivityModifiers, maxNeighbors=rhomb.MAXNEIGHBORS):
+        """
+        Constructor
+        reactivityModifiers ... array of ReactivityModifier rule set which is compiled
+        maxNeighbors ... array int highest number of neighbors per order, defaults to rhomb.MAXNEIGHBORS
+        """
+        self.reactivityModifiers = list(reactivityModifiers)
+        self.orders = sorted(set(modifier.neighborOrder for modifier in self.reactivityModifiers))
+        self.maxNeighborOrder = max(self.orders, default=1)
+        self.tables = {}
+        for order in self.orders:
+            size = maxNeighbors[order - 1]
+            allNeighbors, reactedNeighbors = np.meshgrid(np.arange(size + 1), np.arange(size + 1), indexing='ij')
+            unreactedNeighbors = allNeighbors - reactedNeighbors
+            table = np.ones((size + 1, size + 1))
+            for modifier in self.reactivityModifiers:
+                if modifier.neighborOrder != order:
+                    continue
+                # nan means that the modifier does not care about the number of neighbors
+                applies = np.ones(table.shape, dtype=bool)
+                if not math.isnan(modifier.reactedLateralNeighborsRequired):
+                    applies &= modifier.reactedLateralNeighborsRequired <= reactedNeighbors
+                if not math.isnan(modifier.unreactedLateralNeighborsRequired):
+                    applies &= modifier.unreactedLateralNeighborsRequired <= unreactedNeighbors
+                table[applies] *= modifier.r
+            self.tables[order] = table
+
+
+    def __str__(self):
+        """
+        tostring functions
+        returns string a human readable message that lists all compiled modifiers
+        """
+        return "compiled rules for orders %s:\n%s" % (self.orders, "\n".join(str(modifier) for modifier in self.reactivityModifiers))
+
+
+    def chance(self, reactedNeighbors, allNeighbors, i):
+        """
+        Reaction probability of a single site.
+        reactedNeighbors ... array[order, N] number of reacted neighbors of each site by order
+        allNeighbors ... array[order, N] number of neighbors of each site by order
+        i ... int flat site index
+        returns float probability that the site reacts
+        """
+        chanceToReact = 1
+        for order in self.orders:
+            chanceToReact *= self.tables[order][allNeighbors[order - 1][i], reactedNeighbors[order - 1][i]]
+        return chanceToReact
+
+
+    def chance_many(self, reactedNeighbors, allNeighbors, sites=None):
+        """
+        Reaction probability of many sites at once.
+        reactedNeighbors ... array[order, N] number of reacted neighbors of each site by order
+        allNeighbors ... array[order, N] number of neighbors of each site by order
+        sites ... array int flat indices of the sites, None selects all of them
+        returns array float probability that each site reacts
+        """
+        if sites is None:
+            sites = slice(None)
+        chanceToReact = np.ones(len(allNeighbors[0][sites]))
+        for order in self.orders:
+            chanceToReact *= self.tables[order][allNeighbors[order - 1][sites], reactedNeighbors[order - 1][sites]]
+        return chanceToReact
@@ -0,0 +1,508 @@
+import rhomb
+import lattice
+import trajectory
+import os
+import math
+import concurrent.futures
+import numpy as np
+
+# PIL is imported by the functions which create images, so headless runs never load it
+
+# renderers of the current process, see frame_renderer
+RENDERERS = {}
+# below this many pixels per rhomb the rhombs are not drawn anymore but the local conversion, see DensityRenderer
+DENSITYTHRESHOLD = 2.0
+# number of rhombs which a density bin should hold on average
+SITESPERBIN = 4
+# number of color levels between unreacted and reacted of a density image
+DENSITYLEVELS = 254
+# number of rhombs which a density renderer reads from the state at once, so a memory-mapped state is never loaded as a whole
+BANDSITES = 1 << 22
+
+def lattice_height(latticeWidth):
+    """
+    Height of the rhombs, this is a simple mathematical relation of hexagon width to height.
+    latticeWidth ... width of the rhombs in pixel
+    returns float height of the rhombs in pixel
+    """
+    return 1/2 * 2 * math.sqrt((latticeWidth / 2) ** 2 -
+                               (latticeWidth / 2 * math.cos(math.radians(60))) ** 2)
+
+
+def image_offsets(latticePointsX, latticePointsY, latticeWidth, imageSize):
+    """
+    Shift which centers the tiling on the image.
+    latticePointsX ... int lattice points in x direction
+    latticePointsY ... int lattice points in y direction
+    latticeWidth ... width of the rhombs in pixel
+    imageSize ... (int, int) dimension of the image
+    returns (int, int) shift of the tiling to the left and to the top in pixel
+    """
+    return (int((latticePointsX / 2 * latticeWidth - imageSize[0]) / 2),
+            int((latticePointsY * lattice_height(latticeWidth) - imageSize[1]) / 2))
+
+
+def full_image_size(latticePointsX, latticePointsY, latticeWidth):
+    """
+    Dimension of an image which shows the whole lattice.
+    latticePointsX ... int lattice points in x direction
+    latticePointsY ... int lattice points in y direction
+    latticeWidth ... width of the rhombs in pixel
+    returns (int, int) image size in pixel
+    """
+    return (int(latticePointsX / 2 * latticeWidth) + latticeWidth, int(latticePointsY * lattice_height(latticeWidth)) + latticeWidth)
+
+
+def pixels_per_rhomb(latticeWidth):
+    """
+    Area of the image which a single rhomb covers.
+    latticeWidth ... width of the rhombs in pixel
+    returns float pixels per rhomb
+    """
+    # a row pair of the width of two lattice points holds three rhombs
+    return 2 / 3 * latticeWidth * lattice_height(latticeWidth)
+
+
+def kag_to_screen(x, y, latticeWidth, latticeHeight, xOffset, yOffset):
+    """
+    Transforms a kagome coordinate to a point on screen.
+    x ... int x-coordinate of the Kagome lattice point
+    y ... int y-coordinate of the Kagome lattice point
+    latticeWidth ... width of the rhombs in pixel
+    latticeHeight ... height of the rhombs in pixel
+    xOffset ... int shift of the tiling to the left in pixel
+    yOffset ... int shift of the tiling to the top in pixel
+    returns a tuple of (x, y) coordinates to draw on an image.
+    """
+    if y % 2 == 0:
+        indent = latticeWidth / 4
+        step = latticeWidth / 2
+    else:
+        indent = 0
+        step = latticeWidth
+    if (y + 1) % 4 == 0:
+        indent = latticeWidth / 2
+    return (x * step + indent - xOffset,
+            y * latticeHeight - yOffset)
+
+
+def rhomb_polygon(x, y, latticeWidth, latticeHeight, xOffset, yOffset):
+    """
+    Vertex coordinates of the rhomb at a kagome lattice point in the correct orientation.
+    x ... int x-coordinate of the Kagome lattice point
+    y ... int y-coordinate of the Kagome lattice point
+    latticeWidth ... width of the rhombs in pixel
+    latticeHeight ... height of the rhombs in pixel
+    xOffset ... int shift of the tiling to the left in pixel
+    yOffset ... int shift of the tiling to the top in pixel
+    returns (int, int, int, int, int, int, int, int) four pairs of coordinates that define the polygon
+    """
+    draw_x, draw_y = kag_to_screen(x, y, latticeWidth, latticeHeight, xOffset, yOffset)
+    # figure out the right orientation
+    if y % 2 == 1:
+        return rhomb.lying(draw_x, draw_y, latticeWidth, latticeHeight)
+    elif ((y % 2 == 0 and x % 2 == 1 and y % 4 == 0) or
+          (y % 2 == 0 and x % 2 == 0 and y % 4 == 2)):
+        return rhomb.right(draw_x, draw_y, latticeWidth, latticeHeight)
+    else:
+        return rhomb.left(draw_x, draw_y, latticeWidth, latticeHeight)
+
+
+def screen_positions(x, y, latticeWidth, latticeHeight, xOffset, yOffset):
+    """
+    Transforms many kagome coordinates to points on screen at once, see kag_to_screen.
+    x ... array int x-coordinates of the Kagome lattice points
+    y ... array int y-coordinates of the Kagome lattice points
+    latticeWidth ... width of the rhombs in pixel
+    latticeHeight ... height of the rhombs in pixel
+    xOffset ... int shift of the tiling to the left in pixel
+    yOffset ... int shift of the tiling to the top in pixel
+    returns (array, array) float x and y coordinates of the centers of the rhombs
+    """
+    x = np.asarray(x, dtype=np.int64)
+    y = np.asarray(y, dtype=np.int64)
+    even = y % 2 == 0
+    step = np.where(even, latticeWidth / 2, latticeWidth)
+    indent = np.where(even, latticeWidth / 4, np.where((y + 1) % 4 == 0, latticeWidth / 2, 0))
+    return x * step + indent - xOffset, y * latticeHeight - yOffset
+
+
+def visible_rows(geometry, latticeHeight, imageSize, yOffset, margin):
+    """
+    Rows of the lattice which are on the image.
+    geometry ... lattice.Lattice geometry of the lattice
+    latticeHeight ... height of the rhombs in pixel
+    imageSize ... (int, int) dimension of the image
+    yOffset ... int shift of the tiling to the top in pixel
+    margin ... float distance in pixel by which a row may lie outside of the image
+    returns (int, int) first visible row and the row after the last one, the range is empty if no row is visible
+    """
+    low = max(0, math.ceil((yOffset - margin) / latticeHeight))
+    high = min(geometry.latticePointsY - 1, math.floor((yOffset + imageSize[1] + margin) / latticeHeight))
+    return low, max(low, high + 1)
+
+
+def visible_sites(geometry, latticeWidth, latticeHeight, imageSize, xOffset, yOffset, margin=None, rows=None):
+    """
+    Culls the sites which are not on the image. The visible range of every row is calculated directly,
+    so the cost only depends on the number of visible sites and not on the size of the lattice.
+    geometry ... lattice.Lattice geometry of the lattice
+    latticeWidth ... width of the rhombs in pixel
+    latticeHeight ... height of the rhombs in pixel
+    imageSize ... (int, int) dimension of the image
+    xOffset ... int shift of the tiling to the left in pixel
+    yOffset ... int shift of the tiling to the top in pixel
+    margin ... float distance in pixel by which the center of a rhomb may lie outside of the image, None keeps every rhomb which touches the image
+    rows ... (int, int) first row and the row after the last one to which the result is limited, None takes all rows
+    returns array int64 sorted flat indices of the visible sites
+    """
+    if margin is None:
+        # the vertices are at most half a width from the center, plus the rounding to whole pixels
+        margin = latticeWidth / 2 + 1
+    low, stop = visible_rows(geometry, latticeHeight, imageSize, yOffset, margin)
+    if rows is not None:
+        low, stop = max(low, rows[0]), min(stop, rows[1])
+    if stop <= low:
+        return np.zeros(0, dtype=np.int64)
+    rows = np.arange(low, stop, dtype=np.int64)
+    # screen x of a row is x * step + indent - xOffset, see kag_to_screen
+    even = rows % 2 == 0
+    step = np.where(even, latticeWidth / 2, latticeWidth)
+    indent = np.where(even, latticeWidth / 4, np.where((rows + 1) % 4 == 0, latticeWidth / 2, 0))
+    first = np.maximum(0, np.ceil((xOffset - margin - indent) / step)).astype(np.int64)
+    last = np.minimum(geometry.rowLength[rows] - 1, np.floor((xOffset + imageSize[0] + margin - indent) / step)).astype(np.int64)
+    counts = np.maximum(last - first + 1, 0)
+    # concatenated ranges rowStart + first ... rowStart + last of all rows
+    starts = geometry.rowStart[rows] + first
+    return np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(int(counts.sum()), dtype=np.int64)
+
+
+class LabelMapRenderer():
+    """
+    Renders the state of a lattice without drawing polygons for every image.
+    The tiling is rasterized once into a map from pixels to sites and a static outline layer,
+    every snapshot is then a lookup of the state of each pixel's site. Only the rhombs on the image are rasterized
+    and only their states are read, so a memory-mapped state is never loaded as a whole.
+    """
+
+    def __init__(self, geometry, latticeWidth, latticeHeight, imageSize, xOffset, yOffset, reactedColor='red', backgroundColor='white'):
+        """
+        Constructor
+        geometry ... lattice.Lattice geometry of the lattice
+        latticeWidth ... width of the rhombs in pixel
+        latticeHeight ... height of the rhombs in pixel
+        imageSize ... (int, int) dimension of the resulting images
+        xOffset ... int shift of the tiling to the left in pixel
+        yOffset ... int shift of the tiling to the top in pixel
+        reactedColor ... str or (int, int, int) color of reacted rhombs
+        backgroundColor ... str or (int, int, int) color of unreacted rhombs and the background
+        """
+        from PIL import Image, ImageDraw, ImageColor
+        self.geometry = geometry
+        self.imageSize = imageSize
+
+        # sites on the image, the labels refer to their position in this array
+        self.sites = visible_sites(geometry, latticeWidth, latticeHeight, imageSize, xOffset, yOffset)
+        # pixel -> position in self.sites + 1, 0 is the background
+        labels = Image.new('I', imageSize, 0)
+        labelDraw = ImageDraw.Draw(labels)
+        # outline of the tiling as drawn by Kagome.draw_tiling
+        outline = Image.new('L', imageSize, 0)
+        outlineDraw = ImageDraw.Draw(outline)
+        for k, i in enumerate(self.sites.tolist()):
+            polygon = rhomb_polygon(int(geometry.siteX[i]), int(geometry.siteY[i]), latticeWidth, latticeHeight, xOffset, yOffset)
+            labelDraw.polygon(polygon, k + 1)
+            outlineDraw.polygon(polygon, outline=255)
+        self.labels = np.asarray(labels, dtype=np.int64)
+        self.outline = np.asarray(outline) > 0
+
+        # colors by index: background, unreacted, reacted, highlighted and outline
+        # Kagome.draw_tiling uses the color 1 for the outline, which is (1, 0, 0) in RGB
+        self.palette = np.array([ImageColor.getrgb(backgroundColor), ImageColor.getrgb(backgroundColor),
+                                 ImageColor.getrgb(reactedColor), ImageColor.getrgb('blue'), (1, 0, 0)], dtype=np.uint8)
+
+
+    def render_indexed(self, reacted, highlighted=None):
+        """
+        Creates the palette indices of an image of a state of the lattice.
+        reacted ... array bool state of all sites, None draws all of them unreacted
+        highlighted ... array int flat indices of sites which are drawn in blue, e.g. seeds
+        returns array[height, width] uint8 index into self.palette for every pixel
+        """
+        state = np.ones(len(self.sites) + 1, dtype=np.uint8)
+        state[0] = 0
+        if reacted is not None:
+            state[1:] += np.asarray(reacted[self.sites], dtype=np.uint8)
+        if highlighted is not None:
+            highlighted = np.asarray(highlighted, dtype=np.int64)
+            state[1 + np.searchsorted(self.sites, highlighted[np.isin(highlighted, self.sites)])] = 3
+        indices = state[self.labels]
+        indices[self.outline] = 4
+        return indices
+
+
+    def render(self, reacted, highlighted=None):
+        """
+        Creates an image of a state of the lattice.
+        reacted ... array bool state of all sites, None draws all of them unreacted
+        highlighted ... array int flat indices of sites which are drawn in blue, e.g. seeds
+        returns PIL.Image image of the state
+        """
+        from PIL import Image
+        return Image.fromarray(self.palette[self.render_indexed(reacted, highlighted)], 'RGB')
+
+
+    def to_image(self, indices):
+        """
+        Turns palette indices into a compact palette image.
+        indices ... array[height, width] uint8 result of render_indexed
+        returns PIL.Image image in P mode
+        """
+        from PIL import Image
+        image = Image.fromarray(indices, 'P')
+        image.putpalette(self.palette.reshape(-1).tolist())
+        return image
+
+
+class DensityRenderer():
+    """
+    Renders the local conversion of a lattice whose rhombs are smaller than a pixel.
+    The image is split into square bins, every snapshot counts the reacted rhombs of each bin with numpy
+    and colors the bin between the unreacted and the reacted color. Only the rhombs on the image are counted,
+    they are read in bands of rows, so a memory-mapped state is never loaded as a whole.
+    """
+
+    def __init__(self, geometry, latticeWidth, latticeHeight, imageSize, xOffset, yOffset, reactedColor='red', backgroundColor='white', binSize=None):
+        """
+        Constructor
+        geometry ... lattice.Lattice geometry of the lattice
+        latticeWidth ... width of the rhombs in pixel
+        latticeHeight ... height of the rhombs in pixel
+        imageSize ... (int, int) dimension of the resulting images
+        xOffset ... int shift of the tiling to the left in pixel
+        yOffset ... int shift of the tiling to the top in pixel
+        reactedColor ... str or (int, int, int) color of fully converted bins
+        backgroundColor ... str or (int, int, int) color of unconverted bins and the background
+        binSize ... int edge length of the bins in pixel, None chooses it so that a bin holds about SITESPERBIN rhombs
+        """
+        from PIL import ImageColor
+        self.geometry = geometry
+        self.imageSize = imageSize
+        if binSize is None:
+            binSize = max(1, math.ceil(math.sqrt(SITESPERBIN * pixels_per_rhomb(latticeWidth))))
+        self.binSize = binSize
+        self.latticeWidth = latticeWidth
+        self.latticeHeight = latticeHeight
+        self.xOffset = xOffset
+        self.yOffset = yOffset
+        self.binsX = -(-imageSize[0] // binSize)
+        binsY = -(-imageSize[1] // binSize)
+        self.binCount = self.binsX * binsY
+
+        # bands of rows with about BANDSITES rhombs whose center can be on the image
+        firstRow, stopRow = visible_rows(geometry, latticeHeight, imageSize, yOffset, 0)
+        rowsPerBand = max(1, BANDSITES // geometry.latticePointsX)
+        self.bands = [(row, min(row + rowsPerBand, stopRow)) for row in range(firstRow, stopRow, rowsPerBand)]
+        # the sites and bins of a single band are kept, more bands are recalculated for every image
+        self.bandBins = None
+        self.sitesPerBin = np.zeros(self.binCount, dtype=np.int64)
+        for band in self.bands:
+            sites, bins = self.band_bins(band)
+            self.sitesPerBin += np.bincount(bins, minlength=self.binCount)
+        if len(self.bands) == 1:
+            self.bandBins = (sites, bins)
+        # pixel -> bin
+        self.pixelBins = (np.arange(imageSize[1]) // binSize)[:, None] * self.binsX + (np.arange(imageSize[0]) // binSize)[None, :]
+
+        # colors by index: background, DENSITYLEVELS steps from unreacted to reacted and highlighted
+        background = np.array(ImageColor.getrgb(backgroundColor), dtype=np.float64)
+        reacted = np.array(ImageColor.getrgb(reactedColor), dtype=np.float64)
+        levels = np.linspace(0, 1, DENSITYLEVELS)[:, None]
+        self.palette = np.vstack([background, np.rint(background + (reacted - background) * levels),
+                                  ImageColor.getrgb('blue')]).astype(np.uint8)
+
+
+    def band_bins(self, band):
+        """
+        Rhombs of a band whose center is on the image.
+        band ... (int, int) first row and the row after the last one
+        returns (array, array) int64 flat indices of the rhombs and the bin of each of them
+        """
+        if self.bandBins is not None:
+            return self.bandBins
+        sites = visible_sites(self.geometry, self.latticeWidth, self.latticeHeight, self.imageSize, self.xOffset, self.yOffset, 0, band)
+        screenX, screenY = screen_positions(self.geometry.siteX[sites], self.geometry.siteY[sites], self.latticeWidth, self.latticeHeight, self.xOffset, self.yOffset)
+        inside = (screenX >= 0) & (screenX < self.imageSize[0]) & (screenY >= 0) & (screenY < self.imageSize[1])
+        bins = (screenY[inside] // self.binSize).astype(np.int64) * self.binsX + (screenX[inside] // self.binSize).astype(np.int64)
+        return sites[inside], bins
+
+
+    def render_indexed(self, reacted, highlighted=None):
+        """
+        Creates the palette indices of an image of a state of the lattice.
+        reacted ... array bool state of all sites, None draws all of them unreacted
+        highlighted ... array int flat indices of sites whose bins are drawn in blue, e.g. seeds
+        returns array[height, width] uint8 index into self.palette for every pixel
+        """
+        reactedPerBin = np.zeros(self.binCount)
+        highlightedBins = []
+        # an unreacted lattice without highlights needs no rhomb at all
+        for band in self.bands if reacted is not None or highlighted is not None else []:
+            sites, bins = self.band_bins(band)
+            if reacted is not None:
+                reactedPerBin += np.bincount(bins, weights=np.asarray(reacted[sites], dtype=np.float64), minlength=self.binCount)
+            if highlighted is not None:
+                highlightedBins.append(bins[np.isin(sites, np.asarray(highlighted, dtype=np.int64))])
+        conversion = reactedPerBin / np.maximum(self.sitesPerBin, 1)
+        state = (1 + np.rint(conversion * (DENSITYLEVELS - 1))).astype(np.uint8)
+        state[self.sitesPerBin == 0] = 0
+        for bins in highlightedBins:
+            state[bins] = DENSITYLEVELS + 1
+        return state[self.pixelBins]
+
+
+    def render(self, reacted, highlighted=None):
+        """
+        Creates an image of a state of the lattice.
+        reacted ... array bool state of all sites, None draws all of them unreacted
+        highlighted ... array int flat indices of sites whose bins are drawn in blue, e.g. seeds
+        returns PIL.Image image of the state
+        """
+        from PIL import Image
+        return Image.fromarray(self.palette[self.render_indexed(reacted, highlighted)], 'RGB')
+
+
+    def to_image(self, indices):
+        """
+        Turns palette indices into a compact palette image.
+        indices ... array[height, width] uint8 result of render_indexed
+        returns PIL.Image image in P mode
+        """
+        from PIL import Image
+        image = Image.fromarray(indices, 'P')
+        image.putpalette(self.palette.reshape(-1).tolist())
+        return image
+
+
+def make_renderer(geometry, latticeWidth, latticeHeight, imageSize, xOffset, yOffset, reactedColor='red', backgroundColor='white'):
+    """
+    Renderer with the level of detail which fits the size of the rhombs.
+    see LabelMapRenderer for the arguments
+    returns LabelMapRenderer or DensityRenderer rhombs with outline, or the local conversion below DENSITYTHRESHOLD pixels per rhomb
+    """
+    if pixels_per_rhomb(latticeWidth) < DENSITYTHRESHOLD:
+        return DensityRenderer(geometry, latticeWidth, latticeHeight, imageSize, xOffset, yOffset, reactedColor, backgroundColor)
+    return LabelMapRenderer(geometry, latticeWidth, latticeHeight, imageSize, xOffset, yOffset, reactedColor, backgroundColor)
+
+
+def viewport_offsets(center, latticeWidth, imageSize):
+    """
+    Shift which puts a lattice point into the center of the image, e.g. to zoom into a part of a large lattice.
+    center ... (int, int) kagome coordinates of the lattice point
+    latticeWidth ... width of the rhombs in pixel
+    imageSize ... (int, int) dimension of the image
+    returns (int, int) shift of the tiling to the left and to the top in pixel
+    """
+    x, y = kag_to_screen(center[0], center[1], latticeWidth, lattice_height(latticeWidth), 0, 0)
+    return (int(x - imageSize[0] / 2), int(y - imageSize[1] / 2))
+
+
+def render_viewport(geometry, reacted, center, latticeWidth, imageSize, highlighted=None, reactedColor='red'):
+    """
+    Image of a part of a lattice at any zoom. Only the rhombs in view are rasterized or counted, so it is cheap also for huge lattices.
+    geometry ... lattice.Lattice geometry of the lattice
+    reacted ... array bool state of all sites
+    center ... (int, int) kagome coordinates of the lattice point in the center of the image
+    latticeWidth ... width of the rhombs in pixel, the zoom of the view
+    imageSize ... (int, int) dimension of the image
+    highlighted ... array int flat indices of sites which are drawn in blue, e.g. seeds
+    reactedColor ... str or (int, int, int) color of reacted rhombs
+    returns PIL.Image image of the state
+    """
+    xOffset, yOffset = viewport_offsets(center, latticeWidth, imageSize)
+    return make_renderer(geometry, latticeWidth, lattice_height(latticeWidth), tuple(imageSize), xOffset, yOffset, reactedColor).render(reacted, highlighted)
+
+
+def frame_renderer(latticePointsX, latticePointsY, latticeWidth, imageSize, center=None):
+    """
+    Renderer for a lattice without a Kagome object, built once per process and geometry.
+    latticePointsX ... int lattice points in x direction
+    latticePointsY ... int lattice points in y direction
+    latticeWidth ... width of the rhombs in pixel
+    imageSize ... (int, int) dimension of the images
+    center ... (int, int) kagome coordinates of the lattice point in the center of the images, None centers the whole tiling
+    returns LabelMapRenderer or DensityRenderer renderer with the same geometry as Kagome.kag_to_screen, see make_renderer
+    """
+    key = (latticePointsX, latticePointsY, latticeWidth, tuple(imageSize), None if center is None else tuple(center))
+    if key not in RENDERERS:
+        if center is None:
+            xOffset, yOffset = image_offsets(latticePointsX, latticePointsY, latticeWidth, imageSize)
+        else:
+            xOffset, yOffset = viewport_offsets(center, latticeWidth, imageSize)
+        RENDERERS[key] = make_renderer(lattice.Lattice(latticePointsX, latticePointsY), latticeWidth, lattice_height(latticeWidth), tuple(imageSize), xOffset, yOffset)
+    return RENDERERS[key]
+
+
+def render_chunk(trajectoryFile, cycles, latticeWidth, imageSize, outputFolder, keepFrames, compressLevel, center=None):
+    """
+    Renders the frames of some cycles of a recorded run, the state is advanced from frame to frame.
+    trajectoryFile ... str path of the event log
+    cycles ... array int sorted Monte Carlo cycles of the frames
+    latticeWidth ... width of the rhombs in pixel
+    imageSize ... (int, int) dimension of the images
+    outputFolder ... str folder for PNG files, None does not write them
+    keepFrames ... bool return the frames
+    compressLevel ... int zlib compression level of the PNG files
+    center ... (int, int) kagome coordinates of the lattice point in the center of the frames, None shows the whole tiling
+    returns array of array[height, width] uint8 palette indices of the frames if keepFrames is set
+    """
+    recorded = trajectory.Trajectory(trajectoryFile)
+    frameRenderer = frame_renderer(recorded.latticePointsX, recorded.latticePointsY, latticeWidth, imageSize, center)
+    reacted = recorded.state_at(cycles[0] - 1)
+    done = recorded.events_until(cycles[0] - 1)
+    frames = []
+    for cycle in cycles:
+        until = recorded.events_until(cycle)
+        recorded.apply(reacted, done, until)
+        done = until
+        indices = frameRenderer.render_indexed(reacted)
+        if outputFolder is not None:
+            frameRenderer.to_image(indices).save(os.path.join(outputFolder, "%i.png" % cycle), compress_level=compressLevel)
+        if keepFrames:
+            frames.append(indices)
+    return frames
+
+
+def render_trajectory(trajectoryFile, cycles, latticeWidth, imageSize, outputFolder=None, movieFile=None, frameDuration=100, processes=None, compressLevel=6, center=None):
+    """
+    Renders frames of a recorded run at arbitrary cycles, split across a process pool.
+    trajectoryFile ... str path of an event log written by Kagome.model2DPropagation
+    cycles ... array int Monte Carlo cycles of the frames
+    latticeWidth ... width of the rhombs in pixel
+    imageSize ... (int, int) dimension of the images
+    outputFolder ... str folder in which one PNG per frame is saved, None skips them
+    movieFile ... str path of an animated GIF, PNG or WEBP file with all frames, None skips it
+    frameDuration ... int display time of each frame of the movie in milliseconds
+    processes ... int number of worker processes, None uses all cores, 1 renders everything in this process
+    compressLevel ... int zlib compression level of the PNG files
+    center ... (int, int) kagome coordinates of the lattice point in the center of the frames, e.g. to zoom into a large lattice, None shows the whole tiling
+    """
+    cycles = np.unique(np.asarray(cycles, dtype=np.int64))
+    if outputFolder is not None and not os.path.exists(outputFolder):
+        os.makedirs(outputFolder)
+    workers = processes if processes is not None else (os.cpu_count() or 1)
+    # several chunks per worker balance the load, each chunk replays the events from its first frame on
+    chunks = [chunk for chunk in np.array_split(cycles, max(1, min(len(cycles), workers * 4))) if len(chunk) > 0]
+    tasks = [(trajectoryFile, chunk, latticeWidth, imageSize, outputFolder, movieFile is not None, compressLevel, center) for chunk in chunks]
+    if workers == 1:
+        results = [render_chunk(*task) for task in tasks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(render_chunk, *zip(*tasks)))
+
+    if movieFile is not None:
+        # palette frames keep the memory of long movies small
+        recorded = trajectory.Trajectory(trajectoryFile)
+        frameRenderer = frame_renderer(recorded.latticePointsX, recorded.latticePointsY, latticeWidth, imageSize, center)
+        images = [frameRenderer.to_image(frame) for result in results for frame in result]
+        images[0].save(movieFile, save_all=True, append_images=images[1:], duration=frameDuration, loop=0)
@@ -62,6 +62,90 @@ class Rhomb():
         self.neighbors[0] = self.fn
 
 
+class RhombView():
+    """
+    Lightweight view on a single site of a Kagome lattice.
+    It offers the same attributes as Rhomb but reads and writes the arrays of the lattice it belongs to.
+    """
+
+    def __init__(self, kagome, index):
+        """
+        Constructor
+        kagome ... Kagome lattice which holds the state of the site
+        index ... int flat site index
+        """
+        self.kagome = kagome
+        self.index = int(index)
+        self.x, self.y = kagome.geometry.coordinates(self.index)
+        self.identifier = [(self.x, self.y)]
+
+
+    @property
+    def reacted(self):
+        return bool(self.kagome.reacted[self.index])
+
+
+    @reacted.setter
+    def reacted(self, value):
+        self.kagome.set_reacted(self.index, value)
+
+
+    @property
+    def fn(self):
+        return self.to_tuples(self.kagome.geometry.firstNeighbors[self.index])
+
+
+    @property
+    def neighbors(self):
+        neighbors = np.empty(10, dtype=object)
+        for order in range(1, len(self.kagome.shells) + 1):
+            neighbors[order - 1] = self.to_tuples(self.kagome.shells.shell(order, self.index))
+        return neighbors
+
+
+    def to_tuples(self, indices):
+        """
+        Turns flat site indices into an array of lattice coordinates.
+        indices ... array int flat site indices
+        returns array of tuples (x, y) of the lattice coordinates
+        """
+        tuples = np.empty(len(indices), dtype=object)
+        for i in range(len(indices)):
+            tuples[i] = self.kagome.geometry.coordinates(indices[i])
+        return tuples
+
+
+class RhombRows():
+    """
+    Row wise access to the sites of a Kagome lattice with lattice[y][x] returning a RhombView.
+    """
+
+    def __init__(self, kagome, y=None):
+        """
+        Constructor
+        kagome ... Kagome lattice which holds the state of the sites
+        y ... int row of the lattice, None gives access to all rows
+        """
+        self.kagome = kagome
+        self.y = y
+
+
+    def __len__(self):
+        if self.y is None:
+            return self.kagome.geometry.latticePointsY
+        return int(self.kagome.geometry.rowLength[self.y])
+
+
+    def __getitem__(self, i):
+        if self.y is None:
+            if not -len(self) <= i < len(self):
+                raise IndexError("row %i is out of range" % i)
+            return RhombRows(self.kagome, i % len(self))
+        if not -len(self) <= i < len(self):
+            raise IndexError("lattice point %i is out of range" % i)
+        return RhombView(self.kagome, self.kagome.geometry.index(i, self.y))
+
+
 def lying(x, y, latticeWidth, latticeHeight):
     """
     Vertex coordinates for a lying rhomb.
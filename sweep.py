@@ -0,0 +1,166 @@
+import kagome_lattice
+import lattice
+import ensemble
+import os
+import json
+import hashlib
+import itertools
+import contextlib
+import concurrent.futures
+import numpy as np
+
+# lattice geometries of the current process by (latticePointsX, latticePointsY), shared by all points of a sweep
+GEOMETRIES = {}
+
+def parameter_grid(grid):
+    """
+    Expands a parameter grid into all of its points.
+    grid ... dict parameter name -> array of values
+    returns array of dict all combinations of the values, in a fixed order
+    """
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+def point_key(point):
+    """
+    Identifies a point of a sweep.
+    point ... dict parameters of the point
+    returns str canonical json representation of the parameters
+    """
+    return json.dumps(point, sort_keys=True)
+
+
+def point_seed(masterSeed, point):
+    """
+    Derives the random stream of a point from the seed of the sweep, the stream does not depend on the order in which points are run.
+    masterSeed ... int seed of the whole sweep
+    point ... dict parameters of the point
+    returns numpy.random.SeedSequence seed of the point
+    """
+    digest = hashlib.sha256(point_key(point).encode()).digest()
+    return np.random.SeedSequence([masterSeed, int.from_bytes(digest[:8], 'little')])
+
+
+def get_geometry(latticePoints, maxNeighborOrder, neighborCache):
+    """
+    Lattice geometry with neighbor shells, built once per process and dimensions.
+    latticePoints ... (int, int) lattice points in x and y direction
+    maxNeighborOrder ... int highest order of neighbors which is required
+    neighborCache ... str folder of the neighbor shell cache
+    returns lattice.Lattice the shared geometry
+    """
+    # same rounding as in Kagome
+    key = (latticePoints[0] + latticePoints[0] % 2, latticePoints[1] + latticePoints[1] % 2)
+    if key not in GEOMETRIES:
+        GEOMETRIES[key] = lattice.Lattice(*key)
+    geometry = GEOMETRIES[key]
+    lattice.build_neighbor_shells(geometry, geometry.shells, maxNeighborOrder, neighborCache)
+    return geometry
+
+
+def run_point(point, ruleFactory, MCcycleMax, seeds, sampleCycle, mode, replicas, seed, neighborCache):
+    """
+    Runs all replicas of a single point of a sweep in this process.
+    point ... dict parameters of the point, latticePoints gives the dimensions of the lattice
+    ruleFactory ... function which turns the parameters of a point into an array of ReactivityModifier
+    MCcycleMax ... int or float stop criterion, see Kagome.model2DPropagation
+    seeds ... int number of randomly created seeds in each run
+    sampleCycle ... int number of Monte Carlo cycles between two samples of the conversion
+    mode ... str simulation mode, see Kagome.model2DPropagation
+    replicas ... int number of independent runs of the point
+    seed ... numpy.random.SeedSequence seed of the point
+    neighborCache ... str folder of the neighbor shell cache
+    returns dict result record of the point
+    """
+    reactivityModifiers = ruleFactory(point)
+    maxNeighborOrder = max([modifier.neighborOrder for modifier in reactivityModifiers] + [1])
+    geometry = get_geometry(point["latticePoints"], maxNeighborOrder, neighborCache)
+    curves = []
+    for replicaSeed in seed.spawn(replicas):
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            kagome = kagome_lattice.Kagome(1, point["latticePoints"], (1, 1), None, neighborCache=neighborCache, seed=replicaSeed, geometry=geometry)
+            kagome.model2DPropagation(reactivityModifiers, MCcycleMax, seeds, sampleCycle, mode)
+        curves.append(np.array(kagome.conversionHistory))
+    lastCycle = max(curve[-1, 0] for curve in curves)
+    grid = np.arange(0, lastCycle + sampleCycle, sampleCycle, dtype=np.int64)
+    conversions = np.array([ensemble.on_grid(curve[:, 0], curve[:, 1], grid) for curve in curves])
+    return {"key": point_key(point),
+            "point": point,
+            "cycles": grid.tolist(),
+            "conversion": conversions.tolist(),
+            "finalConversion": float(np.mean([curve[-1, 1] for curve in curves])),
+            "finalCycle": float(np.mean([curve[-1, 0] for curve in curves]))}
+
+
+def read_results(resultsFile):
+    """
+    Reads all finished points from a results file, an incomplete last line of an interrupted sweep is ignored.
+    resultsFile ... str path of the json lines file
+    returns dict key -> result record
+    """
+    results = {}
+    if os.path.exists(resultsFile):
+        with open(resultsFile) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                results[record["key"]] = record
+    return results
+
+
+def run_sweep(grid, ruleFactory, MCcycleMax, resultsFile, masterSeed, seeds=0, sampleCycle=100, mode="sequential", replicas=1, processes=None, neighborCache=lattice.CACHEFOLDER):
+    """
+    Runs all points of a parameter grid and records every finished point in a results file.
+    Points which are already in the results file are skipped, so an interrupted sweep continues where it stopped.
+    grid ... dict parameter name -> array of values, must contain latticePoints with (int, int) lattice dimensions
+    ruleFactory ... function which turns the parameters of a point into an array of ReactivityModifier, must be defined at module level
+    MCcycleMax ... int or float stop criterion, see Kagome.model2DPropagation
+    resultsFile ... str path of the json lines file which stores the results
+    masterSeed ... int seed from which the random streams of all points are derived
+    seeds ... int number of randomly created seeds in each run
+    sampleCycle ... int number of Monte Carlo cycles between two samples of the conversion
+    mode ... str simulation mode, see Kagome.model2DPropagation
+    replicas ... int number of independent runs per point
+    processes ... int number of worker processes, None uses all cores, 1 runs everything in this process
+    neighborCache ... str folder of the neighbor shell cache
+    returns array of dict result records of all points of the grid
+    """
+    results = read_results(resultsFile)
+    points = [point for point in parameter_grid(grid) if point_key(point) not in results]
+    # points with the same dimensions follow each other, so workers can reuse their geometry
+    points.sort(key=lambda point: tuple(point["latticePoints"]))
+    print("%i of %i points left" % (len(points), len(points) + len(results)))
+
+    # an interrupted write leaves an incomplete line behind, new records start on a fresh line
+    incompleteLine = False
+    if os.path.exists(resultsFile) and os.path.getsize(resultsFile) > 0:
+        with open(resultsFile, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            incompleteLine = f.read(1) != b"\n"
+
+    with open(resultsFile, 'a') as f:
+        if incompleteLine:
+            f.write("\n")
+        def record(result):
+            results[result["key"]] = result
+            f.write(json.dumps(result) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+        tasks = [(point, ruleFactory, MCcycleMax, seeds, sampleCycle, mode, replicas, point_seed(masterSeed, point), neighborCache) for point in points]
+        if processes == 1:
+            for task in tasks:
+                record(run_point(*task))
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as pool:
+                futures = [pool.submit(run_point, *task) for task in tasks]
+                try:
+                    for future in concurrent.futures.as_completed(futures):
+                        record(future.result())
+                except BaseException:
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    raise
+    return [results[point_key(point)] for point in parameter_grid(grid)]
@@ -0,0 +1,207 @@
+import os
+import numpy as np
+
+# file layout: MAGIC, latticePointsX, latticePointsY and number of sites as int64, followed by the event records
+MAGIC = b"AODTRJ01"
+HEADER = np.dtype([('magic', 'S8'), ('latticePointsX', '<i8'), ('latticePointsY', '<i8'), ('siteCount', '<i8')])
+# a single reaction, seeds have the cycle -1 and back reactions the complement ~site of their site
+EVENT = np.dtype([('cycle', '<i8'), ('site', '<i4')])
+
+class EventLog():
+    """
+    Append-only binary log of all reactions of a run as (cycle, site index) records, back reactions are recorded as (cycle, ~site index).
+    Records are buffered and written in blocks, the file can be read at any time with Trajectory.
+    """
+
+    def __init__(self, fileName, geometry, bufferSize=65536, resume=False):
+        """
+        Constructor
+        fileName ... str path of the log, an existing file is replaced unless the run resumes
+        geometry ... lattice.Lattice geometry of the simulated lattice
+        bufferSize ... int number of events which are collected before they are written
+        resume ... bool continue the existing log of the same geometry, see truncate for dropping the events after a checkpoint
+        """
+        self.fileName = fileName
+        if resume:
+            if not os.path.exists(fileName) or os.path.getsize(fileName) < HEADER.itemsize:
+                raise ValueError("%s is not an event log which can be continued" % fileName)
+            header = np.fromfile(fileName, dtype=HEADER, count=1)[0]
+            if header['magic'] != MAGIC or (header['latticePointsX'], header['latticePointsY']) != (geometry.latticePointsX, geometry.latticePointsY):
+                raise ValueError("%s is not an event log of a %ix%i lattice" % (fileName, geometry.latticePointsX, geometry.latticePointsY))
+            self.file = open(fileName, 'r+b')
+            # drop an incomplete record of an interrupted run
+            self.file.truncate(HEADER.itemsize + (os.path.getsize(fileName) - HEADER.itemsize) // EVENT.itemsize * EVENT.itemsize)
+            self.file.seek(0, os.SEEK_END)
+        else:
+            # a new run never continues the events of an earlier one
+            self.file = open(fileName, 'wb')
+            header = np.array([(MAGIC, geometry.latticePointsX, geometry.latticePointsY, len(geometry))], dtype=HEADER)
+            self.file.write(header.tobytes())
+        self.buffer = np.empty(bufferSize, dtype=EVENT)
+        self.buffered = 0
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+
+    def record(self, cycle, site):
+        """
+        Adds a single reaction.
+        cycle ... int Monte Carlo cycle of the reaction
+        site ... int flat index of the reacted site, ~index for a back reaction
+        """
+        self.buffer[self.buffered] = (cycle, site)
+        self.buffered += 1
+        if self.buffered == len(self.buffer):
+            self.flush()
+
+
+    def record_many(self, cycle, sites):
+        """
+        Adds many reactions of the same cycle or each with its own cycle.
+        cycle ... int or array int Monte Carlo cycle of the reactions
+        sites ... array int flat indices of the reacted sites, ~index for back reactions
+        """
+        self.flush()
+        events = np.empty(len(sites), dtype=EVENT)
+        events['cycle'] = cycle
+        events['site'] = sites
+        self.file.write(events.tobytes())
+
+
+    def position(self):
+        """
+        Writes all buffered events to the file.
+        returns int number of events in the file
+        """
+        self.flush()
+        return (self.file.tell() - HEADER.itemsize) // EVENT.itemsize
+
+
+    def truncate(self, eventCount):
+        """
+        Drops all events after a given number, e.g. the ones recorded after the checkpoint from which a run continues.
+        eventCount ... int number of events which are kept
+        """
+        if eventCount > self.position():
+            raise ValueError("%s holds %i events instead of at least %i" % (self.fileName, self.position(), eventCount))
+        self.file.truncate(HEADER.itemsize + eventCount * EVENT.itemsize)
+        self.file.seek(0, os.SEEK_END)
+
+
+    def flush(self):
+        """
+        Writes all buffered events to the file.
+        """
+        if self.buffered > 0:
+            self.file.write(self.buffer[:self.buffered].tobytes())
+            self.buffered = 0
+        self.file.flush()
+
+
+    def close(self):
+        """
+        Writes all buffered events and closes the file.
+        """
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+
+class Trajectory():
+    """
+    Read access to an event log through a memory map. Any state of the run can be rebuilt from it without rerunning the simulation.
+    """
+
+    def __init__(self, fileName):
+        """
+        Constructor
+        fileName ... str path of the event log
+        """
+        header = np.fromfile(fileName, dtype=HEADER, count=1)
+        if len(header) == 0 or header[0]['magic'] != MAGIC:
+            raise ValueError("%s is not an event log" % fileName)
+        self.fileName = fileName
+        self.latticePointsX = int(header[0]['latticePointsX'])
+        self.latticePointsY = int(header[0]['latticePointsY'])
+        self.siteCount = int(header[0]['siteCount'])
+        # a log which is still written can end with an incomplete record
+        eventCount = (os.path.getsize(fileName) - HEADER.itemsize) // EVENT.itemsize
+        if eventCount > 0:
+            self.events = np.memmap(fileName, dtype=EVENT, mode='r', offset=HEADER.itemsize, shape=(eventCount,))
+        else:
+            self.events = np.empty(0, dtype=EVENT)
+        self.cycles = self.events['cycle']
+        self.sites = self.events['site']
+
+
+    def __len__(self):
+        """
+        returns int number of recorded events
+        """
+        return len(self.events)
+
+
+    def last_cycle(self):
+        """
+        returns int Monte Carlo cycle of the last recorded event
+        """
+        return int(self.cycles[-1]) if len(self) > 0 else -1
+
+
+    def events_until(self, cycle):
+        """
+        Number of events up to and including a cycle.
+        cycle ... int or array Monte Carlo cycle
+        returns int or array number of events
+        """
+        return np.searchsorted(self.cycles, cycle, side='right')
+
+
+    def state_at(self, cycle):
+        """
+        Rebuilds the state of the lattice after a given Monte Carlo cycle.
+        cycle ... int Monte Carlo cycle, -1 gives the state after the seeds
+        returns array bool state of all sites
+        """
+        return self.apply(np.zeros(self.siteCount, dtype=bool), 0, self.events_until(cycle))
+
+
+    def apply(self, reacted, start, stop):
+        """
+        Replays a range of events on a state.
+        reacted ... array bool state before the first of the events, it is changed in place
+        start ... int index of the first event
+        stop ... int index after the last event
+        returns array bool the state after the events
+        """
+        sites = np.asarray(self.sites[start:stop])
+        back = sites < 0
+        if not back.any():
+            reacted[sites] = True
+            return reacted
+        # the last event of a site decides its state
+        targets = np.where(back, ~sites, sites)
+        last = len(targets) - 1 - np.unique(targets[::-1], return_index=True)[1]
+        reacted[targets[last]] = ~back[last]
+        return reacted
+
+
+    def conversion(self, cycles):
+        """
+        Conversion at arbitrary Monte Carlo cycles.
+        cycles ... array int Monte Carlo cycles
+        returns array float conversion after each of the cycles
+        """
+        eventCounts = self.events_until(np.asarray(cycles))
+        back = self.sites < 0
+        if not back.any():
+            return eventCounts / self.siteCount
+        # back reactions lower the number of reacted sites
+        reactedCounts = np.concatenate([[0], np.cumsum(np.where(back, -1, 1))])
+        return reactedCounts[eventCounts] / self.siteCount
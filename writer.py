@@ -0,0 +1,92 @@
+import queue
+import threading
+
+class SnapshotWriter():
+    """
+    Renders and writes images in a background thread so that the simulation does not wait for PNG encoding and disk access.
+    Images are written in the order they were submitted. At most maxPending images wait for the writer,
+    further submissions block until there is room again.
+    """
+
+    def __init__(self, maxPending=4, compressLevel=6):
+        """
+        Constructor
+        maxPending ... int number of images which may wait for the writer before submit blocks
+        compressLevel ... int zlib compression level of the PNG files from 0 (fast, large) to 9 (slow, small)
+        """
+        self.compressLevel = compressLevel
+        self.pending = queue.Queue(maxsize=max(1, maxPending))
+        self.error = None
+        self.written = 0 # number of images which have been written
+        self.thread = threading.Thread(target=self.work, name="SnapshotWriter", daemon=True)
+        self.thread.start()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, excType, excValue, traceback):
+        # do not hide an exception of the simulation behind one of the writer
+        self.close(raiseError=excType is None)
+
+
+    def work(self):
+        """
+        Loop of the background thread, renders and saves the images one after the other.
+        """
+        while True:
+            job = self.pending.get()
+            try:
+                if job is None:
+                    return
+                if self.error is None:
+                    fileName, render, args = job
+                    render(*args).save(fileName, compress_level=self.compressLevel)
+                    self.written += 1
+            except Exception as e:
+                self.error = e
+            finally:
+                self.pending.task_done()
+
+
+    def check(self):
+        """
+        Raises the first error of the background thread.
+        """
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+
+    def submit(self, fileName, render, *args):
+        """
+        Queues an image, blocks while too many images are waiting.
+        fileName ... str path of the PNG file
+        render ... function which returns a PIL image, called in the background thread with args
+        args ... arguments of render, they must not be changed afterwards, i.e. pass copies of the state
+        """
+        self.check()
+        if not self.thread.is_alive():
+            raise RuntimeError("The snapshot writer has been closed")
+        self.pending.put((fileName, render, args))
+
+
+    def flush(self):
+        """
+        Waits until all queued images are written.
+        """
+        self.pending.join()
+        self.check()
+
+
+    def close(self, raiseError=True):
+        """
+        Writes all queued images and stops the background thread.
+        raiseError ... bool raise errors of the background thread
+        """
+        if self.thread.is_alive():
+            self.pending.put(None)
+            self.thread.join()
+        if raiseError:
+            self.check()